@@ -25,6 +25,8 @@ export class LambdaStack extends Stack {
       'OVERWRITE_OUTGOING_EMAILS': '',
       'STAGE': stage,
       'API_BASE_URL': api_base_url,
+      'TEMPLATE_BYTECODE_CACHE_DIR': '/tmp/amy-email-worker/jinja2',
+      'ATTACHMENT_CACHE_DIR': '/tmp/amy-email-worker/attachments',
     };
 
     if (stage != 'production') {
@@ -56,7 +58,7 @@ export class LambdaStack extends Stack {
     );
     executionRole.addToPolicy(new PolicyStatement({
       resources: ['*'],
-      actions: ['ssm:GetParameter'],
+      actions: ['ssm:GetParameter', 'ssm:GetParameters'],
     }));
 
     // If this doesn't work, use Bucket.fromBucketName() and bucket.grantRead(executionRole)
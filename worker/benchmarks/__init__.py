@@ -0,0 +1,15 @@
+"""
+Microbenchmarks for individual stages of email processing.
+
+Run from the `worker` directory, e.g. `python -m benchmarks.markdown_stage`.
+"""
+
+import timeit
+from typing import Callable
+
+
+def measure(label: str, func: Callable[[], object], *, number: int = 1000, repeat: int = 5) -> float:
+    """Print and return the best mean time (in seconds) of a single `func` call."""
+    per_call = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print(f"{label:<60} {per_call * 1e6:10.1f} us/call")
+    return per_call
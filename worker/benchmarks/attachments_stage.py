@@ -0,0 +1,112 @@
+"""
+Attachments stage: downloading email attachments from (local stand-in of) S3.
+
+Compares sequential, blocking downloads with `AttachmentFetcher`, and reports the
+longest time the event loop was unable to run other tasks and peak memory allocated
+while downloading. Every email carries the same certificate template plus its own
+attachments; the fetcher downloads the shared one once.
+"""
+
+import asyncio
+from io import BytesIO
+import time
+import tracemalloc
+from typing import Awaitable, Callable
+from unittest.mock import patch
+
+from benchmarks.local_s3 import LocalS3Client
+from src.attachments import AttachmentCache, AttachmentFetcher
+from src.aws import download_s3_fileobj
+from src.types import Attachment, AttachmentWithContent
+
+BUCKET = "local-bucket"
+EMAILS = 10
+ATTACHMENTS_PER_EMAIL = 3
+LATENCY = 0.02
+
+
+async def event_loop_lag(done: asyncio.Event) -> float:
+    """Measure the longest delay of a 1ms sleep until `done` is set."""
+    max_lag = 0.0
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        max_lag = max(max_lag, time.perf_counter() - start - 0.001)
+    return max_lag
+
+
+def attachment(path: str) -> Attachment:
+    return Attachment(filename=path, s3_path=path, s3_bucket=BUCKET, presigned_url="", presigned_url_expiration=None)
+
+
+async def run(label: str, download: Callable[[list[Attachment]], Awaitable[object]], s3: LocalS3Client) -> None:
+    emails = [
+        [attachment("attachments/shared.pdf")]
+        + [attachment(f"attachments/{i}-{j}.pdf") for j in range(1, ATTACHMENTS_PER_EMAIL)]
+        for i in range(EMAILS)
+    ]
+    s3.requests = 0
+    done = asyncio.Event()
+    lag_task = asyncio.create_task(event_loop_lag(done))
+    await asyncio.sleep(0)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*[download(attachments) for attachments in emails])
+    elapsed = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    done.set()
+    max_lag = await lag_task
+    print(
+        f"{label:<40} {elapsed * 1e3:8.1f} ms total, {max_lag * 1e3:8.1f} ms max event loop lag, "
+        f"{s3.requests:4} S3 requests, {peak_memory / 1024 / 1024:6.1f} MiB peak memory"
+    )
+
+
+async def sequential(attachments: list[Attachment]) -> object:
+    """Blocking downloads into memory, as done before `AttachmentFetcher`."""
+    contents = []
+    for attachment in attachments:
+        buffer = BytesIO()
+        download_s3_fileobj(BUCKET, attachment.s3_path, buffer)
+        contents.append(AttachmentWithContent(filename=attachment.filename, content=buffer.read()))
+    return contents
+
+
+def fetch_and_close(fetcher: AttachmentFetcher) -> Callable[[list[Attachment]], Awaitable[object]]:
+    async def fetch(attachments: list[Attachment]) -> object:
+        results = await fetcher.fetch_all(attachments)
+        for result in results:
+            result.close()
+        return results
+
+    return fetch
+
+
+def main() -> None:
+    objects = {
+        (BUCKET, f"attachments/{i}-{j}.pdf"): b"%PDF" * 64 * 1024
+        for i in range(EMAILS)
+        for j in range(1, ATTACHMENTS_PER_EMAIL)
+    }
+    objects[(BUCKET, "attachments/shared.pdf")] = b"%PDF" * 64 * 1024
+    s3 = LocalS3Client(objects, latency=LATENCY)
+
+    print(f"{EMAILS} emails x {ATTACHMENTS_PER_EMAIL} attachments, {LATENCY * 1e3:.0f} ms S3 latency")
+    with (
+        patch("src.aws.get_s3_client", return_value=s3),
+        patch("src.attachments.read_s3_bucket_from_ssm", return_value=BUCKET),
+    ):
+        asyncio.run(run("sequential, blocking downloads", sequential, s3))
+
+        fetcher = AttachmentFetcher(
+            max_workers=8, cache=AttachmentCache(max_memory_bytes=16 * 1024 * 1024), info_ttl=60
+        )
+        asyncio.run(run("AttachmentFetcher (8 threads)", fetch_and_close(fetcher), s3))
+        asyncio.run(run("AttachmentFetcher, warm cache", fetch_and_close(fetcher), s3))
+
+
+if __name__ == "__main__":
+    main()
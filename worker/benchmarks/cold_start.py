@@ -0,0 +1,159 @@
+"""
+Cold start: import cost of `main` per module, and time to the first handler call.
+
+Each measurement runs in a fresh interpreter. Import times come from
+`python -X importtime`. The handler is called once with an empty queue, served by
+a local stand-in for the AMY API, and with the local parameter store, so no AWS
+access is needed.
+
+Exits with status 1 when importing `main` exceeds `IMPORT_BUDGET_MS`, or imports
+any of `DEFERRED_MODULES`.
+"""
+
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+WORKER_DIR = Path(__file__).parent.parent
+
+# Cumulative import time of `main`; about 350 ms when the budget was set.
+IMPORT_BUDGET_MS = 750
+
+# Modules which an invocation with no emails to send doesn't need.
+DEFERRED_MODULES = [
+    "aws_lambda_powertools",
+    "boto3",
+    "jinja2",
+    "markdown",
+    "src.delivery",
+    "src.handler",
+    "src.rendering",
+]
+
+HANDLER_SCRIPT = """
+import http.server
+import json
+import threading
+import time
+
+class API(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        # a single, empty page of results
+        if self.path.endswith("page=1"):
+            self.reply(200, {"results": []})
+        else:
+            self.reply(404, {})
+
+    def do_POST(self):
+        self.reply(200, {"expiry": "2100-01-01T00:00:00Z", "token": "token"})
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+server = http.server.ThreadingHTTPServer(("127.0.0.1", PORT), API)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.handler({}, None)
+handled = time.perf_counter()
+print(json.dumps({"import": imported - start, "handler": handled - imported}))
+"""
+
+
+@dataclass(frozen=True)
+class ImportTime:
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(output: str) -> list[ImportTime]:
+    """Parse `-X importtime` output (stderr) into one entry per imported module."""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line.removeprefix("import time:").split("|")
+        entries.append(ImportTime(module.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure_imports(module: str = "main") -> list[ImportTime]:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=WORKER_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(process.stderr)
+
+
+def measure_handler(port: int = 8765, prewarm: bool = False) -> dict[str, float]:
+    """Time to import `main` and to complete the first handler call, in seconds.
+
+    With `prewarm`, import includes lambda init phase prewarming. `process` is the
+    wall time of the whole interpreter, including its startup."""
+    env = {
+        **os.environ,
+        "API_BASE_URL": f"http://127.0.0.1:{port}/api",
+        "PARAMETER_STORE": "local",
+        "DELIVERY_BACKEND": "null",
+        "PREWARM": str(prewarm).lower(),
+    }
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-c", HANDLER_SCRIPT.replace("PORT", str(port))],
+        cwd=WORKER_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings: dict[str, float] = json.loads(process.stdout.splitlines()[-1])
+    timings["process"] = time.perf_counter() - start
+    return timings
+
+
+def main() -> None:
+    imports = measure_imports()
+    by_module = {entry.module: entry for entry in imports}
+    total_ms = by_module["main"].cumulative_us / 1000
+
+    print("Slowest imports (cumulative):")
+    for entry in sorted(imports, key=lambda entry: entry.cumulative_us, reverse=True)[:15]:
+        print(f"  {entry.module:<50} {entry.cumulative_us / 1000:8.1f} ms  (self {entry.self_us / 1000:6.1f} ms)")
+
+    for prewarm in (False, True):
+        timings = measure_handler(prewarm=prewarm)
+        suffix = ", PREWARM" if prewarm else ""
+        print(f"{'import main' + suffix:<60} {timings['import'] * 1e3:10.1f} ms")
+        print(f"{'first handler call (empty queue)' + suffix:<60} {timings['handler'] * 1e3:10.1f} ms")
+        print(f"{'interpreter start to handler return' + suffix:<60} {timings['process'] * 1e3:10.1f} ms")
+
+    failed = False
+    if total_ms > IMPORT_BUDGET_MS:
+        print(f"Importing main took {total_ms:.1f} ms, budget is {IMPORT_BUDGET_MS} ms.")
+        failed = True
+    if imported := [module for module in DEFERRED_MODULES if module in by_module]:
+        print(f"Modules imported eagerly, but deferred on purpose: {imported}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
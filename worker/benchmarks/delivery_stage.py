@@ -0,0 +1,86 @@
+"""
+Delivery stage: sending rendered emails with each delivery backend.
+
+Mailgun is replaced with a local HTTP transport and SMTP with an in-process
+stand-in, so the numbers show per-backend overhead rather than network latency.
+"""
+
+import asyncio
+from datetime import UTC, datetime
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+from uuid import uuid4
+
+import httpx
+
+from src.delivery import (
+    DeliveryBackend,
+    FileSinkBackend,
+    MailgunBackend,
+    SMTPBackend,
+    SMTPConnectionPool,
+)
+from src.types import (
+    AttachmentWithContent,
+    MailgunCredentials,
+    RenderedScheduledEmail,
+    ScheduledEmailStatus,
+)
+
+EMAILS = 500
+
+
+def make_email() -> RenderedScheduledEmail:
+    now_ = datetime.now(tz=UTC)
+    return RenderedScheduledEmail(
+        pk=uuid4(),
+        created_at=now_,
+        last_updated_at=now_,
+        state=ScheduledEmailStatus.LOCKED,
+        scheduled_at=now_,
+        to_header=[],
+        to_header_context_json=[],
+        to_header_rendered=["jdoe@example.com"],
+        from_header="team@example.org",
+        reply_to_header="",
+        cc_header=[],
+        bcc_header=[],
+        subject="",
+        subject_rendered="Your certificate",
+        body="",
+        body_rendered="<p>Thank you for attending the workshop.</p>" * 20,
+        context_json={},
+        template=None,
+        attachments=[],
+        attachments_with_content=[AttachmentWithContent(filename="certificate.pdf", content=b"%PDF" * 25_000)],
+    )
+
+
+async def throughput(label: str, backend: DeliveryBackend) -> None:
+    emails = [make_email() for _ in range(EMAILS)]
+    start = time.perf_counter()
+    await asyncio.gather(*[backend.send(email) for email in emails])
+    elapsed = time.perf_counter() - start
+    print(f"{label:<60} {EMAILS / elapsed:10.1f} emails/s")
+
+
+async def main() -> None:
+    mailgun = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, json={})))
+    credentials = MailgunCredentials(MAILGUN_SENDER_DOMAIN="example.org", MAILGUN_API_KEY="key")
+    # Rate limiting would measure the limit rather than the backend.
+    with patch("src.email.get_mailgun_rate_limiter", return_value=None):
+        await throughput("Mailgun HTTP (local transport)", MailgunBackend(mailgun, credentials))
+    await mailgun.aclose()
+
+    with patch("src.delivery.smtplib.SMTP", return_value=MagicMock(send_message=MagicMock(return_value={}))):
+        pool = SMTPConnectionPool("localhost", 25, starttls=False, size=4)
+        await throughput("SMTP, pooled connections (in-process stand-in)", SMTPBackend(pool))
+
+    with tempfile.TemporaryDirectory() as directory:
+        await throughput("File sink", FileSinkBackend(directory))
+    await throughput("Null sink", FileSinkBackend())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
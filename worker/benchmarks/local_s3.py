@@ -0,0 +1,34 @@
+"""
+Local stand-in for the S3 client used by `src.aws`.
+"""
+
+import hashlib
+import time
+from typing import IO, Any
+
+
+class LocalS3Client:
+    """In-memory S3 with a fixed, simulated per-request latency."""
+
+    objects: dict[tuple[str, str], bytes]
+    latency: float
+    requests: int
+
+    def __init__(self, objects: dict[tuple[str, str], bytes], latency: float = 0.05) -> None:
+        self.objects = objects
+        self.latency = latency
+        self.requests = 0
+
+    def _get(self, bucket: str, key: str) -> bytes:
+        time.sleep(self.latency)
+        self.requests += 1
+        return self.objects[(bucket, key)]
+
+    def head_object(self, Bucket: str, Key: str) -> dict[str, Any]:
+        content = self._get(Bucket, Key)
+        return {"ETag": f'"{hashlib.md5(content).hexdigest()}"', "ContentLength": len(content)}
+
+    def download_fileobj(
+        self, Bucket: str, Key: str, Fileobj: IO[bytes], ExtraArgs: dict[str, Any] | None = None
+    ) -> None:
+        Fileobj.write(self._get(Bucket, Key))
@@ -0,0 +1,41 @@
+"""
+Markdown stage: converting a rendered email body into HTML.
+"""
+
+from itertools import count
+
+import markdown
+
+from benchmarks import measure
+from src.rendering import MarkdownConverter
+
+BODY = """
+Hi John Doe,
+
+Thank you for attending **Software Carpentry workshop** on 2024-05-01.
+Please find your certificate attached.
+
+## Next steps
+
+* fill out the [post-workshop survey](https://example.org/survey),
+* join our [community calls](https://example.org/calls),
+* consider becoming an instructor.
+
+Best regards,
+The Carpentries Team
+"""
+
+
+def main() -> None:
+    measure("markdown.markdown() per email", lambda: markdown.markdown(BODY))
+
+    pooled = MarkdownConverter(cache_size=0)
+    distinct = count()
+    measure("MarkdownConverter, distinct bodies", lambda: pooled.convert(f"{BODY}{next(distinct)}"))
+
+    cached = MarkdownConverter(cache_size=256)
+    measure("MarkdownConverter, identical bodies (memoized)", lambda: cached.convert(BODY))
+
+
+if __name__ == "__main__":
+    main()
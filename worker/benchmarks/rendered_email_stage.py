@@ -0,0 +1,100 @@
+"""
+Rendered email stage: constructing `RenderedScheduledEmail` from a validated email.
+
+Compares dumping the email and validating it again with sharing its field values,
+by CPU time and by memory allocated per email.
+"""
+
+from datetime import UTC, datetime
+import tracemalloc
+from typing import Callable
+from uuid import uuid4
+
+from benchmarks import measure
+from benchmarks.markdown_stage import BODY
+from src.types import (
+    Attachment,
+    RenderedScheduledEmail,
+    ScheduledEmail,
+    ScheduledEmailStatus,
+)
+
+EMAILS = 1000
+
+
+def make_email() -> ScheduledEmail:
+    now_ = datetime.now(tz=UTC)
+    return ScheduledEmail(
+        pk=uuid4(),
+        created_at=now_,
+        last_updated_at=now_,
+        state=ScheduledEmailStatus.LOCKED,
+        scheduled_at=now_,
+        to_header=[],
+        to_header_context_json=[{"api_uri": "api:person#1", "property": "email"}],
+        from_header="team@carpentries.org",
+        reply_to_header="",
+        cc_header=[],
+        bcc_header=[],
+        subject="Your certificate for {{ event.slug }}",
+        body=BODY * 10,
+        context_json={f"key{i}": f"api:person#{i}" for i in range(20)},
+        template="Certificate",
+        attachments=[
+            Attachment(
+                filename=f"attachment{i}.pdf",
+                s3_path=f"attachments/attachment{i}.pdf",
+                s3_bucket="bucket",
+                presigned_url=f"https://bucket.s3.amazonaws.com/attachments/attachment{i}.pdf?signature=abc",
+                presigned_url_expiration=now_,
+            )
+            for i in range(3)
+        ],
+    )
+
+
+def dump_and_validate(email: ScheduledEmail) -> RenderedScheduledEmail:
+    return RenderedScheduledEmail(
+        **email.model_dump(),
+        to_header_rendered=["jdoe@example.com"],
+        subject_rendered="Your certificate for 2024-05-01-ttt-online",
+        body_rendered=BODY,
+        attachments_with_content=[],
+    )
+
+
+def share_fields(email: ScheduledEmail) -> RenderedScheduledEmail:
+    return RenderedScheduledEmail.from_email(
+        email,
+        to_header_rendered=["jdoe@example.com"],
+        subject_rendered="Your certificate for 2024-05-01-ttt-online",
+        body_rendered=BODY,
+        attachments_with_content=[],
+    )
+
+
+def allocated_per_email(build: Callable[[ScheduledEmail], RenderedScheduledEmail], emails: list[ScheduledEmail]) -> int:
+    """Bytes allocated (and still held by results) per email."""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    results = [build(email) for email in emails]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return (after - before) // len(emails)
+
+
+def main() -> None:
+    email = make_email()
+    emails = [make_email() for _ in range(EMAILS)]
+
+    for label, build in [
+        ("RenderedScheduledEmail(**email.model_dump(), ...)", dump_and_validate),
+        ("RenderedScheduledEmail.from_email(email, ...)", share_fields),
+    ]:
+        measure(label, lambda: build(email))
+        print(f"{'':<60} {allocated_per_email(build, emails):10d} B/email")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,73 @@
 import asyncio
+from datetime import timedelta
 import logging
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-from aws_lambda_powertools.utilities.typing import LambdaContext
 import httpx
 
 from src.api import ScheduledEmailController
-from src.handler import handle_email
-from src.settings import SETTINGS, STAGE, read_mailgun_credentials
-from src.token import TokenCache
+from src.prewarm import Prewarmed, prewarm
+from src.settings import SETTINGS, STAGE
+from src.token import TokenCache, get_token_store
 from src.types import WorkerOutput
 
+if TYPE_CHECKING:
+    from aws_lambda_powertools.utilities.typing import LambdaContext
+
 logging.basicConfig()
 logger = logging.getLogger("amy-email-worker")
 logger.setLevel(logging.INFO)  # use logging.DEBUG to see boto3 logs
 
+# Runs during lambda init phase, which isn't billed towards invocation timeout.
+PREWARMED: Prewarmed | None = prewarm(SETTINGS) if SETTINGS.PREWARM else None
+
+
+async def main(event: dict[Any, Any], context: "LambdaContext", prewarmed: Prewarmed | None = None) -> WorkerOutput:
+    if prewarmed is not None:
+        return await run(event, context, prewarmed.client, prewarmed.token_cache)
+
+    async with httpx.AsyncClient() as client:
+        token_cache = TokenCache(
+            client, timedelta(seconds=SETTINGS.TOKEN_REFRESH_MARGIN_SECONDS), store=get_token_store()
+        )
+        return await run(event, context, client, token_cache)
+
 
-async def main(event: dict[Any, Any], context: LambdaContext) -> WorkerOutput:
+async def run(
+    event: dict[Any, Any],
+    context: "LambdaContext",
+    client: httpx.AsyncClient,
+    token_cache: TokenCache,
+) -> WorkerOutput:
     logger.info(f"Start handler with arguments: {event=}, {context=}")
 
     overwrite_outgoing_emails = SETTINGS.OVERWRITE_OUTGOING_EMAILS
     logger.info(f"Stage: {STAGE}")
     logger.info(f"Outgoing emails override: {overwrite_outgoing_emails}")
 
-    mailgun_credentials = read_mailgun_credentials()
-    logger.info("Obtained credentials for Mailgun.")
-
     result: WorkerOutput = {"emails": []}
 
-    async with httpx.AsyncClient() as client:
-        token_cache = TokenCache(client)
+    controller = ScheduledEmailController(
+        api_base_url=SETTINGS.API_BASE_URL,
+        client=client,
+        token_cache=token_cache,
+    )
+    emails = await controller.get_scheduled_to_run()
 
-        controller = ScheduledEmailController(
-            api_base_url=SETTINGS.API_BASE_URL,
-            client=client,
-            token_cache=token_cache,
-        )
-        emails = await controller.get_scheduled_to_run()
-
-        result["emails"] = await asyncio.gather(
-            *[
-                handle_email(
-                    email,
-                    mailgun_credentials,
-                    overwrite_outgoing_emails,
-                    controller,
-                    client,
-                    token_cache,
-                )
-                for email in emails
-            ]
-        )
+    # Most runs find no emails to send, and only check the API token and list
+    # scheduled emails. Delivery backend, rendering and S3 are set up on demand.
+    if emails:
+        from src.sending import send_emails
+
+        result = await send_emails(emails, client, controller, token_cache, overwrite_outgoing_emails)
+    else:
+        logger.info("No emails to send.")
 
     logger.info(f"End handler with result: {result}")
     return result
 
 
-def handler(event: dict[Any, Any], context: LambdaContext) -> WorkerOutput:
+def handler(event: dict[Any, Any], context: "LambdaContext") -> WorkerOutput:
+    if PREWARMED is not None:
+        return PREWARMED.loop.run_until_complete(main(event, context, PREWARMED))
     return asyncio.run(main(event, context))
@@ -0,0 +1,101 @@
+import asyncio
+from collections import deque
+import contextlib
+import json
+from typing import AsyncIterator
+
+from src.types import ScheduledEmail, Settings
+
+# Share of lambda memory available to emails in flight; the rest is left for the
+# interpreter, imported modules and caches.
+LAMBDA_MEMORY_SHARE = 0.5
+
+# Rendering holds several copies of subject and body at the same time: templates,
+# rendered Markdown, HTML and the request sent to Mailgun.
+RENDERING_OVERHEAD = 4
+
+
+def memory_budget(settings: Settings) -> int | None:
+    """Bytes available to emails in flight, or `None` when unbounded.
+
+    Unless set explicitly, the budget is derived from lambda memory size, less the
+    in-memory attachment cache (which is shared by all emails).
+    """
+    if settings.ADMISSION_MEMORY_BYTES:
+        return settings.ADMISSION_MEMORY_BYTES
+
+    if not settings.LAMBDA_MEMORY_SIZE_MB:
+        return None
+
+    lambda_memory_bytes = settings.LAMBDA_MEMORY_SIZE_MB * 1024 * 1024
+    return max(int(lambda_memory_bytes * LAMBDA_MEMORY_SHARE) - settings.ATTACHMENT_CACHE_MEMORY_BYTES, 0)
+
+
+def estimate_email_bytes(email: ScheduledEmail, spool_bytes: int) -> int:
+    """Estimate memory held while the email is handled.
+
+    Downloaded attachments are either shared with the attachment cache, or spooled
+    to disk above `spool_bytes`, so each of them holds at most `spool_bytes` of
+    memory owned by this email.
+    """
+    rendered_bytes = (len(email.subject) + len(email.body)) * RENDERING_OVERHEAD
+    context_bytes = len(json.dumps(email.context_json, default=str))
+    return rendered_bytes + context_bytes + len(email.attachments) * spool_bytes
+
+
+class MemoryAdmissionController:
+    """Delays starting new emails while bytes in flight would exceed the budget.
+
+    Emails are admitted in order of arrival, so that a large email waiting for memory
+    isn't starved by smaller ones. An email is always admitted when nothing else is
+    in flight, even if it exceeds the budget alone.
+    """
+
+    budget_bytes: int | None
+    in_flight_bytes: int
+    peak_bytes: int
+    delayed: int
+    _condition: asyncio.Condition
+    _queue: deque[object]
+
+    def __init__(self, budget_bytes: int | None) -> None:
+        self.budget_bytes = budget_bytes
+        self.in_flight_bytes = 0
+        self.peak_bytes = 0
+        self.delayed = 0
+        self._condition = asyncio.Condition()
+        self._queue = deque()
+
+    def _fits(self, size: int) -> bool:
+        return (
+            self.budget_bytes is None or self.in_flight_bytes == 0 or self.in_flight_bytes + size <= self.budget_bytes
+        )
+
+    async def acquire(self, size: int) -> None:
+        async with self._condition:
+            if self._queue or not self._fits(size):
+                self.delayed += 1
+                ticket = object()
+                self._queue.append(ticket)
+                try:
+                    await self._condition.wait_for(lambda: self._queue[0] is ticket and self._fits(size))
+                finally:
+                    self._queue.remove(ticket)
+                    # next email in the queue may fit as well
+                    self._condition.notify_all()
+
+            self.in_flight_bytes += size
+            self.peak_bytes = max(self.peak_bytes, self.in_flight_bytes)
+
+    async def release(self, size: int) -> None:
+        async with self._condition:
+            self.in_flight_bytes -= size
+            self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, size: int) -> AsyncIterator[None]:
+        await self.acquire(size)
+        try:
+            yield
+        finally:
+            await self.release(size)
@@ -49,9 +49,18 @@ class ScheduledEmailController:
 
         # safety break, preventing infinite loop
         counter = 0
+        reauthenticated = False
         while counter < max_pages:
             result = await self.client.get(url.format(counter + 1), headers=headers)
 
+            # Token reused from a previous invocation could have been revoked since.
+            if result.status_code == httpx.codes.UNAUTHORIZED and not reauthenticated:
+                reauthenticated = True
+                self.token_cache.invalidate()
+                token = await self.token_cache.get_token()
+                headers = self.auth_headers(token.token)
+                continue
+
             # Could be 404 if pagination is out of range
             if result.status_code != 200:
                 break
@@ -0,0 +1,414 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import functools
+import hashlib
+import logging
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import time
+from typing import BinaryIO, Callable, ParamSpec, TypeVar, cast
+
+import httpx
+
+from src.aws import download_s3_fileobj, s3_object_info
+from src.cache import BytesLRUCache, evict_least_recently_used
+from src.settings import SETTINGS, read_s3_bucket_from_ssm
+from src.types import Attachment, AttachmentWithContent, S3ObjectInfo
+
+logger = logging.getLogger("amy-email-worker")
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# Presigned URLs expiring sooner than that aren't used.
+PRESIGNED_URL_EXPIRATION_MARGIN = timedelta(minutes=1)
+
+
+@dataclass(frozen=True)
+class AttachmentKey:
+    bucket: str
+    s3_path: str
+    etag: str
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256("\0".join([self.bucket, self.s3_path, self.etag]).encode()).hexdigest()
+
+
+class AttachmentCache:
+    """Content-addressed cache of attachments, keyed by S3 bucket, path and ETag.
+
+    The in-memory tier is bounded by total size of attachments; cached bytes are
+    shared by all emails without copying. The optional disk tier (e.g. in lambda's
+    `/tmp`) survives between warm invocations; its files are opened and streamed
+    rather than read, and the least recently used ones are evicted once the tier
+    grows over `max_disk_bytes`.
+    """
+
+    memory: BytesLRUCache[AttachmentKey]
+    directory: Path | None
+    max_disk_bytes: int
+
+    def __init__(self, max_memory_bytes: int, directory: str = "", max_disk_bytes: int = 0) -> None:
+        self.memory = BytesLRUCache(max_memory_bytes)
+        self.directory = None
+        self.max_disk_bytes = max_disk_bytes
+
+        if directory:
+            try:
+                Path(directory).mkdir(parents=True, exist_ok=True)
+                self.directory = Path(directory)
+            except OSError as exc:
+                logger.warning(f"Attachment disk cache in {directory!r} disabled: {exc}")
+
+    def _path(self, directory: Path, key: AttachmentKey) -> Path:
+        return directory / f"{key.digest}.attachment"
+
+    def __contains__(self, key: AttachmentKey) -> bool:
+        if self.memory.get(key) is not None:
+            return True
+        return self.directory is not None and self._path(self.directory, key).exists()
+
+    def fits(self, size: int) -> bool:
+        return size <= self.memory.max_bytes or (self.directory is not None and size <= self.max_disk_bytes)
+
+    def open(self, key: AttachmentKey) -> bytes | BinaryIO | None:
+        """Cached bytes, or a new file handle the caller must close."""
+        if (content := self.memory.get(key)) is not None:
+            return content
+
+        if self.directory is None:
+            return None
+
+        path = self._path(self.directory, key)
+        try:
+            file = path.open("rb")
+        except FileNotFoundError:
+            return None
+
+        # mark as recently used
+        with contextlib.suppress(OSError):
+            os.utime(path)
+
+        return file
+
+    def put(self, key: AttachmentKey, file: BinaryIO, size: int) -> None:
+        """Store contents of `file`, read from its current position."""
+        if size <= self.memory.max_bytes:
+            position = file.tell()
+            self.memory.put(key, file.read())
+            file.seek(position)
+
+        if self.directory is None or size > self.max_disk_bytes:
+            return
+
+        # Write to a temporary file and rename it, so that a partially written file
+        # is never read.
+        temporary_path: str | None = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as cache_file:
+                temporary_path = cache_file.name
+                shutil.copyfileobj(file, cache_file)
+            os.replace(temporary_path, self._path(self.directory, key))
+        except OSError as exc:
+            logger.warning(f"Failed to store attachment {key.s3_path!r} in disk cache: {exc}")
+            if temporary_path is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(temporary_path)
+            return
+
+        evict_least_recently_used(self.directory.glob("*.attachment"), self.max_disk_bytes)
+
+
+def has_valid_presigned_url(attachment: Attachment, current_time: datetime) -> bool:
+    """Check if attachment's presigned URL is present and won't expire soon."""
+    if not attachment.presigned_url:
+        return False
+    expiration = attachment.presigned_url_expiration
+    return expiration is None or expiration > current_time + PRESIGNED_URL_EXPIRATION_MARGIN
+
+
+def can_link_presigned_url(attachment: Attachment, current_time: datetime, min_validity: timedelta) -> bool:
+    """Check if attachment's presigned URL is known to stay valid for `min_validity`,
+    so that recipients can still download the attachment after they get the email."""
+    expiration = attachment.presigned_url_expiration
+    return bool(attachment.presigned_url) and expiration is not None and expiration >= current_time + min_validity
+
+
+class AttachmentFetcher:
+    """Downloads attachments without blocking the event loop.
+
+    Attachments with a valid presigned URL are downloaded over the shared async
+    HTTP client. Other attachments, or ones whose presigned URL download failed, are
+    downloaded from S3. boto3 is synchronous, so S3 requests run in a thread pool
+    shared by all emails; the pool size bounds the number of concurrent requests.
+    Attachments of a single email are downloaded in parallel.
+
+    Contents are cached by their ETag, and concurrent requests for the same
+    attachment share a single download, so an attachment sent in bulk is downloaded
+    once per container. ETags of S3 objects are remembered for `info_ttl` seconds,
+    so that emails sent in bulk don't look the same object up again; a download
+    failing for a remembered ETag looks it up anew. Cached copies of presigned URL
+    downloads are revalidated with a conditional request. Downloads are streamed into spooled temporary files,
+    which move to disk above `spool_bytes`; attachments too large to cache are
+    streamed to a private file for each email.
+
+    File contents of returned attachments must be closed by the caller.
+    """
+
+    cache: AttachmentCache
+    spool_bytes: int
+    info_ttl: float
+    downloads: int
+    _executor: ThreadPoolExecutor
+    _downloads: dict[AttachmentKey, asyncio.Future[None]]
+    _presigned_downloads: dict[tuple[str, str], asyncio.Future[tuple[str, BinaryIO | None]]]
+    # latest ETag seen for presigned URL downloads of (bucket, s3_path)
+    _etags: dict[tuple[str, str], str]
+    # S3 object info of (bucket, s3_path), with monotonic time it's remembered until
+    _object_infos: dict[tuple[str, str], tuple[float, S3ObjectInfo]]
+    _info_lookups: dict[tuple[str, str], asyncio.Future[S3ObjectInfo]]
+
+    def __init__(
+        self, max_workers: int, cache: AttachmentCache, spool_bytes: int = 1024 * 1024, info_ttl: float = 0
+    ) -> None:
+        self.cache = cache
+        self.spool_bytes = spool_bytes
+        self.info_ttl = info_ttl
+        self.downloads = 0
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="s3-download")
+        self._downloads = {}
+        self._presigned_downloads = {}
+        self._etags = {}
+        self._object_infos = {}
+        self._info_lookups = {}
+
+    async def _run(self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def fetch(self, attachment: Attachment, client: httpx.AsyncClient | None = None) -> AttachmentWithContent:
+        bucket = await read_s3_bucket_from_ssm()
+
+        if client is not None and has_valid_presigned_url(attachment, datetime.now(tz=timezone.utc)):
+            try:
+                content = await self._fetch_presigned(client, attachment, bucket)
+                return AttachmentWithContent(filename=attachment.filename, content=content)
+            except httpx.HTTPError as exc:
+                logger.warning(f"Failed to download attachment {attachment.s3_path!r} from presigned URL: {exc}")
+
+        content = await self._fetch_s3(attachment, bucket)
+        return AttachmentWithContent(filename=attachment.filename, content=content)
+
+    async def fetch_all(
+        self, attachments: list[Attachment], client: httpx.AsyncClient | None = None
+    ) -> list[AttachmentWithContent]:
+        results = await asyncio.gather(
+            *[self.fetch(attachment, client) for attachment in attachments], return_exceptions=True
+        )
+        fetched = [result for result in results if isinstance(result, AttachmentWithContent)]
+        for result in results:
+            if isinstance(result, BaseException):
+                # Email isn't sent without all its attachments, so files opened for
+                # the others are closed here.
+                for attachment in fetched:
+                    attachment.close()
+                raise result
+        return fetched
+
+    async def select_linked(
+        self, attachments: list[Attachment], threshold_bytes: int, min_validity: timedelta
+    ) -> list[tuple[Attachment, int]]:
+        """Attachments (with their sizes) larger than `threshold_bytes`, which can be
+        linked with a presigned URL valid for at least `min_validity` instead of being
+        sent with the email."""
+        current_time = datetime.now(tz=timezone.utc)
+        candidates = [
+            attachment for attachment in attachments if can_link_presigned_url(attachment, current_time, min_validity)
+        ]
+        if not candidates:
+            return []
+
+        bucket = await read_s3_bucket_from_ssm()
+        infos = await asyncio.gather(*[self._object_info((bucket, attachment.s3_path)) for attachment in candidates])
+        return [(attachment, info.size) for attachment, info in zip(candidates, infos) if info.size > threshold_bytes]
+
+    def _remembered_info(self, path_key: tuple[str, str]) -> S3ObjectInfo | None:
+        remembered = self._object_infos.get(path_key)
+        if remembered is None:
+            return None
+        expires, info = remembered
+        if expires <= time.monotonic():
+            del self._object_infos[path_key]
+            return None
+        return info
+
+    async def _object_info(self, path_key: tuple[str, str]) -> S3ObjectInfo:
+        """ETag and size of S3 object; concurrent lookups of one object share a request."""
+        info = self._remembered_info(path_key)
+        if info is not None:
+            return info
+
+        lookup = self._info_lookups.get(path_key)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._look_up_info(path_key))
+            self._info_lookups[path_key] = lookup
+            lookup.add_done_callback(lambda _: self._info_lookups.pop(path_key, None))
+
+        # Shielded, so that cancelling one email doesn't cancel lookup for others.
+        return await asyncio.shield(lookup)
+
+    async def _look_up_info(self, path_key: tuple[str, str]) -> S3ObjectInfo:
+        expires = time.monotonic() + self.info_ttl
+        info = await self._run(s3_object_info, *path_key)
+        if self.info_ttl > 0:
+            current_time = time.monotonic()
+            self._object_infos = {key: value for key, value in self._object_infos.items() if value[0] > current_time}
+            self._object_infos[path_key] = (expires, info)
+        return info
+
+    async def _fetch_s3(self, attachment: Attachment, bucket: str) -> bytes | BinaryIO:
+        path_key = (bucket, attachment.s3_path)
+        info = self._remembered_info(path_key)
+        if info is not None:
+            try:
+                return await self._fetch_s3_version(path_key, info)
+            except Exception as exc:
+                # The object may have changed since its ETag was looked up.
+                logger.warning(f"Failed to download attachment {attachment.s3_path!r} ({info.etag}): {exc}")
+                self._object_infos.pop(path_key, None)
+
+        info = await self._object_info(path_key)
+        return await self._fetch_s3_version(path_key, info)
+
+    async def _fetch_s3_version(self, path_key: tuple[str, str], info: S3ObjectInfo) -> bytes | BinaryIO:
+        bucket, s3_path = path_key
+        key = AttachmentKey(bucket=bucket, s3_path=s3_path, etag=info.etag)
+
+        content = await self._run(self.cache.open, key)
+
+        if content is None and self.cache.fits(info.size):
+            download = self._downloads.get(key)
+            if download is None:
+                download = asyncio.ensure_future(self._download_to_cache(key, info.size))
+                self._downloads[key] = download
+                download.add_done_callback(lambda _: self._downloads.pop(key, None))
+
+            # Shielded, so that cancelling one email doesn't cancel download for others.
+            await asyncio.shield(download)
+            content = await self._run(self.cache.open, key)
+
+        if content is None:
+            # Too large to cache, or already evicted.
+            content = await self._download(key)
+
+        return content
+
+    async def _download(self, key: AttachmentKey) -> BinaryIO:
+        logger.info(f"Downloading attachment {key.s3_path!r} ({key.etag}).")
+        self.downloads += 1
+        file = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+        try:
+            await self._run(download_s3_fileobj, key.bucket, key.s3_path, file, etag=key.etag)
+        except BaseException:
+            file.close()
+            raise
+        return cast(BinaryIO, file)
+
+    async def _download_to_cache(self, key: AttachmentKey, size: int) -> None:
+        with await self._download(key) as file:
+            await self._run(self.cache.put, key, file, size)
+
+    async def _fetch_presigned(
+        self, client: httpx.AsyncClient, attachment: Attachment, bucket: str
+    ) -> bytes | BinaryIO:
+        path_key = (bucket, attachment.s3_path)
+
+        # Emails sent in bulk have different presigned URLs for the same object, so
+        # concurrent downloads are shared by object path. Only the email which started
+        # the download gets its file, the rest reads the cached copy.
+        download = self._presigned_downloads.get(path_key)
+        started = download is None
+        if download is None:
+            download = asyncio.ensure_future(self._download_presigned(client, attachment.presigned_url, path_key))
+            self._presigned_downloads[path_key] = download
+            download.add_done_callback(lambda _: self._presigned_downloads.pop(path_key, None))
+
+        # Shielded, so that cancelling one email doesn't cancel download for others.
+        etag, file = await asyncio.shield(download)
+        if started and file is not None:
+            return file
+
+        key = AttachmentKey(bucket=bucket, s3_path=attachment.s3_path, etag=etag)
+        content = await self._run(self.cache.open, key)
+        if content is None:
+            # Too large to cache, or already evicted.
+            _, file = await self._download_presigned(client, attachment.presigned_url, path_key, revalidate=False)
+            return cast(BinaryIO, file)
+        return content
+
+    async def _download_presigned(
+        self, client: httpx.AsyncClient, url: str, path_key: tuple[str, str], revalidate: bool = True
+    ) -> tuple[str, BinaryIO | None]:
+        """Download from presigned URL and cache the contents.
+
+        If cache holds the latest seen version and `revalidate` is set, the request
+        is conditional and no file is returned when that version is still current.
+        """
+        bucket, s3_path = path_key
+        headers = {}
+        cached_etag = self._etags.get(path_key)
+        if (
+            revalidate
+            and cached_etag is not None
+            and AttachmentKey(bucket=bucket, s3_path=s3_path, etag=cached_etag) in self.cache
+        ):
+            headers["If-None-Match"] = cached_etag
+
+        logger.info(f"Downloading attachment {s3_path!r} from presigned URL.")
+        file = cast(BinaryIO, tempfile.SpooledTemporaryFile(max_size=self.spool_bytes))
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                if cached_etag is not None and response.status_code == httpx.codes.NOT_MODIFIED:
+                    file.close()
+                    return cached_etag, None
+
+                response.raise_for_status()
+                etag = response.headers.get("ETag", "")
+                async for chunk in response.aiter_bytes():
+                    file.write(chunk)
+        except BaseException:
+            file.close()
+            raise
+
+        self.downloads += 1
+        size = file.tell()
+        file.seek(0)
+
+        if etag:
+            self._etags[path_key] = etag
+            if self.cache.fits(size):
+                await self._run(self.cache.put, AttachmentKey(bucket=bucket, s3_path=s3_path, etag=etag), file, size)
+
+        return etag, file
+
+
+@functools.cache
+def get_attachment_fetcher() -> AttachmentFetcher:
+    """Attachment fetcher shared by all invocations handled in this process."""
+    cache = AttachmentCache(
+        SETTINGS.ATTACHMENT_CACHE_MEMORY_BYTES,
+        SETTINGS.ATTACHMENT_CACHE_DIR,
+        SETTINGS.ATTACHMENT_CACHE_DISK_BYTES,
+    )
+    return AttachmentFetcher(
+        SETTINGS.S3_DOWNLOAD_CONCURRENCY,
+        cache,
+        SETTINGS.ATTACHMENT_SPOOL_BYTES,
+        info_ttl=SETTINGS.ATTACHMENT_INFO_TTL_SECONDS,
+    )
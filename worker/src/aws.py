@@ -1,34 +1,77 @@
-from io import BytesIO
-from typing import Optional, cast
+import logging
+import threading
+from typing import IO, Any, Literal, cast
 
-import boto3
+from src.types import S3ObjectInfo, SSMParameter
 
-from src.types import SSMParameter
+logger = logging.getLogger("amy-email-worker")
 
-ssm_client = boto3.client("ssm")
-s3_client = boto3.client("s3")
+# GetParameters accepts up to 10 names per request
+SSM_GET_PARAMETERS_LIMIT = 10
 
 
-# TODO: turn into async, perhaps use aioboto3 for that
-def read_ssm_parameter(path: str) -> Optional[SSMParameter]:
-    response = ssm_client.get_parameter(Name=path)
+# Clients are created on first use, and shared by all threads.
+_clients: dict[str, Any] = {}
+# Creating clients on boto3's default session concurrently isn't thread-safe.
+_clients_lock = threading.Lock()
 
-    if "Parameter" in response and response["Parameter"]:
-        return cast(SSMParameter, response["Parameter"])
 
-    return None
+def get_client(service: Literal["ssm", "s3"]) -> Any:
+    with _clients_lock:
+        if service not in _clients:
+            # boto3 takes a while to import, and isn't needed by most invocations.
+            import boto3
+
+            _clients[service] = boto3.client(service)
+        return _clients[service]
+
+
+def get_ssm_client() -> Any:
+    """SSM client, created on first use; most invocations have nothing to send."""
+    return get_client("ssm")
+
+
+def get_s3_client() -> Any:
+    """S3 client, created on first use, i.e. only when emails have attachments."""
+    return get_client("s3")
+
+
+def read_ssm_parameters(paths: list[str]) -> dict[str, SSMParameter]:
+    """Read parameters, decrypting secure strings, in as few requests as possible.
+
+    Parameters which don't exist are left out."""
+    parameters: dict[str, SSMParameter] = {}
+
+    for start in range(0, len(paths), SSM_GET_PARAMETERS_LIMIT):
+        names = paths[start:][:SSM_GET_PARAMETERS_LIMIT]
+        response = get_ssm_client().get_parameters(Names=names, WithDecryption=True)
+        for parameter in response.get("Parameters", []):
+            parameters[parameter["Name"]] = cast(SSMParameter, parameter)
+        if invalid_parameters := response.get("InvalidParameters"):
+            logger.warning(f"SSM parameters not found: {invalid_parameters}")
+
+    return parameters
 
 
 def get_parameter_value(parameter: SSMParameter) -> str:
     return parameter.get("Value", "")
 
 
-def inmemory_s3_download(bucket: str, path: str) -> bytes:
-    bytes = BytesIO()
-    s3_client.download_fileobj(Bucket=bucket, Key=path, Fileobj=bytes)
+def s3_object_info(bucket: str, path: str) -> S3ObjectInfo:
+    response = get_s3_client().head_object(Bucket=bucket, Key=path)
+    return S3ObjectInfo(etag=response["ETag"], size=response["ContentLength"])
+
+
+def download_s3_fileobj(bucket: str, path: str, fileobj: IO[bytes], etag: str | None = None) -> None:
+    """Stream S3 object into `fileobj` and rewind it.
+
+    With `etag`, download fails if the object's ETag doesn't match."""
+    extra_args = {"IfMatch": etag} if etag else None
+    get_s3_client().download_fileobj(Bucket=bucket, Key=path, Fileobj=fileobj, ExtraArgs=extra_args)
+    fileobj.seek(0)
 
-    bytes.seek(0)
-    file_contents = bytes.read()
-    bytes.close()
 
-    return file_contents
+def upload_s3_fileobj(bucket: str, path: str, fileobj: IO[bytes]) -> None:
+    """Upload `fileobj` from its start, in parts if it's large."""
+    fileobj.seek(0)
+    get_s3_client().upload_fileobj(Fileobj=fileobj, Bucket=bucket, Key=path)
@@ -0,0 +1,150 @@
+import asyncio
+from dataclasses import dataclass, field
+import logging
+
+from httpx import AsyncClient, Response
+
+from src.email import send_batch_email, send_email
+from src.types import MailgunCredentials, RenderedScheduledEmail
+
+logger = logging.getLogger("amy-email-worker")
+
+# Mailgun accepts up to 1000 recipients in a single batch message.
+MAILGUN_BATCH_LIMIT = 1000
+
+
+@dataclass(frozen=True)
+class BatchKey:
+    from_header: str
+    reply_to_header: str
+    subject: str
+    body: str
+    # (filename, s3_path) of attachments
+    attachments: tuple[tuple[str, str], ...]
+
+
+def batch_key(email: RenderedScheduledEmail) -> BatchKey | None:
+    """Key of emails which can be sent in one batch, or `None` if email can't be batched.
+
+    Only emails with a single recipient and no CC nor BCC are batched, because batch
+    messages would send a copy to CC and BCC addresses for every recipient."""
+    if len(email.to_header_rendered) != 1 or email.cc_header or email.bcc_header:
+        return None
+
+    return BatchKey(
+        from_header=email.from_header,
+        reply_to_header=email.reply_to_header,
+        subject=email.subject_rendered,
+        body=email.body_rendered,
+        attachments=tuple((attachment.filename, attachment.s3_path) for attachment in email.attachments),
+    )
+
+
+@dataclass
+class Batch:
+    emails: list[tuple[RenderedScheduledEmail, asyncio.Future[Response]]] = field(default_factory=list)
+    recipients: set[str] = field(default_factory=set)
+    timer: asyncio.TimerHandle | None = None
+
+
+class MailgunBatcher:
+    """Groups identical emails sent at about the same time into Mailgun batch messages.
+
+    The first email of a group waits up to `window` seconds for other emails of the
+    group; the batch is sent earlier once it reaches `limit` recipients. All emails
+    of a batch receive the same Mailgun response. Emails which can't be batched are
+    sent immediately.
+    """
+
+    client: AsyncClient
+    credentials: MailgunCredentials
+    window: float
+    limit: int
+    requests: int
+    emails: int
+    _pending: dict[BatchKey, Batch]
+    _tasks: set[asyncio.Task[None]]
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        credentials: MailgunCredentials,
+        window: float,
+        limit: int = MAILGUN_BATCH_LIMIT,
+    ) -> None:
+        self.client = client
+        self.credentials = credentials
+        self.window = window
+        self.limit = limit
+        self.requests = 0
+        self.emails = 0
+        self._pending = {}
+        self._tasks = set()
+
+    @property
+    def requests_saved(self) -> int:
+        return self.emails - self.requests
+
+    async def send(self, email: RenderedScheduledEmail) -> Response:
+        key = batch_key(email)
+        if key is None:
+            self.requests += 1
+            self.emails += 1
+            return await send_email(self.client, email, self.credentials)
+
+        recipient = email.to_header_rendered[0]
+        batch = self._pending.get(key)
+        # Mailgun sends one message per recipient, so a repeated recipient starts a new batch.
+        if batch is not None and recipient in batch.recipients:
+            self._flush(key, batch)
+            batch = None
+
+        if batch is None:
+            batch = Batch()
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key, batch)
+            self._pending[key] = batch
+
+        future: asyncio.Future[Response] = asyncio.get_running_loop().create_future()
+        batch.emails.append((email, future))
+        batch.recipients.add(recipient)
+        if len(batch.emails) >= self.limit:
+            self._flush(key, batch)
+
+        return await future
+
+    def _flush(self, key: BatchKey, batch: Batch) -> None:
+        if self._pending.get(key) is not batch:
+            return
+
+        del self._pending[key]
+        if batch.timer is not None:
+            batch.timer.cancel()
+
+        task = asyncio.ensure_future(self._send_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch: Batch) -> None:
+        # Emails cancelled while waiting aren't sent.
+        pending = [(email, future) for email, future in batch.emails if not future.done()]
+        if not pending:
+            return
+
+        self.requests += 1
+        self.emails += len(pending)
+        emails = [email for email, _ in pending]
+        logger.info(f"Sending batch of {len(emails)} emails: {[str(email.pk) for email in emails]}.")
+
+        try:
+            if len(emails) == 1:
+                response = await send_email(self.client, emails[0], self.credentials)
+            else:
+                response = await send_batch_email(self.client, emails, self.credentials)
+        except Exception as exc:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+        else:
+            for _, future in pending:
+                if not future.done():
+                    future.set_result(response)
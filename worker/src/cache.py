@@ -0,0 +1,67 @@
+from collections import OrderedDict
+import contextlib
+from pathlib import Path
+import threading
+from typing import Generic, Hashable, Iterable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+def evict_least_recently_used(paths: Iterable[Path], max_bytes: int) -> None:
+    """Remove files with the oldest modification time until the rest fits in `max_bytes`.
+
+    Caches using this function should touch their files when reading them.
+    """
+    entries: list[tuple[float, int, Path]] = []
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        # Another process (the daemon may share the directory) could have
+        # already removed this file.
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+        total_size -= size
+
+
+class BytesLRUCache(Generic[K]):
+    """Thread-safe, least-recently-used in-memory cache bounded by total size of values."""
+
+    max_bytes: int
+    size: int
+    _entries: OrderedDict[K, bytes]
+    _lock: threading.Lock
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> bytes | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: K, value: bytes) -> None:
+        # Values that would evict everything else aren't cached at all.
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            if (previous := self._entries.pop(key, None)) is not None:
+                self.size -= len(previous)
+
+            self._entries[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
@@ -0,0 +1,398 @@
+from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from email.utils import make_msgid
+import logging
+import mimetypes
+from pathlib import Path
+import queue
+import smtplib
+import ssl
+
+import httpx
+from httpx import AsyncClient
+
+from src.batching import MailgunBatcher
+from src.email import send_email
+from src.settings import SETTINGS, get_parameter_loader, read_mailgun_credentials
+from src.types import (
+    Credentials,
+    DeliveryBackendKind,
+    MailgunCredentials,
+    RenderedScheduledEmail,
+    Settings,
+)
+
+logger = logging.getLogger("amy-email-worker")
+
+
+class DeliveryBackend(ABC):
+    """Delivers rendered emails.
+
+    `send` returns details of successful delivery, which are stored with the email,
+    and raises an exception when the email wasn't delivered."""
+
+    name: str
+
+    @abstractmethod
+    async def send(self, email: RenderedScheduledEmail) -> str: ...
+
+
+def build_mime_message(email: RenderedScheduledEmail, overwrite_outgoing_emails: str | None = None) -> EmailMessage:
+    to = email.to_header_rendered[:]
+    cc = email.cc_header[:]
+    bcc = email.bcc_header[:]
+
+    if overwrite_outgoing_emails:
+        to = [overwrite_outgoing_emails]
+        cc = []
+        bcc = []
+
+    message = EmailMessage()
+    message["Message-ID"] = make_msgid(idstring=str(email.pk))
+    message["From"] = email.from_header
+    message["To"] = to
+    if cc:
+        message["Cc"] = cc
+    # SMTP client sends to BCC addresses, but doesn't transmit the header
+    if bcc:
+        message["Bcc"] = bcc
+    if email.reply_to_header:
+        message["Reply-To"] = email.reply_to_header
+    message["Subject"] = email.subject_rendered
+    message.set_content(email.body_rendered, subtype="html")
+
+    for attachment in email.attachments_with_content:
+        filename = attachment.filename or "attachment"
+        if isinstance(attachment.content, bytes):
+            content = attachment.content
+        else:
+            # file could have been read already, e.g. by a backend that failed
+            attachment.content.seek(0)
+            content = attachment.content.read()
+        maintype, _, subtype = (mimetypes.guess_type(filename)[0] or "application/octet-stream").partition("/")
+        message.add_attachment(content, maintype=maintype, subtype=subtype, filename=filename)
+
+    return message
+
+
+class MailgunBackend(DeliveryBackend):
+    """Mailgun HTTP API, optionally sending identical emails in batches."""
+
+    name = "mailgun"
+
+    client: AsyncClient
+    credentials: MailgunCredentials
+    overwrite_outgoing_emails: str | None
+    batcher: MailgunBatcher | None
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        credentials: MailgunCredentials,
+        overwrite_outgoing_emails: str | None = None,
+        batcher: MailgunBatcher | None = None,
+    ) -> None:
+        self.client = client
+        self.credentials = credentials
+        self.overwrite_outgoing_emails = overwrite_outgoing_emails
+        self.batcher = batcher
+
+    async def send(self, email: RenderedScheduledEmail) -> str:
+        if self.batcher is None:
+            response = await send_email(
+                self.client,
+                email,
+                self.credentials,
+                overwrite_outgoing_emails=self.overwrite_outgoing_emails,
+            )
+        else:
+            response = await self.batcher.send(email)
+
+        # Cached credentials could have been rotated in the meantime.
+        if response.status_code in (httpx.codes.UNAUTHORIZED, httpx.codes.FORBIDDEN):
+            logger.warning("Mailgun rejected credentials, reloading them.")
+            get_parameter_loader().invalidate()
+            self.credentials = await read_mailgun_credentials()
+            if self.batcher is not None:
+                self.batcher.credentials = self.credentials
+            response = await send_email(
+                self.client,
+                email,
+                self.credentials,
+                overwrite_outgoing_emails=self.overwrite_outgoing_emails,
+            )
+
+        logger.info(f"Mailgun response: {response=}")
+        logger.info(f"Response content: {response.content!r}")
+        response.raise_for_status()
+        return f"Mailgun response: {response.content!r}"
+
+
+def quit_connection(connection: smtplib.SMTP) -> None:
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
+
+
+class SMTPConnectionPool:
+    """Persistent SMTP connections, reused by subsequent emails and invocations.
+
+    Sending is blocking, so it runs in a thread pool of the same size as the
+    connection pool."""
+
+    host: str
+    port: int
+    username: str
+    password: str
+    starttls: bool
+    timeout: float
+    _connections: queue.SimpleQueue[smtplib.SMTP]
+    _executor: ThreadPoolExecutor
+    _closed: bool
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str = "",
+        password: str = "",
+        starttls: bool = True,
+        size: int = 4,
+        timeout: float = 30,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._connections = queue.SimpleQueue()
+        self._executor = ThreadPoolExecutor(size, thread_name_prefix="smtp")
+        self._closed = False
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                connection.starttls(context=ssl.create_default_context())
+            if self.username:
+                connection.login(self.username, self.password)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def _send_with(self, connection: smtplib.SMTP, message: EmailMessage) -> dict[str, tuple[int, bytes]]:
+        try:
+            return connection.send_message(message)
+        except BaseException:
+            connection.close()
+            raise
+
+    def send_message(self, message: EmailMessage) -> dict[str, tuple[int, bytes]]:
+        """Send message and return refused recipients."""
+        try:
+            connection = self._connections.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+
+        try:
+            refused = self._send_with(connection, message)
+        except smtplib.SMTPServerDisconnected:
+            # pooled connection was closed by the server in the meantime
+            connection = self._connect()
+            refused = self._send_with(connection, message)
+
+        if self._closed:
+            quit_connection(connection)
+        else:
+            self._connections.put(connection)
+        return refused
+
+    async def send(self, message: EmailMessage) -> dict[str, tuple[int, bytes]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.send_message, message)
+
+    def close(self) -> None:
+        """Close pooled connections and stop threads once sends in progress finish."""
+        self._closed = True
+        self._executor.shutdown(wait=False)
+        while True:
+            try:
+                connection = self._connections.get_nowait()
+            except queue.Empty:
+                return
+            quit_connection(connection)
+
+
+class SMTPBackend(DeliveryBackend):
+    name = "smtp"
+
+    pool: SMTPConnectionPool
+    overwrite_outgoing_emails: str | None
+
+    def __init__(self, pool: SMTPConnectionPool, overwrite_outgoing_emails: str | None = None) -> None:
+        self.pool = pool
+        self.overwrite_outgoing_emails = overwrite_outgoing_emails
+
+    async def send(self, email: RenderedScheduledEmail) -> str:
+        message = build_mime_message(email, self.overwrite_outgoing_emails)
+        refused = await self.pool.send(message)
+        if refused:
+            logger.warning(f"SMTP server refused recipients of email {email.pk}: {refused}")
+        return f"SMTP message {message['Message-ID']} accepted by {self.pool.host}, refused recipients: {refused}"
+
+
+class FileSinkBackend(DeliveryBackend):
+    """Writes MIME messages to `directory`, or discards them when no directory is set.
+
+    Meant for local development and benchmarks."""
+
+    directory: Path | None
+    overwrite_outgoing_emails: str | None
+
+    def __init__(self, directory: str = "", overwrite_outgoing_emails: str | None = None) -> None:
+        self.directory = Path(directory) if directory else None
+        self.overwrite_outgoing_emails = overwrite_outgoing_emails
+        self.name = "file" if directory else "null"
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    async def send(self, email: RenderedScheduledEmail) -> str:
+        message = build_mime_message(email, self.overwrite_outgoing_emails)
+        if self.directory is None:
+            return "Message discarded."
+
+        path = self.directory / f"{email.pk}.eml"
+        path.write_bytes(message.as_bytes())
+        return f"Message written to {path}."
+
+
+def is_transient_failure(exc: Exception) -> bool:
+    """Whether delivery failed because of the connection or a temporary server error.
+
+    Emails rejected for good (e.g. a bad recipient) would be rejected by any backend."""
+    match exc:
+        case httpx.HTTPStatusError():
+            status_code = exc.response.status_code
+            return status_code >= 500 or status_code == httpx.codes.TOO_MANY_REQUESTS
+        case httpx.TransportError():
+            return True
+        case smtplib.SMTPConnectError() | smtplib.SMTPServerDisconnected():
+            return True
+        case smtplib.SMTPResponseException():
+            # 4xx replies are temporary, 5xx permanent
+            return 400 <= exc.smtp_code < 500
+        case smtplib.SMTPException():
+            return False
+        case OSError():
+            # connection refused, reset or timed out
+            return True
+        case _:
+            return False
+
+
+class FailoverBackend(DeliveryBackend):
+    """Sends with `secondary` backend when `primary` fails transiently."""
+
+    primary: DeliveryBackend
+    secondary: DeliveryBackend
+
+    def __init__(self, primary: DeliveryBackend, secondary: DeliveryBackend) -> None:
+        self.primary = primary
+        self.secondary = secondary
+        self.name = f"{primary.name},{secondary.name}"
+
+    async def send(self, email: RenderedScheduledEmail) -> str:
+        try:
+            return await self.primary.send(email)
+        except Exception as exc:
+            if not is_transient_failure(exc):
+                raise
+            logger.warning(
+                f"Delivery of email {email.pk} with {self.primary.name} failed, using {self.secondary.name}."
+            )
+            details = await self.secondary.send(email)
+            return f"{details} (after {self.primary.name} failed: {exc})"
+
+
+_smtp_pool: SMTPConnectionPool | None = None
+
+
+def get_smtp_pool(credentials: Credentials) -> SMTPConnectionPool:
+    """SMTP connection pool shared by all invocations handled in this process.
+
+    When credentials are rotated, the pool is replaced and the previous one closed."""
+    global _smtp_pool
+    if _smtp_pool is not None:
+        if (_smtp_pool.username, _smtp_pool.password) == (credentials.USER, credentials.PASSWORD):
+            return _smtp_pool
+        _smtp_pool.close()
+
+    _smtp_pool = SMTPConnectionPool(
+        SETTINGS.SMTP_HOST,
+        SETTINGS.SMTP_PORT,
+        credentials.USER,
+        credentials.PASSWORD,
+        starttls=SETTINGS.SMTP_STARTTLS,
+        size=SETTINGS.SMTP_POOL_SIZE,
+    )
+    return _smtp_pool
+
+
+def create_backend(
+    kind: DeliveryBackendKind,
+    settings: Settings,
+    client: AsyncClient,
+    mailgun_credentials: MailgunCredentials,
+    overwrite_outgoing_emails: str | None = None,
+    batcher: MailgunBatcher | None = None,
+    smtp_credentials: Credentials | None = None,
+) -> DeliveryBackend:
+    match kind:
+        case "mailgun":
+            return MailgunBackend(client, mailgun_credentials, overwrite_outgoing_emails, batcher)
+        case "smtp":
+            return SMTPBackend(
+                get_smtp_pool(smtp_credentials or Credentials(USER="", PASSWORD="")), overwrite_outgoing_emails
+            )
+        case "file":
+            return FileSinkBackend(settings.DELIVERY_SINK_DIR, overwrite_outgoing_emails)
+        case "null":
+            return FileSinkBackend("", overwrite_outgoing_emails)
+
+
+def create_delivery_backend(
+    settings: Settings,
+    client: AsyncClient,
+    mailgun_credentials: MailgunCredentials,
+    overwrite_outgoing_emails: str | None = None,
+    batcher: MailgunBatcher | None = None,
+    smtp_credentials: Credentials | None = None,
+) -> DeliveryBackend:
+    """Backend selected by `DELIVERY_BACKEND`, failing over to `DELIVERY_FAILOVER_BACKEND`."""
+    backend = create_backend(
+        settings.DELIVERY_BACKEND,
+        settings,
+        client,
+        mailgun_credentials,
+        overwrite_outgoing_emails,
+        batcher,
+        smtp_credentials,
+    )
+    if settings.DELIVERY_FAILOVER_BACKEND is None:
+        return backend
+
+    failover_backend = create_backend(
+        settings.DELIVERY_FAILOVER_BACKEND,
+        settings,
+        client,
+        mailgun_credentials,
+        overwrite_outgoing_emails,
+        batcher,
+        smtp_credentials,
+    )
+    return FailoverBackend(backend, failover_backend)
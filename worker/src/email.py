@@ -1,13 +1,15 @@
+import json
 from typing import Any
 
 from httpx import AsyncClient, Response
 from jinja2 import Environment
+from markupsafe import escape
 
-from src.aws import inmemory_s3_download
-from src.settings import read_s3_bucket_from_ssm
+from src.ratelimit import get_mailgun_rate_limiter, send_rate_limited
+from src.rendering import get_engine, get_markdown_converter
+from src.settings import MAILGUN_API_URL
 from src.types import (
     Attachment,
-    AttachmentWithContent,
     MailgunCredentials,
     RenderedScheduledEmail,
     ScheduledEmail,
@@ -15,7 +17,11 @@ from src.types import (
 
 
 def render_template_from_string(engine: Environment, template: str, context: dict[str, Any]) -> str:
-    return engine.from_string(template).render(context)
+    # Engines with a loader (see `src.rendering.create_engine`) load templates by
+    # their source, which makes use of template and bytecode caches.
+    if engine.loader is None:
+        return engine.from_string(template).render(context)
+    return engine.get_template(template).render(context)
 
 
 def render_email(
@@ -26,10 +32,19 @@ def render_email(
 ) -> RenderedScheduledEmail:
     subject_rendered = render_template_from_string(engine, email.subject, context)
     body_rendered = render_template_from_string(engine, email.body, context)
+    return build_rendered_email(email, recipients, subject_rendered, body_rendered)
+
+
+def build_rendered_email(
+    email: ScheduledEmail,
+    recipients: list[str],
+    subject_rendered: str,
+    body_rendered: str,
+) -> RenderedScheduledEmail:
     to_header_rendered = [recipient for recipient in recipients if recipient]
 
-    return RenderedScheduledEmail(
-        **email.model_dump(),
+    return RenderedScheduledEmail.from_email(
+        email,
         to_header_rendered=to_header_rendered,
         subject_rendered=subject_rendered,
         body_rendered=body_rendered,
@@ -37,10 +52,29 @@ def render_email(
     )
 
 
-def read_attachment_from_s3(attachment: Attachment) -> AttachmentWithContent:
-    bucket_name = read_s3_bucket_from_ssm()
-    file_contents = inmemory_s3_download(bucket_name, attachment.s3_path)
-    return AttachmentWithContent(filename=attachment.filename, content=file_contents)
+def render_email_content(subject: str, body: str, context: dict[str, Any]) -> tuple[str, str]:
+    """Render subject and body with the shared engine, and convert the body to HTML.
+
+    Module-level function, so that it can be run in a process pool."""
+    engine = get_engine()
+    subject_rendered = render_template_from_string(engine, subject, context)
+    body_rendered = render_template_from_string(engine, body, context)
+    return subject_rendered, get_markdown_converter().convert(body_rendered)
+
+
+def append_attachment_links(body_html: str, attachments: list[Attachment]) -> str:
+    """Append download links for attachments that aren't sent with the email."""
+    if not attachments:
+        return body_html
+
+    items = []
+    for attachment in attachments:
+        link = f'<a href="{escape(attachment.presigned_url)}">{escape(attachment.filename)}</a>'
+        if attachment.presigned_url_expiration is not None:
+            link += f" (available until {attachment.presigned_url_expiration:%Y-%m-%d %H:%M %Z})"
+        items.append(f"<li>{link}</li>")
+
+    return f"{body_html}\n<p>Attachments:</p>\n<ul>\n{'\n'.join(items)}\n</ul>"
 
 
 async def send_email(
@@ -49,7 +83,7 @@ async def send_email(
     credentials: MailgunCredentials,
     overwrite_outgoing_emails: str | None = None,
 ) -> Response:
-    url = f"https://api.mailgun.net/v3/{credentials.MAILGUN_SENDER_DOMAIN}/messages"
+    url = f"{MAILGUN_API_URL}/v3/{credentials.MAILGUN_SENDER_DOMAIN}/messages"
     to = email.to_header_rendered[:]
     cc = email.cc_header[:]
     bcc = email.bcc_header[:]
@@ -59,20 +93,60 @@ async def send_email(
         cc = []
         bcc = []
 
-    return await client.post(
-        url,
-        auth=("api", credentials.MAILGUN_API_KEY),
-        files=[
-            ("attachment", (attachment.filename or "attachment", attachment.content))
-            for attachment in email.attachments_with_content
-        ],
-        data={
-            "from": email.from_header,
-            "to": to,
-            "h:Reply-To": email.reply_to_header,
-            "cc": cc,
-            "bcc": bcc,
-            "subject": email.subject_rendered,
-            "html": email.body_rendered,
-        },
+    return await send_rate_limited(
+        get_mailgun_rate_limiter(),
+        lambda: client.post(
+            url,
+            auth=("api", credentials.MAILGUN_API_KEY),
+            # file contents are streamed by httpx instead of being read into memory
+            files=[
+                ("attachment", (attachment.filename or "attachment", attachment.content))
+                for attachment in email.attachments_with_content
+            ],
+            data={
+                "from": email.from_header,
+                "to": to,
+                "h:Reply-To": email.reply_to_header,
+                "cc": cc,
+                "bcc": bcc,
+                "subject": email.subject_rendered,
+                "html": email.body_rendered,
+            },
+        ),
+    )
+
+
+async def send_batch_email(
+    client: AsyncClient,
+    emails: list[RenderedScheduledEmail],
+    credentials: MailgunCredentials,
+) -> Response:
+    """Send emails with identical content, each to its single recipient, as one
+    Mailgun batch message.
+
+    Recipient variables make Mailgun send a separate message to every recipient, so
+    recipients don't see each other."""
+    url = f"{MAILGUN_API_URL}/v3/{credentials.MAILGUN_SENDER_DOMAIN}/messages"
+    email = emails[0]
+    recipient_variables = {batch_email.to_header_rendered[0]: {"id": str(batch_email.pk)} for batch_email in emails}
+
+    return await send_rate_limited(
+        get_mailgun_rate_limiter(),
+        lambda: client.post(
+            url,
+            auth=("api", credentials.MAILGUN_API_KEY),
+            # file contents are streamed by httpx instead of being read into memory
+            files=[
+                ("attachment", (attachment.filename or "attachment", attachment.content))
+                for attachment in email.attachments_with_content
+            ],
+            data={
+                "from": email.from_header,
+                "to": list(recipient_variables),
+                "h:Reply-To": email.reply_to_header,
+                "subject": email.subject_rendered,
+                "html": email.body_rendered,
+                "recipient-variables": json.dumps(recipient_variables),
+            },
+        ),
     )
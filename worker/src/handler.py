@@ -1,11 +1,10 @@
+from datetime import timedelta
 import logging
 from typing import cast
 from uuid import UUID
 
 import httpx
-from jinja2 import DebugUndefined, Environment
-from jinja2.exceptions import TemplateError
-import markdown
+from jinja2.exceptions import TemplateError, TemplateSyntaxError
 from pydantic_core import ValidationError
 
 from src.api import (
@@ -15,9 +14,25 @@ from src.api import (
     fetch_model_field,
     scalar_value_from_uri,
 )
-from src.email import read_attachment_from_s3, render_email, send_email
+from src.attachments import get_attachment_fetcher
+from src.batching import MailgunBatcher
+from src.delivery import DeliveryBackend, MailgunBackend
+from src.email import (
+    append_attachment_links,
+    build_rendered_email,
+    render_email_content,
+)
+from src.rendering import (
+    RenderPlanner,
+    analyze_templates,
+    get_render_executor,
+    render_fingerprint,
+    template_variables,
+)
+from src.settings import SETTINGS
 from src.token import TokenCache
 from src.types import (
+    Attachment,
     ContextModel,
     MailgunCredentials,
     ScheduledEmail,
@@ -37,9 +52,43 @@ async def return_fail_email(id_: UUID, details: str, controller: ScheduledEmailC
     return {
         "email": failed_email.model_dump(mode="json"),
         "status": failed_email.state.value,
+        "error": details,
     }
 
 
+def validate_email(email: ScheduledEmail) -> str | None:
+    """Reason why `email` can't ever be sent, found without any API requests, if any."""
+    try:
+        ContextModel(email.context_json)
+    except ValidationError as exc:
+        logger.error(f"Validation error: {exc}")
+        return f"Failed to read email context {email.pk}."
+
+    try:
+        ToHeaderModel(root=cast(list[SinglePropertyLinkModel | SingleValueLinkModel], email.to_header_context_json))
+    except ValidationError as exc:
+        logger.error(f"Validation error: {exc}")
+        return f"Failed to read email recipients {email.pk}."
+
+    if isinstance(error := analyze_templates(email.subject, email.body), TemplateSyntaxError):
+        return f"Failed to render email {email.pk}. Error: {error}"
+
+    return None
+
+
+async def fail_invalid_email(id_: UUID, details: str, controller: ScheduledEmailController) -> WorkerOutputEmail:
+    """Fail email which didn't pass `validate_email`, without locking it first."""
+    try:
+        output = await return_fail_email(id_, details, controller)
+    except httpx.HTTPStatusError as exc:
+        logger.warning(f"Failing unlocked email {id_} was rejected ({exc}), locking it first.")
+        await controller.lock_by_id(id_)
+        return await return_fail_email(id_, details, controller)
+
+    output["lock_skipped"] = True
+    return output
+
+
 async def handle_email(
     email: ScheduledEmail,
     mailgun_credentials: MailgunCredentials,
@@ -47,10 +96,17 @@ async def handle_email(
     controller: ScheduledEmailController,
     client: httpx.AsyncClient,
     token_cache: TokenCache,
+    render_planner: RenderPlanner | None = None,
+    batcher: MailgunBatcher | None = None,
+    backend: DeliveryBackend | None = None,
 ) -> WorkerOutputEmail:
     id = email.pk
     logger.info(f"Working on email {id}.")
 
+    # Emails that are broken from the start aren't locked just to be failed.
+    if (details := validate_email(email)) is not None:
+        return await fail_invalid_email(id, details, controller)
+
     locked_email = await controller.lock_by_id(id)
     logger.info(f"Locked email {id}.")
 
@@ -88,9 +144,17 @@ async def handle_email(
             controller,
         )
 
+    # Only context entries used by the templates are fetched. If templates can't be
+    # parsed, all entries are fetched and the error is reported when rendering.
+    used_variables = template_variables(locked_email.subject, locked_email.body)
+    context_links = {key: link for key, link in context.root.items() if used_variables is None or key in used_variables}
+    skipped_context_keys = sorted(context.root.keys() - context_links.keys())
+    if skipped_context_keys:
+        logger.info(f"Skipping context keys unused by email {id}: {skipped_context_keys}.")
+
     # Fetch data from API for context and recipients
     try:
-        context_dict = {key: await context_entry(link, client, token) for key, link in context.root.items()}
+        context_dict = {key: await context_entry(link, client, token) for key, link in context_links.items()}
     except (UriError, httpx.HTTPError) as exc:
         return await return_fail_email(
             id,
@@ -114,11 +178,22 @@ async def handle_email(
             controller,
         )
 
-    # Render email subject, body and recipients using JSON data from the API.
+    # Render email subject and body using JSON data from the API, then render the
+    # markdown body of the email. This is CPU-bound work, so it's handed over to the
+    # render executor. Emails with identical templates and context are rendered once.
     logger.info(f"Rendering email {id}.")
-    engine = Environment(autoescape=True, undefined=DebugUndefined)
+
+    async def render() -> tuple[str, str]:
+        return await get_render_executor().run(
+            render_email_content, locked_email.subject, locked_email.body, context_dict
+        )
+
     try:
-        rendered_email = render_email(engine, locked_email, context_dict, recipient_addresses_list)
+        if render_planner is None:
+            subject_rendered, body_html = await render()
+        else:
+            fingerprint = render_fingerprint(locked_email.subject, locked_email.body, context_dict)
+            subject_rendered, body_html = await render_planner.render(fingerprint, render)
     except TemplateError as exc:
         return await return_fail_email(
             id,
@@ -126,17 +201,28 @@ async def handle_email(
             controller,
         )
 
-    # Render the markdown body of the email
-    logger.info(f"Rendering email's MD body {id}.")
-    body_html = markdown.markdown(rendered_email.body_rendered)
-    rendered_email.body_rendered = body_html
+    rendered_email = build_rendered_email(locked_email, recipient_addresses_list, subject_rendered, body_html)
 
-    # Read attachments from S3
-    logger.info("Reading attachments from S3.")
+    # Attachments above the threshold are linked in the body with their presigned
+    # URLs, the rest is read from presigned URLs or S3.
+    logger.info("Reading attachments.")
+    fetcher = get_attachment_fetcher()
+    linked_attachments: list[tuple[Attachment, int]] = []
     try:
-        rendered_email.attachments_with_content = [
-            read_attachment_from_s3(attachment) for attachment in rendered_email.attachments
-        ]
+        if SETTINGS.ATTACHMENT_LINK_THRESHOLD_BYTES:
+            linked_attachments = await fetcher.select_linked(
+                rendered_email.attachments,
+                SETTINGS.ATTACHMENT_LINK_THRESHOLD_BYTES,
+                timedelta(seconds=SETTINGS.ATTACHMENT_LINK_MIN_VALIDITY_SECONDS),
+            )
+        rendered_email.attachments_with_content = await fetcher.fetch_all(
+            [
+                attachment
+                for attachment in rendered_email.attachments
+                if attachment not in [linked for linked, _ in linked_attachments]
+            ],
+            client,
+        )
     except Exception as exc:  # TODO: what exception actually this is? boto3 I guess
         return await return_fail_email(
             id,
@@ -144,27 +230,36 @@ async def handle_email(
             controller,
         )
 
-    try:
-        logger.info(f"Attempting to send email {id}.")
-        response = await send_email(
-            client,
-            rendered_email,
-            mailgun_credentials,
-            overwrite_outgoing_emails=overwrite_outgoing_emails,
+    if linked_attachments:
+        logger.info(f"Linking {len(linked_attachments)} attachments of email {id} instead of sending them.")
+        rendered_email.body_rendered = append_attachment_links(
+            rendered_email.body_rendered, [attachment for attachment, _ in linked_attachments]
         )
+
+    if backend is None:
+        backend = MailgunBackend(client, mailgun_credentials, overwrite_outgoing_emails, batcher)
+
+    try:
+        logger.info(f"Attempting to send email {id} with {backend.name}.")
+        details = await backend.send(rendered_email)
         logger.info(f"Sent email {id}.")
-        logger.info(f"Mailgun response: {response=}")
-        logger.info(f"Response content: {response.content!r}")
-        response.raise_for_status()
 
     except Exception as exc:
         return await return_fail_email(id, f"Failed to send email {id}. Error: {exc}", controller)
 
     else:
-        succeeded_email = await controller.succeed_by_id(
-            id, f"Email sent successfully. Mailgun response: {response.content!r}"
-        )
-        return {
+        succeeded_email = await controller.succeed_by_id(id, f"Email sent successfully. {details}")
+        output: WorkerOutputEmail = {
             "email": succeeded_email.model_dump(mode="json"),
             "status": succeeded_email.state.value,
         }
+        if skipped_context_keys:
+            output["skipped_context_keys"] = skipped_context_keys
+        if linked_attachments:
+            output["attachments_linked"] = [attachment.filename for attachment, _ in linked_attachments]
+            output["attachment_bytes_saved"] = sum(size for _, size in linked_attachments)
+        return output
+
+    finally:
+        for attachment in rendered_email.attachments_with_content:
+            attachment.close()
@@ -0,0 +1,65 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import timedelta
+import logging
+
+import httpx
+
+from src.settings import MAILGUN_API_URL, get_parameter_loader
+from src.token import TokenCache, get_token_store
+from src.types import Settings
+
+logger = logging.getLogger("amy-email-worker")
+
+# Lambda init phase is limited to 10 seconds.
+PREWARM_TIMEOUT = 5
+
+
+@dataclass
+class Prewarmed:
+    """Resources prepared during lambda init phase, reused by all invocations.
+
+    Connections pooled by the client belong to the event loop they were opened in,
+    so invocations run in `loop` instead of a new one."""
+
+    loop: asyncio.AbstractEventLoop
+    client: httpx.AsyncClient
+    token_cache: TokenCache
+
+
+async def open_connection(client: httpx.AsyncClient, url: str) -> None:
+    """Open a (TLS) connection to `url`'s host, which stays in the client's pool."""
+    await client.head(url)
+
+
+async def warm_up(client: httpx.AsyncClient, token_cache: TokenCache, settings: Settings) -> None:
+    """Load parameters, fetch API token and connect to Mailgun concurrently.
+
+    Failures are logged; whatever wasn't prepared is initialized on first use."""
+    jobs = {
+        "parameters": get_parameter_loader().get(),
+        # also opens connection to AMY API, and shares parameters loaded above
+        "API token": token_cache.get_token(),
+    }
+    if "mailgun" in (settings.DELIVERY_BACKEND, settings.DELIVERY_FAILOVER_BACKEND):
+        jobs["Mailgun connection"] = open_connection(client, MAILGUN_API_URL)
+
+    results = await asyncio.gather(*jobs.values(), return_exceptions=True)
+    for name, result in zip(jobs, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Prewarming {name} failed, it will be initialized on first use: {result!r}")
+
+
+def prewarm(settings: Settings, timeout: float = PREWARM_TIMEOUT) -> Prewarmed:
+    loop = asyncio.new_event_loop()
+    client = httpx.AsyncClient()
+    token_cache = TokenCache(client, timedelta(seconds=settings.TOKEN_REFRESH_MARGIN_SECONDS), store=get_token_store())
+
+    try:
+        loop.run_until_complete(asyncio.wait_for(warm_up(client, token_cache, settings), timeout))
+    except Exception as exc:
+        logger.warning(f"Prewarming failed, resources will be initialized on first use: {exc!r}")
+    else:
+        logger.info("Prewarmed API token, parameters and connections.")
+
+    return Prewarmed(loop, client, token_cache)
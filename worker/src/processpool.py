@@ -0,0 +1,129 @@
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+import logging
+from multiprocessing.connection import Connection
+from multiprocessing.context import ForkServerContext, SpawnContext
+from multiprocessing.process import BaseProcess
+import queue
+import threading
+from typing import Any, Callable, ParamSpec, TypeVar, cast
+
+logger = logging.getLogger("amy-email-worker")
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class WorkerProcessDied(RuntimeError):
+    pass
+
+
+def worker_main(connection: Connection, initializer: Callable[[], None] | None) -> None:
+    """Run jobs received over `connection` and send back their results, until `None`."""
+    if initializer is not None:
+        initializer()
+
+    while (job := connection.recv()) is not None:
+        func, args, kwargs = job
+        try:
+            result = (True, func(*args, **kwargs))
+        except Exception as exc:
+            result = (False, exc)
+
+        try:
+            connection.send(result)
+        except Exception as exc:
+            # result or exception which can't be pickled
+            connection.send((False, RuntimeError(f"Cannot send result of {func!r}: {exc!r}")))
+
+
+class PipeProcessPool(Executor):
+    """Worker processes, each talking to this process over its own `Pipe`.
+
+    `ProcessPoolExecutor` passes work through `multiprocessing.Queue`, which needs
+    POSIX semaphores (`/dev/shm`), not available in AWS Lambda. Pipes need nothing
+    but file descriptors.
+
+    Each job is dispatched by a thread, which holds an idle process until the job's
+    result comes back, so there's one dispatching thread per process.
+    """
+
+    max_workers: int
+    _context: ForkServerContext | SpawnContext
+    _initializer: Callable[[], None] | None
+    _idle: queue.SimpleQueue[tuple[BaseProcess, Connection]]
+    _processes: list[BaseProcess]
+    _dispatcher: ThreadPoolExecutor
+    _lock: threading.Lock
+    _shutdown: bool
+
+    def __init__(
+        self,
+        max_workers: int,
+        mp_context: ForkServerContext | SpawnContext,
+        initializer: Callable[[], None] | None = None,
+    ) -> None:
+        self.max_workers = max_workers
+        self._context = mp_context
+        self._initializer = initializer
+        self._idle = queue.SimpleQueue()
+        self._processes = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+        for _ in range(max_workers):
+            self._idle.put(self._start_worker())
+        self._dispatcher = ThreadPoolExecutor(max_workers, thread_name_prefix="render-dispatch")
+
+    def _start_worker(self) -> tuple[BaseProcess, Connection]:
+        connection, child_connection = self._context.Pipe()
+        process = self._context.Process(target=worker_main, args=(child_connection, self._initializer), daemon=True)
+        process.start()
+        # the child holds its own copy; closing ours lets recv() notice its death
+        child_connection.close()
+        with self._lock:
+            self._processes.append(process)
+        return process, connection
+
+    def _call(self, func: Callable[..., T], args: tuple[Any, ...], kwargs: dict[str, Any]) -> T:
+        process, connection = self._idle.get()
+        try:
+            connection.send((func, args, kwargs))
+            ok, result = connection.recv()
+        except (EOFError, OSError) as exc:
+            logger.warning(f"Worker process {process.pid} died, starting a new one.")
+            connection.close()
+            with self._lock:
+                if process in self._processes:
+                    self._processes.remove(process)
+            if not self._shutdown:
+                self._idle.put(self._start_worker())
+            raise WorkerProcessDied(f"Worker process {process.pid} died: {exc!r}") from exc
+
+        self._idle.put((process, connection))
+        if not ok:
+            raise result
+        return cast(T, result)
+
+    def submit(self, fn: Callable[P, T], /, *args: P.args, **kwargs: P.kwargs) -> Future[T]:
+        return self._dispatcher.submit(self._call, fn, args, kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self._shutdown = True
+        self._dispatcher.shutdown(wait=wait, cancel_futures=cancel_futures)
+        while True:
+            try:
+                _, connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+
+        with self._lock:
+            processes, self._processes = self._processes, []
+        for process in processes:
+            if wait:
+                process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
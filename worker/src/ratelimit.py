@@ -0,0 +1,162 @@
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import functools
+import logging
+import time
+from typing import Awaitable, Callable
+
+import httpx
+
+from src.settings import SETTINGS
+
+logger = logging.getLogger("amy-email-worker")
+
+# Throttled requests are retried this many times before the response is returned.
+THROTTLED_RETRIES = 3
+# Waiting requests check the limiter again at least this often, so that a higher
+# rate shortens their wait.
+RECHECK_SECONDS = 0.1
+
+
+def parse_retry_after(value: str | None, current_time: datetime) -> float | None:
+    """Seconds to wait according to `Retry-After` header (delay or HTTP date)."""
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - current_time).total_seconds(), 0.0)
+
+
+class AdaptiveRateLimiter:
+    """Token bucket with rate controlled by additive increase, multiplicative decrease.
+
+    Every successful request increases the rate by `increase / rate`, i.e. by about
+    `increase` requests per second every second at full throughput. A throttled
+    request cuts the rate by `decrease` (at most once per second, as requests in
+    flight are throttled together), and `Retry-After` pauses all requests. The rate
+    settles just below the highest one accepted by the server.
+
+    Waiting requests check tokens, the current rate and the pause again every time
+    they wake up (at least every `RECHECK_SECONDS`), so that rate changes apply to
+    requests already waiting.
+
+    Limiter holds no event loop objects, so it's shared between invocations.
+    """
+
+    rate: float
+    min_rate: float
+    max_rate: float
+    increase: float
+    decrease: float
+    burst: float
+    throttled: int
+    _tokens: float
+    _updated: float
+    _paused_until: float
+    _last_decrease: float
+    _clock: Callable[[], float]
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        burst: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if not 0 < min_rate <= rate <= max_rate:
+            raise ValueError(f"Rates must satisfy 0 < {min_rate=} <= {rate=} <= {max_rate=}.")
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.throttled = 0
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._paused_until = float("-inf")
+        self._last_decrease = float("-inf")
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available now, and return 0. Otherwise return seconds
+        to wait before trying again, at the current rate."""
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        delay = max((1 - self._tokens) / self.rate, self._paused_until - now)
+        if delay > 0:
+            return delay
+        self._tokens -= 1
+        return 0.0
+
+    async def acquire(self) -> None:
+        while (delay := self.try_acquire()) > 0:
+            await asyncio.sleep(min(delay, RECHECK_SECONDS))
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttled(self, retry_after: float | None = None) -> None:
+        self.throttled += 1
+        now = self._clock()
+
+        if now - self._last_decrease >= 1:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._last_decrease = now
+
+        if retry_after is not None:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+        logger.info(f"Request throttled, rate lowered to {self.rate:.2f}/s, retry after {retry_after}s.")
+
+
+async def send_rate_limited(
+    limiter: AdaptiveRateLimiter | None,
+    send: Callable[[], Awaitable[httpx.Response]],
+    retries: int = THROTTLED_RETRIES,
+) -> httpx.Response:
+    """Send request when the limiter allows, and retry it when throttled.
+
+    Without a limiter, the request is sent right away and never retried."""
+    if limiter is None:
+        return await send()
+
+    for _ in range(retries):
+        await limiter.acquire()
+        response = await send()
+        if response.status_code != httpx.codes.TOO_MANY_REQUESTS:
+            limiter.on_success()
+            return response
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After"), datetime.now(tz=timezone.utc))
+        limiter.on_throttled(retry_after)
+
+    await limiter.acquire()
+    return await send()
+
+
+@functools.cache
+def get_mailgun_rate_limiter() -> AdaptiveRateLimiter | None:
+    """Mailgun rate limiter shared by all invocations handled in this process, unless
+    disabled with `MAILGUN_RATE_LIMIT=0`."""
+    if not SETTINGS.MAILGUN_RATE_LIMIT:
+        return None
+    return AdaptiveRateLimiter(
+        rate=SETTINGS.MAILGUN_RATE_LIMIT,
+        min_rate=1,
+        max_rate=SETTINGS.MAILGUN_MAX_RATE_LIMIT,
+    )
@@ -0,0 +1,295 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import queue
+from typing import Any, Awaitable, Callable, Iterable, ParamSpec, TypeVar
+
+from jinja2 import (
+    BaseLoader,
+    BytecodeCache,
+    DebugUndefined,
+    Environment,
+    FileSystemBytecodeCache,
+    meta,
+)
+from jinja2.bccache import Bucket
+from jinja2.exceptions import TemplateError, TemplateSyntaxError
+import markdown
+
+from src.cache import evict_least_recently_used
+from src.processpool import PipeProcessPool
+from src.settings import SETTINGS
+from src.types import RenderExecutorKind
+
+logger = logging.getLogger("amy-email-worker")
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class StringLoader(BaseLoader):
+    """Loader which treats template name as the template source.
+
+    `Environment.from_string` bypasses both environment's template cache and its
+    bytecode cache. Loading sources through `Environment.get_template` with this
+    loader enables both of them for templates stored in the database.
+    """
+
+    def get_source(self, environment: Environment, template: str) -> tuple[str, str | None, Callable[[], bool]]:
+        return template, None, lambda: True
+
+
+class BoundedFileSystemBytecodeCache(FileSystemBytecodeCache):
+    """File system bytecode cache with size-bounded, least-recently-used eviction.
+
+    Cache files are touched when loaded, so their modification time reflects
+    last use. After every write the oldest files are removed until the cache fits
+    in `max_bytes`.
+    """
+
+    max_bytes: int
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        super().__init__(directory)
+        self.max_bytes = max_bytes
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        super().load_bytecode(bucket)
+        if bucket.code is not None:
+            with contextlib.suppress(OSError):
+                os.utime(self._get_cache_filename(bucket))
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        super().dump_bytecode(bucket)
+        self.evict()
+
+    def evict(self) -> None:
+        evict_least_recently_used(Path(self.directory).glob(self.pattern % ("*",)), self.max_bytes)
+
+
+def create_engine(bytecode_cache: BytecodeCache | None = None) -> Environment:
+    return Environment(
+        autoescape=True,
+        undefined=DebugUndefined,
+        loader=StringLoader(),
+        bytecode_cache=bytecode_cache,
+    )
+
+
+def create_bytecode_cache(directory: str, max_bytes: int) -> BytecodeCache | None:
+    if not directory:
+        return None
+
+    try:
+        return BoundedFileSystemBytecodeCache(directory, max_bytes)
+    except OSError as exc:
+        logger.warning(f"Template bytecode cache in {directory!r} disabled: {exc}")
+        return None
+
+
+@functools.cache
+def get_engine() -> Environment:
+    """Rendering engine shared by all emails handled in this process."""
+    return create_engine(
+        create_bytecode_cache(
+            SETTINGS.TEMPLATE_BYTECODE_CACHE_DIR,
+            SETTINGS.TEMPLATE_BYTECODE_CACHE_MAX_BYTES,
+        )
+    )
+
+
+class MarkdownConverter:
+    """Converts Markdown to HTML using a pool of reusable `markdown.Markdown` instances.
+
+    `markdown.markdown()` builds a new instance, with all its extensions and processors,
+    for every call. Here instances are reset after use and returned to the pool. Output
+    is memoized for up to `cache_size` distinct texts, as bulk sends often render
+    identical bodies.
+    """
+
+    _pool: queue.SimpleQueue[markdown.Markdown]
+    convert: Callable[[str], str]
+
+    def __init__(self, cache_size: int) -> None:
+        self._pool = queue.SimpleQueue()
+        self.convert = functools.lru_cache(maxsize=cache_size)(self._convert)
+
+    def _convert(self, text: str) -> str:
+        try:
+            converter = self._pool.get_nowait()
+        except queue.Empty:
+            converter = markdown.Markdown()
+
+        try:
+            return converter.convert(text)
+        finally:
+            converter.reset()
+            self._pool.put(converter)
+
+
+@functools.cache
+def get_markdown_converter() -> MarkdownConverter:
+    """Markdown converter shared by all emails handled in this process."""
+    return MarkdownConverter(SETTINGS.MARKDOWN_CACHE_SIZE)
+
+
+@functools.lru_cache(maxsize=256)
+def analyze_templates(*templates: str) -> frozenset[str] | TemplateSyntaxError:
+    """Names of undeclared variables the templates use, e.g. context keys, or syntax
+    error of the first template that can't be parsed.
+
+    Templates of an email are parsed once, both to validate and to render it.
+    """
+    engine = get_engine()
+    variables: set[str] = set()
+    try:
+        for template in templates:
+            variables |= meta.find_undeclared_variables(engine.parse(template))
+    except TemplateSyntaxError as exc:
+        # cached errors shouldn't keep parser's frames alive
+        return exc.with_traceback(None)
+    return frozenset(variables)
+
+
+def template_variables(*templates: str) -> frozenset[str] | None:
+    """Names of undeclared variables the templates use, or `None` if any template
+    can't be parsed."""
+    variables = analyze_templates(*templates)
+    return None if isinstance(variables, TemplateSyntaxError) else variables
+
+
+def preload_templates(templates: Iterable[str]) -> None:
+    """Compile templates into the engine's cache of the current process.
+
+    Invalid templates are skipped here; their errors are reported when rendering.
+    """
+    engine = get_engine()
+    for template in templates:
+        with contextlib.suppress(TemplateError):
+            engine.get_template(template)
+
+
+def initialize_worker() -> None:
+    """Set up rendering engine and Markdown converter in a new worker process."""
+    get_engine()
+    get_markdown_converter()
+
+
+class RenderExecutor:
+    """Runs CPU-bound rendering inline, in a thread pool or in a process pool.
+
+    Rendering inline blocks the event loop, and with it all in-flight HTTP requests.
+    A thread pool keeps the loop responsive, a process pool additionally uses all
+    available CPUs.
+    """
+
+    kind: RenderExecutorKind
+    max_workers: int
+    _executor: Executor | None
+
+    def __init__(self, kind: RenderExecutorKind, max_workers: int = 0) -> None:
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+
+        if kind == "process":
+            try:
+                # Forking a process that already runs threads (e.g. S3 downloads) is
+                # unsafe, so workers are started from a clean fork server. Pipes work
+                # in AWS Lambda, which doesn't provide /dev/shm for ProcessPoolExecutor.
+                self._executor = PipeProcessPool(
+                    self.max_workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=initialize_worker,
+                )
+            except OSError as exc:
+                logger.warning(f"Cannot start rendering processes, using threads instead: {exc}")
+                self.kind = "thread"
+
+        if self.kind == "thread":
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="render")
+
+    async def run(self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        if self._executor is None:
+            return func(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def preload(self, templates: Iterable[str]) -> None:
+        """Compile templates before rendering starts.
+
+        Threads share the engine of this process, so it's enough to compile templates
+        once. Work submitted to a process pool can't be pinned to a process, so a
+        preload job is submitted per worker; the bytecode cache lets processes that
+        missed the job load templates compiled by the others.
+        """
+        unique_templates = list(dict.fromkeys(templates))
+        jobs = self.max_workers if self.kind == "process" else 1
+        await asyncio.gather(*[self.run(preload_templates, unique_templates) for _ in range(jobs)])
+
+
+@functools.cache
+def get_render_executor() -> RenderExecutor:
+    """Render executor shared by all invocations handled in this process."""
+    return RenderExecutor(SETTINGS.RENDER_EXECUTOR, SETTINGS.RENDER_WORKERS)
+
+
+def render_fingerprint(subject: str, body: str, context: dict[str, Any]) -> str:
+    """Fingerprint of template sources and the resolved context they're rendered with."""
+    payload = json.dumps([subject, body, context], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class RenderPlanner:
+    """Renders each distinct fingerprint only once per batch of emails.
+
+    Bulk campaigns produce many emails with identical subject, body and context, which
+    differ only in recipients. The first email with a given fingerprint renders it,
+    the rest of its group reuses (or awaits) that result.
+
+    Only `max_results` finished renders are kept, least recently used are dropped
+    first; personalized emails each have their own fingerprint, and their rendered
+    bodies shouldn't be held for the whole invocation. Renders in progress are kept
+    until they finish.
+    """
+
+    max_results: int
+    renders: int
+    renders_saved: int
+    _results: OrderedDict[str, asyncio.Task[tuple[str, str]]]
+
+    def __init__(self, max_results: int = 64) -> None:
+        self.max_results = max_results
+        self.renders = 0
+        self.renders_saved = 0
+        self._results = OrderedDict()
+
+    def _evict(self) -> None:
+        finished = [fingerprint for fingerprint, task in self._results.items() if task.done()]
+        for fingerprint in finished[: max(len(self._results) - self.max_results, 0)]:
+            del self._results[fingerprint]
+
+    async def render(self, fingerprint: str, render: Callable[[], Awaitable[tuple[str, str]]]) -> tuple[str, str]:
+        task = self._results.get(fingerprint)
+
+        if task is None:
+            task = asyncio.ensure_future(render())
+            self._results[fingerprint] = task
+            self.renders += 1
+            self._evict()
+        else:
+            self._results.move_to_end(fingerprint)
+            self.renders_saved += 1
+
+        # Shielded, so that cancelling one email doesn't cancel rendering for its group.
+        return await asyncio.shield(task)
@@ -0,0 +1,99 @@
+from abc import ABC, abstractmethod
+from datetime import UTC, datetime
+import json
+import logging
+from pathlib import Path
+import tempfile
+from typing import BinaryIO, TextIO, cast
+from uuid import uuid4
+
+from src.aws import upload_s3_fileobj
+from src.types import CompactWorkerOutputEmail, Settings, WorkerOutputEmail
+
+logger = logging.getLogger("amy-email-worker")
+
+# records are kept in memory up to this size before being spooled to disk
+RESULTS_SPOOL_BYTES = 1024 * 1024
+
+
+def compact_output(output: WorkerOutputEmail) -> CompactWorkerOutputEmail:
+    """Primary key, status, duration and error of a handled email, without its content."""
+    compact: CompactWorkerOutputEmail = {"pk": output["email"]["pk"], "status": output["status"]}
+    if "duration_seconds" in output:
+        compact["duration_seconds"] = output["duration_seconds"]
+    if "error" in output:
+        compact["error"] = output["error"]
+    return compact
+
+
+def results_name(current_time: datetime) -> str:
+    """Unique name of results file of one invocation, sortable by time."""
+    return f"{current_time:%Y-%m-%dT%H%M%S}-{uuid4()}.ndjson"
+
+
+class ResultSink(ABC):
+    """Receives full records of handled emails as they complete, one JSON per line."""
+
+    @abstractmethod
+    def write(self, output: WorkerOutputEmail) -> None: ...
+
+    @abstractmethod
+    def close(self) -> str:
+        """Finish writing, and return location of the records."""
+
+
+class FileResultSink(ResultSink):
+    path: Path
+    _file: TextIO
+
+    def __init__(self, directory: str, name: str) -> None:
+        self.path = Path(directory) / name
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("w", encoding="utf-8")
+
+    def write(self, output: WorkerOutputEmail) -> None:
+        self._file.write(json.dumps(output) + "\n")
+        # records of already handled emails survive the invocation timing out
+        self._file.flush()
+
+    def close(self) -> str:
+        self._file.close()
+        return str(self.path)
+
+
+class S3ResultSink(ResultSink):
+    """Records are spooled to a temporary file and uploaded when closed."""
+
+    bucket: str
+    path: str
+    _file: BinaryIO
+
+    def __init__(self, bucket: str, path: str) -> None:
+        self.bucket = bucket
+        self.path = path
+        self._file = cast(BinaryIO, tempfile.SpooledTemporaryFile(max_size=RESULTS_SPOOL_BYTES))
+
+    def write(self, output: WorkerOutputEmail) -> None:
+        self._file.write(json.dumps(output).encode() + b"\n")
+
+    def close(self) -> str:
+        try:
+            upload_s3_fileobj(self.bucket, self.path, self._file)
+        finally:
+            self._file.close()
+        return f"s3://{self.bucket}/{self.path}"
+
+
+def create_result_sink(settings: Settings, current_time: datetime | None = None) -> ResultSink | None:
+    """Sink selected by `RESULT_SINK`, writing records of this invocation."""
+    name = results_name(current_time or datetime.now(tz=UTC))
+    match settings.RESULT_SINK:
+        case "file":
+            return FileResultSink(settings.RESULT_SINK_DIR, name)
+        case "s3" if settings.RESULT_SINK_S3_BUCKET:
+            return S3ResultSink(settings.RESULT_SINK_S3_BUCKET, f"results/{name}")
+        case "s3":
+            logger.warning("RESULT_SINK_S3_BUCKET isn't set, email records won't be written.")
+            return None
+        case _:
+            return None
@@ -0,0 +1,122 @@
+"""Sending scheduled emails, imported by `main` only when there are emails to send.
+
+Rendering (Jinja2, Markdown) and delivery modules are comparatively slow to import,
+and most invocations don't need them.
+"""
+
+import asyncio
+import logging
+import time
+
+import httpx
+
+from src.admission import MemoryAdmissionController, estimate_email_bytes, memory_budget
+from src.api import ScheduledEmailController
+from src.batching import MailgunBatcher
+from src.delivery import create_delivery_backend
+from src.handler import handle_email
+from src.ratelimit import get_mailgun_rate_limiter
+from src.rendering import RenderPlanner, get_render_executor
+from src.results import compact_output, create_result_sink
+from src.settings import SETTINGS, get_parameter_loader
+from src.token import TokenCache
+from src.types import (
+    CompactWorkerOutputEmail,
+    ScheduledEmail,
+    WorkerOutput,
+    WorkerOutputEmail,
+)
+
+logger = logging.getLogger("amy-email-worker")
+
+
+async def send_emails(
+    emails: list[ScheduledEmail],
+    client: httpx.AsyncClient,
+    controller: ScheduledEmailController,
+    token_cache: TokenCache,
+    overwrite_outgoing_emails: str,
+) -> WorkerOutput:
+    result: WorkerOutput = {"emails": []}
+
+    # Parameters were already loaded (all in one request) to obtain the API token.
+    parameters = await get_parameter_loader().get()
+    mailgun_credentials = parameters.MAILGUN_CREDENTIALS
+    logger.info("Obtained credentials for Mailgun.")
+
+    # Outgoing emails override sends all emails to one address, so they are never batched.
+    batcher = (
+        MailgunBatcher(client, mailgun_credentials, SETTINGS.MAILGUN_BATCH_WINDOW_MS / 1000)
+        if SETTINGS.MAILGUN_BATCH_WINDOW_MS and not overwrite_outgoing_emails
+        else None
+    )
+    backend = create_delivery_backend(
+        SETTINGS,
+        client,
+        mailgun_credentials,
+        overwrite_outgoing_emails,
+        batcher,
+        parameters.SMTP_CREDENTIALS,
+    )
+    logger.info(f"Delivery backend: {backend.name}")
+
+    await get_render_executor().preload(template for email in emails for template in (email.subject, email.body))
+    render_planner = RenderPlanner()
+
+    admission = MemoryAdmissionController(memory_budget(SETTINGS))
+
+    result_sink = create_result_sink(SETTINGS)
+    lock_requests_saved = 0
+
+    async def admit_and_handle_email(email: ScheduledEmail) -> WorkerOutputEmail:
+        nonlocal lock_requests_saved
+        async with admission.reserve(estimate_email_bytes(email, SETTINGS.ATTACHMENT_SPOOL_BYTES)):
+            start = time.perf_counter()
+            output = await handle_email(
+                email,
+                mailgun_credentials,
+                overwrite_outgoing_emails,
+                controller,
+                client,
+                token_cache,
+                render_planner=render_planner,
+                batcher=batcher,
+                backend=backend,
+            )
+        output["duration_seconds"] = round(time.perf_counter() - start, 3)
+        if output.get("lock_skipped"):
+            lock_requests_saved += 1
+        if result_sink is not None:
+            result_sink.write(output)
+        return output
+
+    async def admit_and_handle_email_compact(email: ScheduledEmail) -> CompactWorkerOutputEmail:
+        # full output is dropped as soon as the email is handled
+        return compact_output(await admit_and_handle_email(email))
+
+    try:
+        if SETTINGS.OUTPUT_MODE == "compact":
+            result["emails"] = await asyncio.gather(*[admit_and_handle_email_compact(email) for email in emails])
+        else:
+            result["emails"] = await asyncio.gather(*[admit_and_handle_email(email) for email in emails])
+    finally:
+        if result_sink is not None:
+            result["results_location"] = await asyncio.to_thread(result_sink.close)
+            logger.info(f"Email records written to {result['results_location']}.")
+
+    result["renders_saved"] = render_planner.renders_saved
+    result["admission_delayed"] = admission.delayed
+    result["lock_requests_saved"] = lock_requests_saved
+    logger.info(f"Failed {lock_requests_saved} invalid emails without locking them.")
+    if (limiter := get_mailgun_rate_limiter()) is not None:
+        result["mailgun_rate"] = round(limiter.rate, 2)
+        logger.info(f"Mailgun rate limit {limiter.rate:.2f}/s, {limiter.throttled} requests throttled so far.")
+    if batcher is not None:
+        result["mailgun_requests_saved"] = batcher.requests_saved
+        logger.info(f"Sent {batcher.emails} emails in {batcher.requests} Mailgun requests.")
+    logger.info(f"Rendered {render_planner.renders} emails, reused {render_planner.renders_saved} renders.")
+    logger.info(
+        f"Memory budget {admission.budget_bytes} bytes, peak {admission.peak_bytes} bytes in flight, "
+        f"{admission.delayed} emails delayed."
+    )
+    return result
@@ -1,9 +1,30 @@
+import asyncio
 import functools
+import logging
 import os
-from typing import cast
+import time
+from typing import Callable, Protocol, cast
 
-from src.aws import get_parameter_value, read_ssm_parameter
-from src.types import Credentials, MailgunCredentials, Settings, Stage
+from src.aws import get_parameter_value, read_ssm_parameters
+from src.types import (
+    Credentials,
+    DeliveryBackendKind,
+    MailgunCredentials,
+    OutputMode,
+    ParameterStoreKind,
+    RenderExecutorKind,
+    ResultSinkKind,
+    Settings,
+    Stage,
+    TokenStoreKind,
+    WorkerParameters,
+)
+
+logger = logging.getLogger("amy-email-worker")
+
+DELIVERY_BACKENDS = ["mailgun", "smtp", "file", "null"]
+
+MAILGUN_API_URL = "https://api.mailgun.net"
 
 
 def read_settings_from_env() -> Settings:
@@ -13,6 +34,77 @@ def read_settings_from_env() -> Settings:
             cast(Stage, stage) if (stage := os.getenv("STAGE", "staging")) in ["production", "staging"] else "staging"
         ),
         API_BASE_URL=os.getenv("API_BASE_URL") or "http://localhost:8000/api",
+        TEMPLATE_BYTECODE_CACHE_DIR=os.getenv("TEMPLATE_BYTECODE_CACHE_DIR") or "",
+        TEMPLATE_BYTECODE_CACHE_MAX_BYTES=int(os.getenv("TEMPLATE_BYTECODE_CACHE_MAX_BYTES") or 16 * 1024 * 1024),
+        MARKDOWN_CACHE_SIZE=int(os.getenv("MARKDOWN_CACHE_SIZE") or 256),
+        RENDER_EXECUTOR=(
+            cast(RenderExecutorKind, executor)
+            if (executor := os.getenv("RENDER_EXECUTOR", "inline")) in ["inline", "thread", "process"]
+            else "inline"
+        ),
+        # 0 means one worker per available CPU
+        RENDER_WORKERS=int(os.getenv("RENDER_WORKERS") or 0),
+        # boto3 clients keep up to 10 connections in their pool
+        S3_DOWNLOAD_CONCURRENCY=int(os.getenv("S3_DOWNLOAD_CONCURRENCY") or 8),
+        ATTACHMENT_CACHE_MEMORY_BYTES=int(os.getenv("ATTACHMENT_CACHE_MEMORY_BYTES") or 16 * 1024 * 1024),
+        ATTACHMENT_CACHE_DIR=os.getenv("ATTACHMENT_CACHE_DIR") or "",
+        ATTACHMENT_CACHE_DISK_BYTES=int(os.getenv("ATTACHMENT_CACHE_DISK_BYTES") or 256 * 1024 * 1024),
+        ATTACHMENT_SPOOL_BYTES=int(os.getenv("ATTACHMENT_SPOOL_BYTES") or 1024 * 1024),
+        # 0 means ETags of S3 objects are looked up for every email
+        ATTACHMENT_INFO_TTL_SECONDS=int(os.getenv("ATTACHMENT_INFO_TTL_SECONDS") or 60),
+        # set by lambda runtime
+        LAMBDA_MEMORY_SIZE_MB=int(os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE") or 0),
+        # 0 means derived from lambda memory size
+        ADMISSION_MEMORY_BYTES=int(os.getenv("ADMISSION_MEMORY_BYTES") or 0),
+        # 0 means attachments are never linked
+        ATTACHMENT_LINK_THRESHOLD_BYTES=int(os.getenv("ATTACHMENT_LINK_THRESHOLD_BYTES") or 0),
+        # linked presigned URLs stay valid for at least this long (default 7 days)
+        ATTACHMENT_LINK_MIN_VALIDITY_SECONDS=int(os.getenv("ATTACHMENT_LINK_MIN_VALIDITY_SECONDS") or 7 * 24 * 3600),
+        # 0 means emails are sent one by one
+        MAILGUN_BATCH_WINDOW_MS=int(os.getenv("MAILGUN_BATCH_WINDOW_MS") or 0),
+        # requests per second; initial rate adapts to Mailgun throttling up to the maximum
+        # 0 means Mailgun requests aren't rate limited
+        MAILGUN_RATE_LIMIT=(rate_limit := max(int(os.getenv("MAILGUN_RATE_LIMIT") or 10), 0)),
+        MAILGUN_MAX_RATE_LIMIT=max(int(os.getenv("MAILGUN_MAX_RATE_LIMIT") or 100), rate_limit),
+        DELIVERY_BACKEND=(
+            cast(DeliveryBackendKind, backend)
+            if (backend := os.getenv("DELIVERY_BACKEND", "mailgun")) in DELIVERY_BACKENDS
+            else "mailgun"
+        ),
+        DELIVERY_FAILOVER_BACKEND=(
+            cast(DeliveryBackendKind, failover_backend)
+            if (failover_backend := os.getenv("DELIVERY_FAILOVER_BACKEND", "")) in DELIVERY_BACKENDS
+            else None
+        ),
+        DELIVERY_SINK_DIR=os.getenv("DELIVERY_SINK_DIR") or "/tmp/amy-email-worker/outbox",
+        SMTP_HOST=os.getenv("SMTP_HOST") or "localhost",
+        SMTP_PORT=int(os.getenv("SMTP_PORT") or 587),
+        SMTP_STARTTLS=(os.getenv("SMTP_STARTTLS") or "true").lower() == "true",
+        SMTP_POOL_SIZE=int(os.getenv("SMTP_POOL_SIZE") or 4),
+        PARAMETER_CACHE_TTL_SECONDS=int(os.getenv("PARAMETER_CACHE_TTL_SECONDS") or 300),
+        PREWARM=(os.getenv("PREWARM") or "false").lower() == "true",
+        TOKEN_REFRESH_MARGIN_SECONDS=int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS") or 60),
+        PARAMETER_STORE=(
+            cast(ParameterStoreKind, store)
+            if (store := os.getenv("PARAMETER_STORE", "ssm")) in ["ssm", "local"]
+            else "ssm"
+        ),
+        TOKEN_STORE=(
+            cast(TokenStoreKind, store)
+            if (store := os.getenv("TOKEN_STORE", "none")) in ["none", "memory", "file"]
+            else "none"
+        ),
+        TOKEN_STORE_PATH=os.getenv("TOKEN_STORE_PATH") or "/tmp/amy-email-worker/token",
+        OUTPUT_MODE=(
+            cast(OutputMode, mode) if (mode := os.getenv("OUTPUT_MODE", "full")) in ["full", "compact"] else "full"
+        ),
+        RESULT_SINK=(
+            cast(ResultSinkKind, sink)
+            if (sink := os.getenv("RESULT_SINK", "none")) in ["none", "file", "s3"]
+            else "none"
+        ),
+        RESULT_SINK_DIR=os.getenv("RESULT_SINK_DIR") or "/tmp/amy-email-worker/results",
+        RESULT_SINK_S3_BUCKET=os.getenv("RESULT_SINK_S3_BUCKET") or "",
     )
 
 
@@ -20,35 +112,163 @@ SETTINGS = read_settings_from_env()
 STAGE = SETTINGS.STAGE
 
 
-def read_mailgun_credentials() -> MailgunCredentials:
-    # TODO: turn into async
-    api_key_parameter = read_ssm_parameter(f"/{STAGE}/email-worker/mailgun_key")
-    api_key = get_parameter_value(api_key_parameter) if api_key_parameter else "fakeKey"
+# Parameters read from SSM, by path
+MAILGUN_KEY_PARAMETER = f"/{STAGE}/email-worker/mailgun_key"
+MAILGUN_SENDER_DOMAIN_PARAMETER = f"/{STAGE}/email-worker/mailgun_sender_domain"
+TOKEN_USERNAME_PARAMETER = f"/{STAGE}/email-worker/token_username"
+TOKEN_PASSWORD_PARAMETER = f"/{STAGE}/email-worker/token_password"
+SMTP_USERNAME_PARAMETER = f"/{STAGE}/email-worker/smtp_username"
+SMTP_PASSWORD_PARAMETER = f"/{STAGE}/email-worker/smtp_password"
+S3_BUCKET_PARAMETER = f"/{STAGE}/amy/email_attachments_bucket_name"
+PARAMETER_PATHS = [
+    MAILGUN_KEY_PARAMETER,
+    MAILGUN_SENDER_DOMAIN_PARAMETER,
+    TOKEN_USERNAME_PARAMETER,
+    TOKEN_PASSWORD_PARAMETER,
+    S3_BUCKET_PARAMETER,
+]
+# only exist in deployments delivering emails over SMTP
+SMTP_PARAMETER_PATHS = [
+    SMTP_USERNAME_PARAMETER,
+    SMTP_PASSWORD_PARAMETER,
+]
+
+
+def parameter_paths(settings: Settings) -> list[str]:
+    """Paths of parameters used with configured delivery backends."""
+    if "smtp" in (settings.DELIVERY_BACKEND, settings.DELIVERY_FAILOVER_BACKEND):
+        return PARAMETER_PATHS + SMTP_PARAMETER_PATHS
+    return PARAMETER_PATHS
+
+
+class ParameterStore(Protocol):
+    def get_parameters(self, paths: list[str]) -> dict[str, str]:
+        """Values of existing parameters, by path."""
+        ...
 
-    sender_domain_parameter = read_ssm_parameter(f"/{STAGE}/email-worker/mailgun_sender_domain")
-    sender_domain = get_parameter_value(sender_domain_parameter) if sender_domain_parameter else ""
-    return MailgunCredentials(
-        MAILGUN_SENDER_DOMAIN=sender_domain,
-        MAILGUN_API_KEY=api_key,
-    )
 
+class SSMParameterStore:
+    def get_parameters(self, paths: list[str]) -> dict[str, str]:
+        return {path: get_parameter_value(parameter) for path, parameter in read_ssm_parameters(paths).items()}
 
-def read_token_credentials_from_ssm() -> Credentials:
-    # TODO: turn into async
-    token_user_parameter = read_ssm_parameter(f"/{STAGE}/email-worker/token_username")
-    token_password_parameter = read_ssm_parameter(f"/{STAGE}/email-worker/token_password")
 
-    token_user = get_parameter_value(token_user_parameter) if token_user_parameter else "email_worker_account"
-    token_password = get_parameter_value(token_password_parameter) if token_password_parameter else "fakePassword"
+class LocalParameterStore:
+    """In-memory stand-in for SSM, for tests and running the worker without AWS."""
 
-    return Credentials(
-        USER=token_user,
-        PASSWORD=token_password,
+    values: dict[str, str]
+    requests: int
+
+    def __init__(self, values: dict[str, str] | None = None) -> None:
+        self.values = values or {}
+        self.requests = 0
+
+    def get_parameters(self, paths: list[str]) -> dict[str, str]:
+        self.requests += 1
+        return {path: self.values[path] for path in paths if path in self.values}
+
+
+def worker_parameters(values: dict[str, str]) -> WorkerParameters:
+    """Parameters with defaults (suitable for local development) for missing values."""
+    return WorkerParameters(
+        MAILGUN_CREDENTIALS=MailgunCredentials(
+            MAILGUN_SENDER_DOMAIN=values.get(MAILGUN_SENDER_DOMAIN_PARAMETER, ""),
+            MAILGUN_API_KEY=values.get(MAILGUN_KEY_PARAMETER, "fakeKey"),
+        ),
+        TOKEN_CREDENTIALS=Credentials(
+            USER=values.get(TOKEN_USERNAME_PARAMETER, "email_worker_account"),
+            PASSWORD=values.get(TOKEN_PASSWORD_PARAMETER, "fakePassword"),
+        ),
+        SMTP_CREDENTIALS=Credentials(
+            USER=values.get(SMTP_USERNAME_PARAMETER, ""),
+            PASSWORD=values.get(SMTP_PASSWORD_PARAMETER, ""),
+        ),
+        S3_BUCKET=values.get(S3_BUCKET_PARAMETER, "fakeBucket"),
     )
 
 
+class ParameterLoader:
+    """Loads all worker parameters with a single batched request, off the event loop.
+
+    Loaded parameters are cached for `ttl` seconds, also between warm invocations,
+    so that rotated parameters take effect within the TTL. Callers should
+    `invalidate` them when credentials are rejected. Concurrent readers share a load
+    in progress."""
+
+    store: ParameterStore
+    ttl: float
+    paths: list[str]
+    parameters: WorkerParameters | None
+    _expires_at: float
+    _loading: asyncio.Task[WorkerParameters] | None
+    _clock: Callable[[], float]
+
+    def __init__(
+        self,
+        store: ParameterStore,
+        ttl: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+        paths: list[str] = PARAMETER_PATHS,
+    ) -> None:
+        self.store = store
+        self.ttl = ttl
+        self.paths = paths
+        self.parameters = None
+        self._expires_at = float("-inf")
+        self._loading = None
+        self._clock = clock
+
+    def _load(self) -> WorkerParameters:
+        self.parameters = worker_parameters(self.store.get_parameters(self.paths))
+        self._expires_at = self._clock() + self.ttl
+        return self.parameters
+
+    def _loading_in_current_loop(self) -> asyncio.Task[WorkerParameters] | None:
+        # Tasks of previous invocations belong to event loops which are closed already.
+        if self._loading is None or self._loading.get_loop() is not asyncio.get_running_loop():
+            return None
+        return self._loading
+
+    def invalidate(self) -> None:
+        """Reload parameters on next read, e.g. after credentials were rejected."""
+        logger.info("Parameters invalidated.")
+        self._expires_at = float("-inf")
+
+    async def load(self) -> WorkerParameters:
+        """(Re)load parameters, unless they are being loaded already."""
+        loading = self._loading_in_current_loop()
+        if loading is None or loading.done():
+            loading = self._loading = asyncio.ensure_future(asyncio.to_thread(self._load))
+        # Shielded, so that cancelling one reader doesn't cancel load for others.
+        return await asyncio.shield(loading)
+
+    async def get(self) -> WorkerParameters:
+        """Cached parameters, loaded again once expired."""
+        loading = self._loading_in_current_loop()
+        if loading is not None and not loading.done():
+            return await asyncio.shield(loading)
+        if self.parameters is not None and self._clock() < self._expires_at:
+            return self.parameters
+        return await self.load()
+
+
 @functools.cache
-def read_s3_bucket_from_ssm() -> str:
-    bucket_parameter = read_ssm_parameter(f"/{STAGE}/amy/email_attachments_bucket_name")
-    bucket = get_parameter_value(bucket_parameter) if bucket_parameter else "fakeBucket"
-    return bucket
+def get_parameter_loader() -> ParameterLoader:
+    """Parameter loader shared by all invocations handled in this process."""
+    store: ParameterStore = LocalParameterStore() if SETTINGS.PARAMETER_STORE == "local" else SSMParameterStore()
+    return ParameterLoader(store, SETTINGS.PARAMETER_CACHE_TTL_SECONDS, paths=parameter_paths(SETTINGS))
+
+
+async def read_mailgun_credentials() -> MailgunCredentials:
+    return (await get_parameter_loader().get()).MAILGUN_CREDENTIALS
+
+
+async def read_token_credentials_from_ssm() -> Credentials:
+    return (await get_parameter_loader().get()).TOKEN_CREDENTIALS
+
+
+async def read_smtp_credentials() -> Credentials:
+    return (await get_parameter_loader().get()).SMTP_CREDENTIALS
+
+
+async def read_s3_bucket_from_ssm() -> str:
+    return (await get_parameter_loader().get()).S3_BUCKET
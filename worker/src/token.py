@@ -1,42 +1,191 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
+import functools
+import logging
+import os
+from pathlib import Path
+import tempfile
+from typing import Protocol
 
 import httpx
+from pydantic import ValidationError
 
-from src.settings import SETTINGS, read_token_credentials_from_ssm
+from src.settings import (
+    SETTINGS,
+    get_parameter_loader,
+    read_token_credentials_from_ssm,
+)
 from src.types import AuthToken
 
+logger = logging.getLogger("amy-email-worker")
+
+
+class TokenStore(Protocol):
+    """Keeps API token between invocations."""
+
+    def load(self) -> AuthToken | None: ...
+
+    def save(self, token: AuthToken) -> None: ...
+
+    def clear(self) -> None: ...
+
+
+class MemoryTokenStore:
+    """Token kept in process memory, available to warm invocations."""
+
+    token: AuthToken | None
+
+    def __init__(self) -> None:
+        self.token = None
+
+    def load(self) -> AuthToken | None:
+        return self.token
+
+    def save(self, token: AuthToken) -> None:
+        self.token = token
+
+    def clear(self) -> None:
+        self.token = None
+
+
+class FileTokenStore:
+    """Token kept in a plain file, e.g. in lambda's `/tmp`, which survives warm
+    invocations and restarts of the process.
+
+    The file isn't encrypted: it's readable only by the user running the worker
+    (mode 0600), the same user that can read the credentials it was obtained with.
+    It's written to a temporary file and renamed, so readers never see partial
+    content. A file that can't be parsed is ignored."""
+
+    path: Path
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+
+    def load(self) -> AuthToken | None:
+        try:
+            return AuthToken.model_validate_json(self.path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except ValidationError as exc:
+            logger.warning(f"Ignoring unreadable token file {self.path}: {exc}")
+            return None
+
+    def save(self, token: AuthToken) -> None:
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # mkstemp creates the file with mode 0600
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.path.parent, prefix=f"{self.path.name}.", suffix=".tmp")
+        try:
+            with open(descriptor, "wb") as file:
+                file.write(token.model_dump_json().encode())
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            Path(temporary_path).unlink(missing_ok=True)
+            raise
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+@functools.cache
+def get_token_store() -> TokenStore | None:
+    """Token store shared by all invocations handled in this process, if enabled."""
+    match SETTINGS.TOKEN_STORE:
+        case "memory":
+            return MemoryTokenStore()
+        case "file":
+            return FileTokenStore(SETTINGS.TOKEN_STORE_PATH)
+        case _:
+            return None
+
 
 class TokenCache:
+    """API token, fetched again when it expires.
+
+    Concurrent callers share a single login request. Once the token is within
+    `delta` of its expiry, a new one is fetched in the background, while the current
+    one is still returned.
+
+    With a `store`, the token is reused by later invocations until it expires."""
+
     client: httpx.AsyncClient
+    store: TokenStore | None
     _token: AuthToken | None
     _delta: timedelta
+    _refreshing: asyncio.Task[AuthToken] | None
 
     def __init__(
         self,
         client: httpx.AsyncClient,
         delta: timedelta = timedelta(0),
         token: AuthToken | None = None,
+        store: TokenStore | None = None,
     ) -> None:
         self.client = client
+        self.store = store
+        if token is None and store is not None:
+            token = store.load()
         self._token = token.model_copy() if token is not None else None
         self._delta = delta
+        self._refreshing = None
 
     async def fetch_token(self) -> AuthToken:
-        credentials = read_token_credentials_from_ssm()
+        credentials = await read_token_credentials_from_ssm()
         url = f"{SETTINGS.API_BASE_URL}/auth/login/"
 
         response = await self.client.post(
             url,
             auth=(credentials.USER, credentials.PASSWORD),
         )
+
+        # Cached credentials could have been rotated in the meantime.
+        if response.status_code in (httpx.codes.UNAUTHORIZED, httpx.codes.FORBIDDEN):
+            get_parameter_loader().invalidate()
+            credentials = await read_token_credentials_from_ssm()
+            response = await self.client.post(
+                url,
+                auth=(credentials.USER, credentials.PASSWORD),
+            )
+
         response.raise_for_status()
 
         return AuthToken(**response.json())
 
+    async def _fetch_and_store_token(self) -> AuthToken:
+        self._token = await self.fetch_token()
+        if self.store is not None:
+            try:
+                self.store.save(self._token)
+            except Exception as exc:
+                # the token is still valid, it just won't be reused by later invocations
+                logger.warning(f"Storing API token failed: {exc!r}")
+        return self._token
+
+    def invalidate(self) -> None:
+        """Fetch new token on next use, e.g. after the stored one was revoked."""
+        self._token = None
+        if self.store is not None:
+            self.store.clear()
+
+    def _log_refresh_failure(self, task: asyncio.Task[AuthToken]) -> None:
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            logger.warning(f"Fetching API token failed: {exc!r}")
+
+    def refresh(self) -> asyncio.Task[AuthToken]:
+        """Fetch a new token, unless it's being fetched already."""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._fetch_and_store_token())
+            self._refreshing.add_done_callback(self._log_refresh_failure)
+        return self._refreshing
+
     async def get_token(self) -> AuthToken:
         current_time = datetime.now(tz=timezone.utc)
 
-        if self._token is None or self._token.has_expired(current_time, self._delta):
-            self._token = await self.fetch_token()
+        if self._token is None or self._token.has_expired(current_time, timedelta(0)):
+            # Shielded, so that cancelling one caller doesn't cancel fetch for others.
+            return await asyncio.shield(self.refresh())
+
+        if self._token.has_expired(current_time, self._delta):
+            self.refresh()
 
         return self._token
@@ -1,13 +1,19 @@
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Any, Literal, Optional, TypedDict
+from typing import Any, BinaryIO, Literal, NotRequired, Optional, TypedDict
 from uuid import UUID
 
-from pydantic import BaseModel, ConfigDict, RootModel
+from pydantic import BaseModel, ConfigDict, RootModel, SkipValidation
 
 BasicTypes = str | int | float | bool | datetime | None
 Stage = Literal["production", "staging"]
+RenderExecutorKind = Literal["inline", "thread", "process"]
+DeliveryBackendKind = Literal["mailgun", "smtp", "file", "null"]
+ParameterStoreKind = Literal["ssm", "local"]
+TokenStoreKind = Literal["none", "memory", "file"]
+OutputMode = Literal["full", "compact"]
+ResultSinkKind = Literal["none", "file", "s3"]
 
 
 class NotFoundError(Exception):
@@ -26,11 +32,52 @@ class SSMParameter(TypedDict, total=False):
     DataType: str
 
 
+@dataclass(frozen=True)
+class S3ObjectInfo:
+    etag: str
+    size: int
+
+
 @dataclass(frozen=True)
 class Settings:
     STAGE: Stage
     OVERWRITE_OUTGOING_EMAILS: str
     API_BASE_URL: str
+    TEMPLATE_BYTECODE_CACHE_DIR: str
+    TEMPLATE_BYTECODE_CACHE_MAX_BYTES: int
+    MARKDOWN_CACHE_SIZE: int
+    RENDER_EXECUTOR: RenderExecutorKind
+    RENDER_WORKERS: int
+    S3_DOWNLOAD_CONCURRENCY: int
+    ATTACHMENT_CACHE_MEMORY_BYTES: int
+    ATTACHMENT_CACHE_DIR: str
+    ATTACHMENT_CACHE_DISK_BYTES: int
+    ATTACHMENT_SPOOL_BYTES: int
+    ATTACHMENT_INFO_TTL_SECONDS: int
+    LAMBDA_MEMORY_SIZE_MB: int
+    ADMISSION_MEMORY_BYTES: int
+    ATTACHMENT_LINK_THRESHOLD_BYTES: int
+    ATTACHMENT_LINK_MIN_VALIDITY_SECONDS: int
+    MAILGUN_BATCH_WINDOW_MS: int
+    MAILGUN_RATE_LIMIT: int
+    MAILGUN_MAX_RATE_LIMIT: int
+    DELIVERY_BACKEND: DeliveryBackendKind
+    DELIVERY_FAILOVER_BACKEND: DeliveryBackendKind | None
+    DELIVERY_SINK_DIR: str
+    SMTP_HOST: str
+    SMTP_PORT: int
+    SMTP_STARTTLS: bool
+    SMTP_POOL_SIZE: int
+    PARAMETER_STORE: ParameterStoreKind
+    PARAMETER_CACHE_TTL_SECONDS: int
+    PREWARM: bool
+    TOKEN_REFRESH_MARGIN_SECONDS: int
+    TOKEN_STORE: TokenStoreKind
+    TOKEN_STORE_PATH: str
+    OUTPUT_MODE: OutputMode
+    RESULT_SINK: ResultSinkKind
+    RESULT_SINK_DIR: str
+    RESULT_SINK_S3_BUCKET: str
 
 
 @dataclass(frozen=True)
@@ -45,6 +92,14 @@ class Credentials:
     PASSWORD: str
 
 
+@dataclass(frozen=True)
+class WorkerParameters:
+    MAILGUN_CREDENTIALS: MailgunCredentials
+    TOKEN_CREDENTIALS: Credentials
+    SMTP_CREDENTIALS: Credentials
+    S3_BUCKET: str
+
+
 class Attachment(BaseModel):
     filename: str
     s3_path: str
@@ -85,8 +140,16 @@ class ScheduledEmail(BaseModel):
 
 
 class AttachmentWithContent(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     filename: str | None
-    content: bytes
+    # Bytes shared with the attachment cache, or a file (e.g. spooled temporary file)
+    # streamed when sending the email.
+    content: bytes | SkipValidation[BinaryIO]
+
+    def close(self) -> None:
+        if not isinstance(self.content, bytes):
+            self.content.close()
 
 
 class RenderedScheduledEmail(ScheduledEmail):
@@ -95,14 +158,67 @@ class RenderedScheduledEmail(ScheduledEmail):
     body_rendered: str
     attachments_with_content: list[AttachmentWithContent]
 
+    @classmethod
+    def from_email(
+        cls,
+        email: ScheduledEmail,
+        *,
+        to_header_rendered: list[str],
+        subject_rendered: str,
+        body_rendered: str,
+        attachments_with_content: list[AttachmentWithContent],
+    ) -> "RenderedScheduledEmail":
+        """Rendered `email`, sharing field values of the already validated `email`.
+
+        Neither `email` is serialized, nor are its fields validated again. Rendered
+        fields aren't validated either, as they're produced by the worker."""
+        return cls.model_construct(
+            **email.__dict__,
+            to_header_rendered=to_header_rendered,
+            subject_rendered=subject_rendered,
+            body_rendered=body_rendered,
+            attachments_with_content=attachments_with_content,
+        )
+
 
 class WorkerOutputEmail(TypedDict):
     email: dict[str, Any]
     status: str
+    # context keys not used by subject nor body, and therefore not fetched
+    skipped_context_keys: NotRequired[list[str]]
+    # filenames of attachments linked in the body instead of being sent with the email
+    attachments_linked: NotRequired[list[str]]
+    # size of linked attachments
+    attachment_bytes_saved: NotRequired[int]
+    # reason why the email failed
+    error: NotRequired[str]
+    # time spent handling the email
+    duration_seconds: NotRequired[float]
+    # whether the email was failed without locking it, as it couldn't ever be sent
+    lock_skipped: NotRequired[bool]
+
+
+class CompactWorkerOutputEmail(TypedDict):
+    pk: str
+    status: str
+    duration_seconds: NotRequired[float]
+    error: NotRequired[str]
 
 
 class WorkerOutput(TypedDict):
-    emails: list[WorkerOutputEmail]
+    emails: list[WorkerOutputEmail] | list[CompactWorkerOutputEmail]
+    # number of emails which reused subject and body rendered for another email
+    renders_saved: NotRequired[int]
+    # number of emails which waited for memory held by other emails
+    admission_delayed: NotRequired[int]
+    # number of Mailgun requests saved by sending emails in batches
+    mailgun_requests_saved: NotRequired[int]
+    # Mailgun requests per second allowed by the adaptive rate limiter
+    mailgun_rate: NotRequired[float]
+    # where full records of handled emails were written to
+    results_location: NotRequired[str]
+    # number of lock requests saved by failing invalid emails right away
+    lock_requests_saved: NotRequired[int]
 
 
 class SinglePropertyLinkModel(BaseModel):
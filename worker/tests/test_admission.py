@@ -0,0 +1,168 @@
+import asyncio
+from dataclasses import replace
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+
+from src.admission import (
+    RENDERING_OVERHEAD,
+    MemoryAdmissionController,
+    estimate_email_bytes,
+    memory_budget,
+)
+from src.settings import SETTINGS
+from src.types import Attachment, ScheduledEmail, ScheduledEmailStatus
+
+
+def make_email(attachments: int) -> ScheduledEmail:
+    now_ = datetime.now(timezone.utc)
+    return ScheduledEmail(
+        pk=uuid4(),
+        created_at=now_,
+        last_updated_at=now_,
+        state=ScheduledEmailStatus.SCHEDULED,
+        scheduled_at=now_,
+        to_header=[],
+        to_header_context_json=[],
+        from_header="",
+        reply_to_header="",
+        cc_header=[],
+        bcc_header=[],
+        subject="Hello",
+        body="World",
+        context_json={},
+        template=None,
+        attachments=[
+            Attachment(
+                filename=f"file{i}.pdf",
+                s3_path=f"certificates/file{i}.pdf",
+                s3_bucket="",
+                presigned_url="",
+                presigned_url_expiration=None,
+            )
+            for i in range(attachments)
+        ],
+    )
+
+
+def test_memory_budget__explicit() -> None:
+    # Arrange
+    settings = replace(SETTINGS, ADMISSION_MEMORY_BYTES=1000, LAMBDA_MEMORY_SIZE_MB=512)
+
+    # Act
+    result = memory_budget(settings)
+
+    # Assert
+    assert result == 1000
+
+
+def test_memory_budget__derived_from_lambda_memory_size() -> None:
+    # Arrange
+    settings = replace(
+        SETTINGS, ADMISSION_MEMORY_BYTES=0, LAMBDA_MEMORY_SIZE_MB=128, ATTACHMENT_CACHE_MEMORY_BYTES=16 * 1024 * 1024
+    )
+
+    # Act
+    result = memory_budget(settings)
+
+    # Assert
+    assert result == 48 * 1024 * 1024
+
+
+def test_memory_budget__unbounded_outside_lambda() -> None:
+    # Arrange
+    settings = replace(SETTINGS, ADMISSION_MEMORY_BYTES=0, LAMBDA_MEMORY_SIZE_MB=0)
+
+    # Act
+    result = memory_budget(settings)
+
+    # Assert
+    assert result is None
+
+
+def test_estimate_email_bytes() -> None:
+    # Arrange
+    email = make_email(attachments=2)
+
+    # Act
+    result = estimate_email_bytes(email, spool_bytes=1000)
+
+    # Assert
+    assert result == len("HelloWorld") * RENDERING_OVERHEAD + len("{}") + 2 * 1000
+
+
+@pytest.mark.asyncio
+async def test_memory_admission_controller__small_emails_run_concurrently() -> None:
+    # Arrange
+    admission = MemoryAdmissionController(budget_bytes=100)
+    running = asyncio.Event()
+
+    async def handle() -> None:
+        async with admission.reserve(10):
+            if admission.in_flight_bytes == 50:
+                running.set()
+            await running.wait()
+
+    # Act
+    await asyncio.wait_for(asyncio.gather(*[handle() for _ in range(5)]), timeout=1)
+
+    # Assert
+    assert admission.delayed == 0
+    assert admission.peak_bytes == 50
+    assert admission.in_flight_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_memory_admission_controller__delays_emails_over_budget() -> None:
+    # Arrange
+    admission = MemoryAdmissionController(budget_bytes=100)
+    order: list[str] = []
+
+    async def handle(name: str, size: int) -> None:
+        async with admission.reserve(size):
+            order.append(f"start {name}")
+            await asyncio.sleep(0)
+            order.append(f"end {name}")
+
+    # Act
+    await asyncio.gather(handle("large1", 80), handle("large2", 80), handle("small", 10))
+
+    # Assert
+    assert admission.delayed == 2
+    assert admission.peak_bytes == 90
+    # small email waits for large one queued before it
+    assert order == ["start large1", "end large1", "start large2", "start small", "end large2", "end small"]
+
+
+@pytest.mark.asyncio
+async def test_memory_admission_controller__admits_oversized_email_alone() -> None:
+    # Arrange
+    admission = MemoryAdmissionController(budget_bytes=100)
+
+    # Act
+    async with admission.reserve(1000):
+        in_flight = admission.in_flight_bytes
+
+    # Assert
+    assert in_flight == 1000
+    assert admission.in_flight_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_memory_admission_controller__cancelled_waiter_leaves_queue() -> None:
+    # Arrange
+    admission = MemoryAdmissionController(budget_bytes=100)
+    await admission.acquire(80)
+    waiter = asyncio.ensure_future(admission.acquire(80))
+    await asyncio.sleep(0)
+
+    # Act
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    await admission.release(80)
+
+    # Assert
+    async with admission.reserve(10):
+        assert admission.in_flight_bytes == 10
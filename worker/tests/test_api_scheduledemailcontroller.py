@@ -112,6 +112,38 @@ async def test_scheduled_email_controller__get_paginated(
     assert client.get.await_count == 3
 
 
+@pytest.mark.asyncio
+async def test_scheduled_email_controller__get_paginated__revoked_token(
+    token: AuthToken,
+) -> None:
+    # Arrange
+    api_base_url = "http://localhost:8000/api"
+    client = AsyncMock()
+    mock_unauthorized = MagicMock(status_code=401)
+    mock_get = MagicMock(status_code=200)
+    mock_get.json.return_value = {"results": [{"id": "9116a1af-f361-4633-8990-5e16e43683e3"}]}
+    mock_not_found = MagicMock(status_code=404)
+    client.get.side_effect = [mock_unauthorized, mock_get, mock_not_found]
+
+    new_token = AuthToken(expiry=token.expiry, token="new token")
+    token_cache = TokenCache(client, token=token)
+    token_cache.fetch_token = AsyncMock(return_value=new_token)  # type: ignore[method-assign]
+    controller = ScheduledEmailController(api_base_url, client, token_cache)
+    url = f"{api_base_url}/v2/fakepage?page={{}}"
+
+    # Act
+    result = await controller.get_paginated(url)
+
+    # Assert
+    assert result == [{"id": "9116a1af-f361-4633-8990-5e16e43683e3"}]
+    token_cache.fetch_token.assert_awaited_once()
+    assert [call.kwargs["headers"] for call in client.get.await_args_list] == [
+        {"Authorization": f"Token {token.token}"},
+        {"Authorization": "Token new token"},
+        {"Authorization": "Token new token"},
+    ]
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("max_pages", [0, 6])
 async def test_scheduled_email_controller__get_paginated__safety_break_at_max_pages(
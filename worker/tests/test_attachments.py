@@ -0,0 +1,434 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from io import BytesIO
+from pathlib import Path
+import threading
+from typing import BinaryIO, Iterator
+from unittest.mock import ANY, MagicMock, patch
+
+import httpx
+import pytest
+
+from src.attachments import (
+    AttachmentCache,
+    AttachmentFetcher,
+    AttachmentKey,
+    has_valid_presigned_url,
+)
+from src.cache import BytesLRUCache
+from src.types import Attachment, AttachmentWithContent, S3ObjectInfo
+
+
+def make_attachment(
+    filename: str, presigned_url: str = "", presigned_url_expiration: datetime | None = None
+) -> Attachment:
+    return Attachment(
+        filename=filename,
+        s3_path=f"certificates/random-person/{filename}",
+        s3_bucket="",
+        presigned_url=presigned_url,
+        presigned_url_expiration=presigned_url_expiration,
+    )
+
+
+def make_presigned_client(requests: list[httpx.Request], status_code: int = 200) -> httpx.AsyncClient:
+    """HTTP client responding with URL path as content and a fixed ETag."""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"etag1"':
+            return httpx.Response(304)
+        return httpx.Response(status_code, content=request.url.path.encode(), headers={"ETag": '"etag1"'})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.fixture
+def mock_s3() -> Iterator[MagicMock]:
+    """Patch S3 calls made by `AttachmentFetcher`; downloads return the object path."""
+    with (
+        patch("src.attachments.read_s3_bucket_from_ssm", return_value="bogus-s3"),
+        patch("src.attachments.s3_object_info", return_value=S3ObjectInfo(etag='"etag1"', size=4)),
+        patch("src.attachments.download_s3_fileobj") as mock_download,
+    ):
+
+        def download(bucket: str, path: str, fileobj: BinaryIO, etag: str) -> None:
+            fileobj.write(path.encode())
+            fileobj.seek(0)
+
+        mock_download.side_effect = download
+        yield mock_download
+
+
+def test_bytes_lru_cache__evicts_least_recently_used() -> None:
+    # Arrange
+    cache: BytesLRUCache[str] = BytesLRUCache(max_bytes=8)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    cache.get("a")
+
+    # Act
+    cache.put("c", b"1234")
+    cache.put("too-big", b"123456789")
+
+    # Assert
+    assert cache.get("a") == b"1234"
+    assert cache.get("b") is None
+    assert cache.get("c") == b"1234"
+    assert cache.get("too-big") is None
+    assert cache.size == 8
+
+
+def test_attachment_cache__memory_tier(tmp_path: Path) -> None:
+    # Arrange
+    key = AttachmentKey(bucket="bogus-s3", s3_path="certificate.pdf", etag='"etag1"')
+    cache = AttachmentCache(max_memory_bytes=1024)
+    file = BytesIO(b"Test")
+
+    # Act
+    cache.put(key, file, size=4)
+
+    # Assert
+    assert cache.open(key) == b"Test"
+    assert file.tell() == 0
+
+
+def test_attachment_cache__disk_tier_survives_memory(tmp_path: Path) -> None:
+    # Arrange
+    key = AttachmentKey(bucket="bogus-s3", s3_path="certificate.pdf", etag='"etag1"')
+    AttachmentCache(max_memory_bytes=1024, directory=str(tmp_path), max_disk_bytes=1024).put(key, BytesIO(b"Test"), 4)
+    cache = AttachmentCache(max_memory_bytes=1024, directory=str(tmp_path), max_disk_bytes=1024)
+
+    # Act
+    result = cache.open(key)
+
+    # Assert
+    assert not isinstance(result, bytes) and result is not None
+    with result:
+        assert result.read() == b"Test"
+    assert cache.open(AttachmentKey(bucket="bogus-s3", s3_path="certificate.pdf", etag='"etag2"')) is None
+
+
+def test_attachment_cache__disk_tier_bounded(tmp_path: Path) -> None:
+    # Arrange
+    cache = AttachmentCache(max_memory_bytes=0, directory=str(tmp_path), max_disk_bytes=6)
+
+    # Act
+    cache.put(AttachmentKey(bucket="bogus-s3", s3_path="first.pdf", etag='"etag1"'), BytesIO(b"1234"), 4)
+    cache.put(AttachmentKey(bucket="bogus-s3", s3_path="second.pdf", etag='"etag1"'), BytesIO(b"1234"), 4)
+
+    # Assert
+    assert len(list(tmp_path.glob("*.attachment"))) == 1
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__fetch_all(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024))
+    attachments = [make_attachment("certificate.pdf"), make_attachment("handbook.pdf")]
+
+    # Act
+    result = await fetcher.fetch_all(attachments)
+
+    # Assert
+    assert result == [
+        AttachmentWithContent(filename="certificate.pdf", content=b"certificates/random-person/certificate.pdf"),
+        AttachmentWithContent(filename="handbook.pdf", content=b"certificates/random-person/handbook.pdf"),
+    ]
+    mock_s3.assert_any_call("bogus-s3", "certificates/random-person/certificate.pdf", ANY, etag='"etag1"')
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__fetch_all__failure_closes_fetched_files() -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=0))
+    attachments = [make_attachment("certificate.pdf"), make_attachment("handbook.pdf")]
+    file = BytesIO(b"Test")
+    fetched = AttachmentWithContent(filename="certificate.pdf", content=file)
+
+    # Act & Assert
+    with patch.object(fetcher, "fetch", side_effect=[fetched, RuntimeError("S3 unavailable")]):
+        with pytest.raises(RuntimeError, match="S3 unavailable"):
+            await fetcher.fetch_all(attachments)
+    assert file.closed
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__downloads_in_parallel_off_event_loop(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024))
+    attachments = [make_attachment("certificate.pdf"), make_attachment("handbook.pdf")]
+    # Both downloads must be in progress at the same time to pass the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+    event_loop_ticks = 0
+
+    def download(bucket: str, path: str, fileobj: BinaryIO, etag: str) -> None:
+        barrier.wait()
+
+    async def tick() -> None:
+        nonlocal event_loop_ticks
+        event_loop_ticks += 1
+
+    mock_s3.side_effect = download
+
+    # Act
+    result, _ = await asyncio.gather(fetcher.fetch_all(attachments), tick())
+
+    # Assert
+    assert len(result) == 2
+    assert event_loop_ticks == 1
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__same_attachment_downloaded_once(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=4, cache=AttachmentCache(max_memory_bytes=1024))
+    attachment = make_attachment("certificate.pdf")
+
+    # Act
+    concurrent = await asyncio.gather(*[fetcher.fetch(attachment) for _ in range(5)])
+    later = await fetcher.fetch(attachment)
+
+    # Assert
+    assert {result.content for result in [*concurrent, later]} == {b"certificates/random-person/certificate.pdf"}
+    assert fetcher.downloads == 1
+    mock_s3.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__changed_etag_downloaded_again(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024))
+    attachment = make_attachment("certificate.pdf")
+    await fetcher.fetch(attachment)
+
+    # Act
+    with patch("src.attachments.s3_object_info", return_value=S3ObjectInfo(etag='"etag2"', size=4)):
+        await fetcher.fetch(attachment)
+
+    # Assert
+    assert fetcher.downloads == 2
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__object_info_remembered(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024), info_ttl=60)
+    expiration = datetime.now(tz=UTC) + timedelta(days=8)
+    attachment = make_attachment("certificate.pdf", "https://s3.example.org/presigned/certificate.pdf", expiration)
+
+    # Act
+    with patch("src.attachments.s3_object_info", return_value=S3ObjectInfo('"etag1"', 4)) as mock_info:
+        linked = await fetcher.select_linked([attachment], threshold_bytes=1000, min_validity=timedelta(days=7))
+        results = await asyncio.gather(*[fetcher.fetch(attachment) for _ in range(3)])
+        results.append(await fetcher.fetch(attachment))
+
+    # Assert
+    assert linked == []
+    assert {result.content for result in results} == {b"certificates/random-person/certificate.pdf"}
+    mock_info.assert_called_once()
+    mock_s3.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__object_info_expires(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024), info_ttl=0.05)
+    attachment = make_attachment("certificate.pdf")
+
+    # Act
+    with patch("src.attachments.s3_object_info", return_value=S3ObjectInfo('"etag1"', 4)) as mock_info:
+        await fetcher.fetch(attachment)
+        await asyncio.sleep(0.1)
+        await fetcher.fetch(attachment)
+
+    # Assert
+    assert mock_info.call_count == 2
+    mock_s3.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__remembered_etag_changed_looked_up_again(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1), info_ttl=60)
+    attachment = make_attachment("certificate.pdf")
+    with patch("src.attachments.s3_object_info", return_value=S3ObjectInfo('"etag1"', 4)):
+        (await fetcher.fetch(attachment)).close()
+
+    def download(bucket: str, path: str, fileobj: BinaryIO, etag: str) -> None:
+        if etag != '"etag2"':
+            raise RuntimeError("Precondition Failed")
+        fileobj.write(b"new version")
+        fileobj.seek(0)
+
+    mock_s3.side_effect = download
+
+    # Act
+    with patch("src.attachments.s3_object_info", return_value=S3ObjectInfo('"etag2"', 11)) as mock_info:
+        result = await fetcher.fetch(attachment)
+
+    # Assert
+    assert not isinstance(result.content, bytes)
+    assert result.content.read() == b"new version"
+    result.close()
+    mock_info.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__large_attachment_streamed_to_file(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1), spool_bytes=1)
+    attachment = make_attachment("certificate.pdf")
+
+    # Act
+    results = [await fetcher.fetch(attachment) for _ in range(2)]
+
+    # Assert
+    assert fetcher.downloads == 2
+    for result in results:
+        assert not isinstance(result.content, bytes)
+        assert result.content.read() == b"certificates/random-person/certificate.pdf"
+        result.close()
+        assert result.content.closed
+
+
+@pytest.mark.parametrize(
+    "presigned_url,expires_in,expected",
+    [
+        ("", timedelta(hours=1), False),
+        ("https://s3.example.org/file.pdf", None, True),
+        ("https://s3.example.org/file.pdf", timedelta(hours=1), True),
+        ("https://s3.example.org/file.pdf", timedelta(seconds=10), False),
+        ("https://s3.example.org/file.pdf", -timedelta(hours=1), False),
+    ],
+)
+def test_has_valid_presigned_url(presigned_url: str, expires_in: timedelta | None, expected: bool) -> None:
+    # Arrange
+    now = datetime(2024, 5, 1, 12, 0, tzinfo=UTC)
+    expiration = now + expires_in if expires_in is not None else None
+    attachment = make_attachment("certificate.pdf", presigned_url, expiration)
+
+    # Act
+    result = has_valid_presigned_url(attachment, now)
+
+    # Assert
+    assert result is expected
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__presigned_url_used_instead_of_s3(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024))
+    attachment = make_attachment("certificate.pdf", "https://s3.example.org/presigned/certificate.pdf")
+    requests: list[httpx.Request] = []
+
+    # Act
+    async with make_presigned_client(requests) as client:
+        result = await fetcher.fetch(attachment, client)
+
+    # Assert
+    assert result.content.read() == b"/presigned/certificate.pdf"  # type: ignore[union-attr]
+    result.close()
+    assert len(requests) == 1
+    mock_s3.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__expired_presigned_url_falls_back_to_s3(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024))
+    attachment = make_attachment(
+        "certificate.pdf",
+        "https://s3.example.org/presigned/certificate.pdf",
+        datetime.now(tz=UTC) - timedelta(minutes=5),
+    )
+    requests: list[httpx.Request] = []
+
+    # Act
+    async with make_presigned_client(requests) as client:
+        result = await fetcher.fetch(attachment, client)
+
+    # Assert
+    assert result.content == b"certificates/random-person/certificate.pdf"
+    assert requests == []
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__failed_presigned_url_download_falls_back_to_s3(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024))
+    attachment = make_attachment("certificate.pdf", "https://s3.example.org/presigned/certificate.pdf")
+    requests: list[httpx.Request] = []
+
+    # Act
+    async with make_presigned_client(requests, status_code=403) as client:
+        result = await fetcher.fetch(attachment, client)
+
+    # Assert
+    assert result.content == b"certificates/random-person/certificate.pdf"
+    assert len(requests) == 1
+    mock_s3.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__presigned_url_downloads_shared_and_revalidated(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024))
+    # Emails sent in bulk get different presigned URLs for the same object.
+    attachments = [
+        make_attachment("certificate.pdf", f"https://s3.example.org/presigned/certificate.pdf?signature={i}")
+        for i in range(5)
+    ]
+    requests: list[httpx.Request] = []
+
+    # Act
+    async with make_presigned_client(requests) as client:
+        concurrent = await asyncio.gather(*[fetcher.fetch(attachment, client) for attachment in attachments])
+        later = await fetcher.fetch(attachments[0], client)
+
+    # Assert
+    assert fetcher.downloads == 1
+    assert [request.headers.get("If-None-Match") for request in requests] == [None, '"etag1"']
+    assert later.content == b"/presigned/certificate.pdf"
+    for result in concurrent:
+        result.close()
+
+
+@pytest.mark.asyncio
+async def test_attachment_fetcher__select_linked(mock_s3: MagicMock) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024))
+    sizes = {"certificates/random-person/large.pdf": 2000, "certificates/random-person/small.pdf": 10}
+    expiration = datetime.now(tz=UTC) + timedelta(days=8)
+    attachments = [
+        make_attachment("large.pdf", "https://s3.example.org/presigned/large.pdf", expiration),
+        make_attachment("small.pdf", "https://s3.example.org/presigned/small.pdf", expiration),
+        make_attachment("no-url.pdf"),
+    ]
+
+    # Act
+    with patch("src.attachments.s3_object_info", side_effect=lambda _, path: S3ObjectInfo('"etag"', sizes[path])):
+        result = await fetcher.select_linked(attachments, threshold_bytes=1000, min_validity=timedelta(days=7))
+
+    # Assert
+    assert result == [(attachments[0], 2000)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("expires_in", [timedelta(hours=2), None])
+async def test_attachment_fetcher__select_linked__url_expiring_too_soon_not_linked(
+    mock_s3: MagicMock, expires_in: timedelta | None
+) -> None:
+    # Arrange
+    fetcher = AttachmentFetcher(max_workers=2, cache=AttachmentCache(max_memory_bytes=1024))
+    expiration = datetime.now(tz=UTC) + expires_in if expires_in is not None else None
+    attachment = make_attachment("large.pdf", "https://s3.example.org/presigned/large.pdf", expiration)
+
+    # Act
+    with patch("src.attachments.s3_object_info", return_value=S3ObjectInfo('"etag"', 2000)) as mock_info:
+        result = await fetcher.select_linked([attachment], threshold_bytes=1000, min_validity=timedelta(days=7))
+
+    # Assert
+    assert result == []
+    mock_info.assert_not_called()
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from unittest.mock import MagicMock, patch
+
+from src.aws import SSM_GET_PARAMETERS_LIMIT, get_s3_client, read_ssm_parameters
+
+
+@patch("src.aws.get_ssm_client")
+def test_read_ssm_parameters(mock_get_ssm_client: MagicMock) -> None:
+    # Arrange
+    mock_ssm_client = mock_get_ssm_client.return_value
+    paths = [f"/staging/parameter{i}" for i in range(SSM_GET_PARAMETERS_LIMIT + 1)]
+    mock_ssm_client.get_parameters.side_effect = [
+        {
+            "Parameters": [{"Name": path, "Value": "value"} for path in paths[:SSM_GET_PARAMETERS_LIMIT]],
+            "InvalidParameters": [],
+        },
+        {"Parameters": [], "InvalidParameters": [paths[-1]]},
+    ]
+
+    # Act
+    result = read_ssm_parameters(paths)
+
+    # Assert
+    assert list(result) == paths[:SSM_GET_PARAMETERS_LIMIT]
+    assert [call.kwargs for call in mock_ssm_client.get_parameters.call_args_list] == [
+        {"Names": paths[:SSM_GET_PARAMETERS_LIMIT], "WithDecryption": True},
+        {"Names": paths[SSM_GET_PARAMETERS_LIMIT:], "WithDecryption": True},
+    ]
+
+
+@patch.dict("src.aws._clients", clear=True)
+@patch("boto3.client")
+def test_get_s3_client__created_once_by_concurrent_threads(mock_client: MagicMock) -> None:
+    # Arrange
+    barrier = threading.Barrier(8)
+
+    def get_client_together() -> object:
+        barrier.wait()
+        return get_s3_client()
+
+    # Act
+    with ThreadPoolExecutor(8) as executor:
+        clients = list(executor.map(lambda _: get_client_together(), range(8)))
+
+    # Assert
+    mock_client.assert_called_once_with("s3")
+    assert all(client is mock_client.return_value for client in clients)
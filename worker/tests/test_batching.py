@@ -0,0 +1,176 @@
+import asyncio
+from datetime import UTC, datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
+
+import pytest
+
+from src.batching import MailgunBatcher, batch_key
+from src.types import MailgunCredentials, RenderedScheduledEmail, ScheduledEmailStatus
+
+CREDENTIALS = MailgunCredentials(MAILGUN_SENDER_DOMAIN="example.com", MAILGUN_API_KEY="secret")
+
+
+def make_email(to: list[str], subject: str = "Hello", cc: list[str] | None = None) -> RenderedScheduledEmail:
+    now_ = datetime.now(tz=UTC)
+    return RenderedScheduledEmail(
+        pk=uuid4(),
+        created_at=now_,
+        last_updated_at=now_,
+        state=ScheduledEmailStatus.LOCKED,
+        scheduled_at=now_,
+        to_header=[],
+        to_header_context_json=[],
+        to_header_rendered=to,
+        from_header="team@example.org",
+        reply_to_header="",
+        cc_header=cc or [],
+        bcc_header=[],
+        subject=subject,
+        subject_rendered=subject,
+        body="Welcome!",
+        body_rendered="<p>Welcome!</p>",
+        context_json={},
+        template=None,
+        attachments=[],
+        attachments_with_content=[],
+    )
+
+
+def test_batch_key() -> None:
+    # Arrange
+    email1 = make_email(["a@example.org"])
+    email2 = make_email(["b@example.org"])
+    email3 = make_email(["c@example.org"], subject="Other")
+
+    # Act
+    keys = [batch_key(email) for email in [email1, email2, email3]]
+
+    # Assert
+    assert keys[0] is not None
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
+
+
+@pytest.mark.parametrize(
+    "email",
+    [
+        make_email([]),
+        make_email(["a@example.org", "b@example.org"]),
+        make_email(["a@example.org"], cc=["c@example.org"]),
+    ],
+)
+def test_batch_key__email_not_batched(email: RenderedScheduledEmail) -> None:
+    # Act
+    result = batch_key(email)
+
+    # Assert
+    assert result is None
+
+
+@pytest.mark.asyncio
+@patch("src.batching.send_email")
+@patch("src.batching.send_batch_email")
+async def test_mailgun_batcher__identical_emails_sent_in_one_request(
+    mock_send_batch_email: AsyncMock, mock_send_email: AsyncMock
+) -> None:
+    # Arrange
+    client = AsyncMock()
+    batcher = MailgunBatcher(client, CREDENTIALS, window=0.01)
+    emails = [make_email([f"person{i}@example.org"]) for i in range(3)]
+    other = make_email(["person@example.org"], subject="Other")
+
+    # Act
+    responses = await asyncio.gather(*[batcher.send(email) for email in [*emails, other]])
+
+    # Assert
+    mock_send_batch_email.assert_awaited_once_with(client, emails, CREDENTIALS)
+    mock_send_email.assert_awaited_once_with(client, other, CREDENTIALS)
+    assert responses == [mock_send_batch_email.return_value] * 3 + [mock_send_email.return_value]
+    assert batcher.requests == 2
+    assert batcher.requests_saved == 2
+
+
+@pytest.mark.asyncio
+@patch("src.batching.send_email")
+@patch("src.batching.send_batch_email")
+async def test_mailgun_batcher__batch_limit(mock_send_batch_email: AsyncMock, mock_send_email: AsyncMock) -> None:
+    # Arrange
+    # Window long enough to fail the test if batches waited for it.
+    batcher = MailgunBatcher(AsyncMock(), CREDENTIALS, window=60, limit=2)
+    emails = [make_email([f"person{i}@example.org"]) for i in range(4)]
+
+    # Act
+    await asyncio.wait_for(asyncio.gather(*[batcher.send(email) for email in emails]), timeout=1)
+
+    # Assert
+    assert [call.args[1] for call in mock_send_batch_email.await_args_list] == [emails[:2], emails[2:]]
+
+
+@pytest.mark.asyncio
+@patch("src.batching.send_email")
+@patch("src.batching.send_batch_email")
+async def test_mailgun_batcher__repeated_recipient_starts_new_batch(
+    mock_send_batch_email: AsyncMock, mock_send_email: AsyncMock
+) -> None:
+    # Arrange
+    batcher = MailgunBatcher(AsyncMock(), CREDENTIALS, window=0.01)
+    emails = [make_email(["a@example.org"]), make_email(["b@example.org"]), make_email(["a@example.org"])]
+
+    # Act
+    await asyncio.gather(*[batcher.send(email) for email in emails])
+
+    # Assert
+    mock_send_batch_email.assert_awaited_once()
+    assert mock_send_batch_email.await_args_list[0].args[1] == emails[:2]
+    # single email batch is sent as regular email
+    mock_send_email.assert_awaited_once()
+    assert mock_send_email.await_args_list[0].args[1] == emails[2]
+
+
+@pytest.mark.asyncio
+@patch("src.batching.send_batch_email")
+async def test_mailgun_batcher__error_propagated_to_all_emails(mock_send_batch_email: AsyncMock) -> None:
+    # Arrange
+    batcher = MailgunBatcher(AsyncMock(), CREDENTIALS, window=0.01)
+    emails = [make_email([f"person{i}@example.org"]) for i in range(2)]
+    mock_send_batch_email.side_effect = ConnectionError("Mailgun unavailable")
+
+    # Act
+    results = await asyncio.gather(*[batcher.send(email) for email in emails], return_exceptions=True)
+
+    # Assert
+    assert [type(result) for result in results] == [ConnectionError, ConnectionError]
+
+
+@pytest.mark.asyncio
+@patch("src.batching.send_email")
+@patch("src.batching.send_batch_email")
+async def test_mailgun_batcher__cancelled_email_not_sent(
+    mock_send_batch_email: AsyncMock, mock_send_email: AsyncMock
+) -> None:
+    # Arrange
+    batcher = MailgunBatcher(AsyncMock(), CREDENTIALS, window=0.01)
+    emails = [make_email([f"person{i}@example.org"]) for i in range(2)]
+    cancelled = asyncio.ensure_future(batcher.send(emails[0]))
+    await asyncio.sleep(0)
+
+    # Act
+    cancelled.cancel()
+    response = await batcher.send(emails[1])
+
+    # Assert
+    assert response is mock_send_email.return_value
+    mock_send_batch_email.assert_not_awaited()
+    mock_send_email.assert_awaited_once_with(batcher.client, emails[1], CREDENTIALS)
+
+
+def test_mailgun_batcher__requests_saved() -> None:
+    # Arrange
+    batcher = MailgunBatcher(MagicMock(), CREDENTIALS, window=0)
+
+    # Act
+    batcher.requests, batcher.emails = 3, 10
+
+    # Assert
+    assert batcher.requests_saved == 7
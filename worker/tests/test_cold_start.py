@@ -0,0 +1,31 @@
+from benchmarks.cold_start import (
+    DEFERRED_MODULES,
+    measure_imports,
+    parse_importtime,
+)
+
+
+def test_parse_importtime() -> None:
+    # Arrange
+    output = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   src.settings\n"
+        "import time:        80 |        200 | main\n"
+    )
+
+    # Act
+    result = parse_importtime(output)
+
+    # Assert
+    assert [(entry.module, entry.self_us, entry.cumulative_us) for entry in result] == [
+        ("src.settings", 120, 120),
+        ("main", 80, 200),
+    ]
+
+
+def test_main_defers_sending_modules() -> None:
+    # Act
+    imports = {entry.module for entry in measure_imports("main")}
+
+    # Assert
+    assert [module for module in DEFERRED_MODULES if module in imports] == []
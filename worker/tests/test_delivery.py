@@ -0,0 +1,345 @@
+from dataclasses import replace
+from datetime import UTC, datetime
+from email import message_from_bytes
+from io import BytesIO
+from pathlib import Path
+import smtplib
+from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
+
+import httpx
+import pytest
+
+from src.delivery import (
+    FailoverBackend,
+    FileSinkBackend,
+    MailgunBackend,
+    SMTPBackend,
+    SMTPConnectionPool,
+    build_mime_message,
+    create_delivery_backend,
+    get_smtp_pool,
+    is_transient_failure,
+)
+from src.settings import SETTINGS
+from src.types import (
+    AttachmentWithContent,
+    Credentials,
+    MailgunCredentials,
+    RenderedScheduledEmail,
+    ScheduledEmailStatus,
+)
+
+CREDENTIALS = MailgunCredentials(MAILGUN_SENDER_DOMAIN="example.com", MAILGUN_API_KEY="secret")
+
+
+@pytest.fixture
+def rendered_email() -> RenderedScheduledEmail:
+    now_ = datetime.now(tz=UTC)
+    return RenderedScheduledEmail(
+        pk=uuid4(),
+        created_at=now_,
+        last_updated_at=now_,
+        state=ScheduledEmailStatus.LOCKED,
+        scheduled_at=now_,
+        to_header=[],
+        to_header_context_json=[],
+        to_header_rendered=["jdoe@example.com"],
+        from_header="team@example.org",
+        reply_to_header="reply@example.org",
+        cc_header=["cc@example.org"],
+        bcc_header=["bcc@example.org"],
+        subject="Hello",
+        subject_rendered="Hello World!",
+        body="Welcome!",
+        body_rendered="<p>Welcome!</p>",
+        context_json={},
+        template=None,
+        attachments=[],
+        attachments_with_content=[AttachmentWithContent(filename="certificate.pdf", content=BytesIO(b"Test"))],
+    )
+
+
+def test_build_mime_message(rendered_email: RenderedScheduledEmail) -> None:
+    # Arrange
+    # attachment file read by another backend before
+    rendered_email.attachments_with_content[0].content.read()  # type: ignore[union-attr]
+
+    # Act
+    message = build_mime_message(rendered_email)
+
+    # Assert
+    assert message["From"] == "team@example.org"
+    assert message["To"] == "jdoe@example.com"
+    assert message["Cc"] == "cc@example.org"
+    assert message["Bcc"] == "bcc@example.org"
+    assert message["Reply-To"] == "reply@example.org"
+    assert message["Subject"] == "Hello World!"
+    body = message.get_body()
+    assert body is not None
+    assert body.get_content().strip() == "<p>Welcome!</p>"
+    [attachment] = message.iter_attachments()
+    assert attachment.get_filename() == "certificate.pdf"
+    assert attachment.get_content_type() == "application/pdf"
+    assert attachment.get_content() == b"Test"
+
+
+def test_build_mime_message__outgoing_addresses_overwritten(rendered_email: RenderedScheduledEmail) -> None:
+    # Act
+    message = build_mime_message(rendered_email, "safe_mailing_group@example.com")
+
+    # Assert
+    assert message["To"] == "safe_mailing_group@example.com"
+    assert message["Cc"] is None
+    assert message["Bcc"] is None
+
+
+@pytest.mark.asyncio
+@patch("src.delivery.send_email")
+async def test_mailgun_backend(mock_send_email: AsyncMock, rendered_email: RenderedScheduledEmail) -> None:
+    # Arrange
+    client = AsyncMock()
+    backend = MailgunBackend(client, CREDENTIALS, "safe_mailing_group@example.com")
+    mock_send_email.return_value = httpx.Response(
+        200, content=b"Queued", request=httpx.Request("POST", "https://api.mailgun.net")
+    )
+
+    # Act
+    result = await backend.send(rendered_email)
+
+    # Assert
+    assert result == "Mailgun response: b'Queued'"
+    mock_send_email.assert_awaited_once_with(
+        client, rendered_email, CREDENTIALS, overwrite_outgoing_emails="safe_mailing_group@example.com"
+    )
+
+
+@pytest.mark.asyncio
+@patch("src.delivery.send_email")
+async def test_mailgun_backend__error(mock_send_email: AsyncMock, rendered_email: RenderedScheduledEmail) -> None:
+    # Arrange
+    backend = MailgunBackend(AsyncMock(), CREDENTIALS)
+    mock_send_email.return_value = httpx.Response(400, request=httpx.Request("POST", "https://api.mailgun.net"))
+
+    # Act & Assert
+    with pytest.raises(httpx.HTTPStatusError):
+        await backend.send(rendered_email)
+
+
+@pytest.mark.asyncio
+@patch("src.delivery.get_parameter_loader")
+@patch("src.delivery.read_mailgun_credentials")
+@patch("src.delivery.send_email")
+async def test_mailgun_backend__rotated_credentials_reloaded(
+    mock_send_email: AsyncMock,
+    mock_read_mailgun_credentials: AsyncMock,
+    mock_get_parameter_loader: MagicMock,
+    rendered_email: RenderedScheduledEmail,
+) -> None:
+    # Arrange
+    client = AsyncMock()
+    backend = MailgunBackend(client, CREDENTIALS)
+    new_credentials = MailgunCredentials(MAILGUN_SENDER_DOMAIN="example.com", MAILGUN_API_KEY="rotated")
+    mock_read_mailgun_credentials.return_value = new_credentials
+    request = httpx.Request("POST", "https://api.mailgun.net")
+    mock_send_email.side_effect = [
+        httpx.Response(401, request=request),
+        httpx.Response(200, content=b"Queued", request=request),
+    ]
+
+    # Act
+    result = await backend.send(rendered_email)
+
+    # Assert
+    assert result == "Mailgun response: b'Queued'"
+    mock_get_parameter_loader.return_value.invalidate.assert_called_once()
+    assert backend.credentials == new_credentials
+    assert mock_send_email.await_args_list[1].args == (client, rendered_email, new_credentials)
+
+
+@patch("src.delivery.smtplib.SMTP")
+def test_smtp_connection_pool__reuses_connection(mock_smtp: MagicMock) -> None:
+    # Arrange
+    pool = SMTPConnectionPool("smtp.example.org", 587, "user", "password")
+    mock_smtp.return_value.send_message.return_value = {}
+
+    # Act
+    results = [pool.send_message(MagicMock()) for _ in range(3)]
+
+    # Assert
+    assert results == [{}, {}, {}]
+    mock_smtp.assert_called_once_with("smtp.example.org", 587, timeout=30)
+    mock_smtp.return_value.starttls.assert_called_once()
+    mock_smtp.return_value.login.assert_called_once_with("user", "password")
+    assert mock_smtp.return_value.send_message.call_count == 3
+
+
+@patch("src.delivery.smtplib.SMTP")
+def test_smtp_connection_pool__reconnects_closed_connection(mock_smtp: MagicMock) -> None:
+    # Arrange
+    pool = SMTPConnectionPool("smtp.example.org", 587, starttls=False)
+    stale, fresh = MagicMock(), MagicMock()
+    stale.send_message.side_effect = smtplib.SMTPServerDisconnected()
+    fresh.send_message.return_value = {}
+    mock_smtp.side_effect = [stale, fresh]
+
+    # Act
+    result = pool.send_message(MagicMock())
+
+    # Assert
+    assert result == {}
+    stale.close.assert_called_once()
+    stale.login.assert_not_called()
+    fresh.send_message.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_smtp_backend(rendered_email: RenderedScheduledEmail) -> None:
+    # Arrange
+    pool = MagicMock(host="smtp.example.org")
+    pool.send = AsyncMock(return_value={})
+    backend = SMTPBackend(pool)
+
+    # Act
+    result = await backend.send(rendered_email)
+
+    # Assert
+    [message] = pool.send.await_args_list[0].args
+    assert message["To"] == "jdoe@example.com"
+    assert result == f"SMTP message {message['Message-ID']} accepted by smtp.example.org, refused recipients: {{}}"
+
+
+@pytest.mark.asyncio
+async def test_file_sink_backend(tmp_path: Path, rendered_email: RenderedScheduledEmail) -> None:
+    # Arrange
+    backend = FileSinkBackend(str(tmp_path / "outbox"))
+
+    # Act
+    result = await backend.send(rendered_email)
+
+    # Assert
+    path = tmp_path / "outbox" / f"{rendered_email.pk}.eml"
+    assert result == f"Message written to {path}."
+    assert message_from_bytes(path.read_bytes())["Subject"] == "Hello World!"
+
+
+@pytest.mark.asyncio
+async def test_null_sink_backend(rendered_email: RenderedScheduledEmail) -> None:
+    # Arrange
+    backend = FileSinkBackend()
+
+    # Act
+    result = await backend.send(rendered_email)
+
+    # Assert
+    assert backend.name == "null"
+    assert result == "Message discarded."
+
+
+@pytest.mark.asyncio
+async def test_failover_backend(rendered_email: RenderedScheduledEmail) -> None:
+    # Arrange
+    primary = AsyncMock(spec=MailgunBackend)
+    primary.name = "mailgun"
+    primary.send.side_effect = httpx.ConnectError("Mailgun unavailable")
+    backend = FailoverBackend(primary, FileSinkBackend())
+
+    # Act
+    result = await backend.send(rendered_email)
+
+    # Assert
+    assert backend.name == "mailgun,null"
+    assert result == "Message discarded. (after mailgun failed: Mailgun unavailable)"
+
+
+@pytest.mark.asyncio
+async def test_failover_backend__permanent_failure_not_retried(rendered_email: RenderedScheduledEmail) -> None:
+    # Arrange
+    primary = AsyncMock(spec=MailgunBackend)
+    primary.name = "mailgun"
+    response = httpx.Response(400, request=httpx.Request("POST", "https://api.mailgun.net"))
+    primary.send.side_effect = httpx.HTTPStatusError("Bad recipient", request=response.request, response=response)
+    secondary = AsyncMock(spec=FileSinkBackend)
+    secondary.name = "null"
+    backend = FailoverBackend(primary, secondary)
+
+    # Act & Assert
+    with pytest.raises(httpx.HTTPStatusError):
+        await backend.send(rendered_email)
+    secondary.send.assert_not_awaited()
+
+
+@pytest.mark.parametrize(
+    "exc,expected",
+    [
+        (httpx.ConnectError("unavailable"), True),
+        (httpx.ReadTimeout("timed out"), True),
+        (smtplib.SMTPServerDisconnected(), True),
+        (smtplib.SMTPResponseException(421, b"Try again later"), True),
+        (smtplib.SMTPResponseException(550, b"No such user"), False),
+        (smtplib.SMTPRecipientsRefused({}), False),
+        (ConnectionRefusedError(), True),
+        (ValueError(), False),
+    ],
+)
+def test_is_transient_failure(exc: Exception, expected: bool) -> None:
+    # Act & Assert
+    assert is_transient_failure(exc) is expected
+
+
+@pytest.mark.parametrize("status_code,expected", [(400, False), (404, False), (429, True), (500, True), (503, True)])
+def test_is_transient_failure__http_status(status_code: int, expected: bool) -> None:
+    # Arrange
+    response = httpx.Response(status_code, request=httpx.Request("POST", "https://api.mailgun.net"))
+    exc = httpx.HTTPStatusError("error", request=response.request, response=response)
+
+    # Act & Assert
+    assert is_transient_failure(exc) is expected
+
+
+@patch("src.delivery._smtp_pool", None)
+@patch("src.delivery.SMTPConnectionPool")
+def test_get_smtp_pool__replaced_when_credentials_rotate(mock_pool: MagicMock) -> None:
+    # Arrange
+    old_pool, new_pool = MagicMock(username="user", password="old"), MagicMock(username="user", password="new")
+    mock_pool.side_effect = [old_pool, new_pool]
+
+    # Act
+    first = get_smtp_pool(Credentials(USER="user", PASSWORD="old"))
+    reused = get_smtp_pool(Credentials(USER="user", PASSWORD="old"))
+    rotated = get_smtp_pool(Credentials(USER="user", PASSWORD="new"))
+
+    # Assert
+    assert first is reused is old_pool
+    assert rotated is new_pool
+    old_pool.close.assert_called_once()
+    new_pool.close.assert_not_called()
+
+
+@patch("src.delivery.smtplib.SMTP")
+def test_smtp_connection_pool__close(mock_smtp: MagicMock) -> None:
+    # Arrange
+    pool = SMTPConnectionPool("smtp.example.org", 587, starttls=False)
+    mock_smtp.return_value.send_message.return_value = {}
+    pool.send_message(MagicMock())
+
+    # Act
+    pool.close()
+
+    # Assert
+    mock_smtp.return_value.quit.assert_called_once()
+
+
+def test_create_delivery_backend() -> None:
+    # Arrange
+    settings = replace(SETTINGS, DELIVERY_BACKEND="mailgun", DELIVERY_FAILOVER_BACKEND="null")
+    client = AsyncMock()
+
+    # Act
+    backend = create_delivery_backend(settings, client, CREDENTIALS)
+
+    # Assert
+    assert isinstance(backend, FailoverBackend)
+    assert isinstance(backend.primary, MailgunBackend)
+    assert isinstance(backend.secondary, FileSinkBackend)
+    assert backend.primary.client is client
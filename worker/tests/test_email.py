@@ -1,6 +1,6 @@
 from datetime import UTC, datetime
 from typing import Any
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import AsyncMock
 from uuid import uuid4
 
 from jinja2 import DebugUndefined, Environment
@@ -8,9 +8,11 @@ from jinja2.exceptions import TemplateSyntaxError
 import pytest
 
 from src.email import (
-    read_attachment_from_s3,
+    append_attachment_links,
     render_email,
+    render_email_content,
     render_template_from_string,
+    send_batch_email,
     send_email,
 )
 from src.types import (
@@ -99,33 +101,51 @@ def test_render_email() -> None:
     )
 
 
-@patch("src.email.read_s3_bucket_from_ssm")
-@patch("src.email.inmemory_s3_download")
-def test_read_attachment_from_s3(
-    mock_inmemory_s3_download: MagicMock,
-    mock_read_s3_bucket_from_ssm: MagicMock,
-) -> None:
+def test_render_email_content() -> None:
     # Arrange
-    mock_read_s3_bucket_from_ssm.return_value = "bogus-s3"
-    mock_inmemory_s3_download.return_value = b"Test"
-    attachment = Attachment(
-        filename="certificate.pdf",
-        s3_path="certificates/random-person/certificate.pdf",
-        s3_bucket="",
-        presigned_url="",
-        presigned_url_expiration=None,
-    )
+    subject = "Hello World and {{ name }}!"
+    body = "Welcome, **{{ name }}**!"
+    context = {"name": "John Doe"}
+
+    # Act
+    result = render_email_content(subject, body, context)
+
+    # Assert
+    assert result == ("Hello World and John Doe!", "<p>Welcome, <strong>John Doe</strong>!</p>")
+
+
+def test_append_attachment_links() -> None:
+    # Arrange
+    body_html = "<p>Welcome!</p>"
+    attachments = [
+        Attachment(
+            filename="handbook <final>.pdf",
+            s3_path="handbooks/handbook.pdf",
+            s3_bucket="",
+            presigned_url="https://s3.example.org/handbook.pdf?X-Amz-Expires=3600&X-Amz-Signature=abc",
+            presigned_url_expiration=datetime(2024, 5, 1, 12, 0, tzinfo=UTC),
+        ),
+    ]
 
     # Act
-    result = read_attachment_from_s3(attachment)
+    result = append_attachment_links(body_html, attachments)
 
     # Assert
-    assert result == AttachmentWithContent(
-        filename="certificate.pdf",
-        content=b"Test",
+    assert result == (
+        "<p>Welcome!</p>\n<p>Attachments:</p>\n<ul>\n"
+        '<li><a href="https://s3.example.org/handbook.pdf?X-Amz-Expires=3600&amp;X-Amz-Signature=abc">'
+        "handbook &lt;final&gt;.pdf</a> (available until 2024-05-01 12:00 UTC)</li>\n</ul>"
     )
 
 
+def test_append_attachment_links__no_attachments() -> None:
+    # Act
+    result = append_attachment_links("<p>Welcome!</p>", [])
+
+    # Assert
+    assert result == "<p>Welcome!</p>"
+
+
 @pytest.mark.asyncio
 async def test_send_email() -> None:
     # Arrange
@@ -294,3 +314,60 @@ async def test_send_email__with_attachments() -> None:
             "html": email.body_rendered,
         },
     )
+
+
+@pytest.mark.asyncio
+async def test_send_batch_email() -> None:
+    # Arrange
+    client = AsyncMock()
+    now_ = datetime.now(tz=UTC)
+    emails = [
+        RenderedScheduledEmail(
+            pk=uuid4(),
+            created_at=now_,
+            last_updated_at=now_,
+            state=ScheduledEmailStatus.SCHEDULED,
+            scheduled_at=now_,
+            to_header=[],
+            to_header_context_json=[],
+            to_header_rendered=[recipient],
+            from_header="team@example.org",
+            reply_to_header="",
+            cc_header=[],
+            bcc_header=[],
+            subject="Hello World!",
+            subject_rendered="Hello World!",
+            body="Welcome!",
+            body_rendered="<p>Welcome!</p>",
+            context_json={},
+            template="Welcome email",
+            attachments=[],
+            attachments_with_content=[AttachmentWithContent(filename="certificate.pdf", content=b"Test")],
+        )
+        for recipient in ["jdoe@example.com", "asmith@example.com"]
+    ]
+    credentials = MailgunCredentials(
+        MAILGUN_SENDER_DOMAIN="example.com",
+        MAILGUN_API_KEY="secret",
+    )
+
+    # Act
+    await send_batch_email(client, emails, credentials)
+
+    # Assert
+    client.post.assert_awaited_once_with(
+        f"https://api.mailgun.net/v3/{credentials.MAILGUN_SENDER_DOMAIN}/messages",
+        auth=("api", credentials.MAILGUN_API_KEY),
+        files=[("attachment", ("certificate.pdf", b"Test"))],
+        data={
+            "from": "team@example.org",
+            "to": ["jdoe@example.com", "asmith@example.com"],
+            "h:Reply-To": "",
+            "subject": "Hello World!",
+            "html": "<p>Welcome!</p>",
+            "recipient-variables": (
+                f'{{"jdoe@example.com": {{"id": "{emails[0].pk}"}}, '
+                f'"asmith@example.com": {{"id": "{emails[1].pk}"}}}}'
+            ),
+        },
+    )
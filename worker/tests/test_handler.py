@@ -1,3 +1,4 @@
+from dataclasses import replace
 from datetime import datetime, timezone
 from typing import Any, cast
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -7,6 +8,8 @@ from httpx import HTTPStatusError
 import pytest
 
 from src.handler import handle_email, return_fail_email
+from src.rendering import RenderPlanner
+from src.settings import SETTINGS
 from src.token import TokenCache
 from src.types import (
     Attachment,
@@ -78,15 +81,15 @@ async def test_return_fail_email(scheduled_email: ScheduledEmail) -> None:
     controller.fail_by_id.assert_awaited_once_with(scheduled_email.pk, details=details)
 
     # no point in testing the values
-    assert result.keys() == {"email", "status"}
+    assert result.keys() == {"email", "status", "error"}
 
 
 @pytest.mark.asyncio
-@patch("src.handler.send_email")
+@patch("src.delivery.send_email")
 @patch("src.handler.fetch_model_field")
-@patch("src.handler.read_attachment_from_s3")
+@patch("src.attachments.AttachmentFetcher.fetch")
 async def test_handle_email__happy_path(
-    mock_read_attachment_from_s3: MagicMock,
+    mock_fetch_attachment: AsyncMock,
     mock_fetch_model_field: AsyncMock,
     mock_send_email: AsyncMock,
     token: AuthToken,
@@ -115,7 +118,7 @@ async def test_handle_email__happy_path(
         "id": "<20111114174239.25659.5817@samples.mailgun.org>",
     }
     mock_send_email.return_value.raise_for_status = MagicMock()
-    mock_read_attachment_from_s3.return_value = AttachmentWithContent(filename="certificate.pdf", content=b"Test")
+    mock_fetch_attachment.return_value = AttachmentWithContent(filename="certificate.pdf", content=b"Test")
 
     # Act
     result = await handle_email(
@@ -155,13 +158,13 @@ async def test_handle_email__invalid_context_json(
     overwrite_outgoing_emails: str,
 ) -> None:
     # Arrange
-    # forcing validation error
-    scheduled_email.context_json = cast(dict[str, Any], "{")
-    failed_email = scheduled_email.model_copy(update={"state": ScheduledEmailStatus.FAILED})
+    # forcing validation error of the email changed since it was listed
+    locked_email = scheduled_email.model_copy(update={"context_json": cast(dict[str, Any], "{")})
+    failed_email = locked_email.model_copy(update={"state": ScheduledEmailStatus.FAILED})
     client = AsyncMock()
     token_cache = TokenCache(client, token=token)
     controller = AsyncMock()
-    controller.lock_by_id.return_value = scheduled_email
+    controller.lock_by_id.return_value = locked_email
     controller.fail_by_id.return_value = failed_email
 
     # Act
@@ -178,6 +181,7 @@ async def test_handle_email__invalid_context_json(
     assert result == {
         "email": failed_email.model_dump(mode="json"),
         "status": failed_email.state.value,
+        "error": f"Failed to read email context {scheduled_email.pk}.",
     }
     controller.lock_by_id.assert_awaited_once_with(scheduled_email.pk)
     controller.fail_by_id.assert_awaited_once_with(
@@ -194,13 +198,13 @@ async def test_handle_email__invalid_to_header_context_json(
     overwrite_outgoing_emails: str,
 ) -> None:
     # Arrange
-    # forcing validation error
-    scheduled_email.to_header_context_json = cast(list[dict[str, Any]], "{")
-    failed_email = scheduled_email.model_copy(update={"state": ScheduledEmailStatus.FAILED})
+    # forcing validation error of the email changed since it was listed
+    locked_email = scheduled_email.model_copy(update={"to_header_context_json": cast(list[dict[str, Any]], "{")})
+    failed_email = locked_email.model_copy(update={"state": ScheduledEmailStatus.FAILED})
     client = AsyncMock()
     token_cache = TokenCache(client, token=token)
     controller = AsyncMock()
-    controller.lock_by_id.return_value = scheduled_email
+    controller.lock_by_id.return_value = locked_email
     controller.fail_by_id.return_value = failed_email
 
     # Act
@@ -217,6 +221,7 @@ async def test_handle_email__invalid_to_header_context_json(
     assert result == {
         "email": failed_email.model_dump(mode="json"),
         "status": failed_email.state.value,
+        "error": f"Failed to read email recipients {scheduled_email.pk}.",
     }
     controller.lock_by_id.assert_awaited_once_with(scheduled_email.pk)
     controller.fail_by_id.assert_awaited_once_with(
@@ -255,6 +260,7 @@ async def test_handle_email__unsupported_context_uri(
     assert result == {
         "email": failed_email.model_dump(mode="json"),
         "status": failed_email.state.value,
+        "error": ("Issue when generating context: Unsupported URI 'unsupported#John Doe' " "for context generation."),
     }
     controller.lock_by_id.assert_awaited_once_with(scheduled_email.pk)
     controller.fail_by_id.assert_awaited_once_with(
@@ -299,6 +305,7 @@ async def test_handle_email__api_error(
     assert result == {
         "email": failed_email.model_dump(mode="json"),
         "status": failed_email.state.value,
+        "error": "Issue when generating context: Client error '404 Not Found'",
     }
     controller.lock_by_id.assert_awaited_once_with(scheduled_email.pk)
     controller.fail_by_id.assert_awaited_once_with(
@@ -337,6 +344,9 @@ async def test_handle_email__invalid_recipients(
     assert result == {
         "email": failed_email.model_dump(mode="json"),
         "status": failed_email.state.value,
+        "error": (
+            f"Issue when generating email {scheduled_email.pk} recipients: " "Unsupported URI 'unsupported#John Doe'."
+        ),
     }
     controller.lock_by_id.assert_awaited_once_with(scheduled_email.pk)
     controller.fail_by_id.assert_awaited_once_with(
@@ -357,12 +367,13 @@ async def test_handle_email__invalid_jinja2_template(
     overwrite_outgoing_emails: str,
 ) -> None:
     # Arrange
-    scheduled_email.subject = "{{ invalid_syntax }"
-    failed_email = scheduled_email.model_copy(update={"state": ScheduledEmailStatus.FAILED})
+    # email changed since it was listed
+    locked_email = scheduled_email.model_copy(update={"subject": "{{ invalid_syntax }"})
+    failed_email = locked_email.model_copy(update={"state": ScheduledEmailStatus.FAILED})
     client = AsyncMock()
     token_cache = TokenCache(client, token=token)
     controller = AsyncMock()
-    controller.lock_by_id.return_value = scheduled_email
+    controller.lock_by_id.return_value = locked_email
     controller.fail_by_id.return_value = failed_email
     mock_fetch_model_field.return_value = "person@example.org"
 
@@ -380,6 +391,7 @@ async def test_handle_email__invalid_jinja2_template(
     assert result == {
         "email": failed_email.model_dump(mode="json"),
         "status": failed_email.state.value,
+        "error": (f"Failed to render email {scheduled_email.pk}. Error: unexpected '}}'"),
     }
     controller.lock_by_id.assert_awaited_once_with(scheduled_email.pk)
     controller.fail_by_id.assert_awaited_once_with(
@@ -389,11 +401,11 @@ async def test_handle_email__invalid_jinja2_template(
 
 
 @pytest.mark.asyncio
-@patch("src.handler.send_email")
+@patch("src.delivery.send_email")
 @patch("src.handler.fetch_model_field")
-@patch("src.handler.read_attachment_from_s3")
+@patch("src.attachments.AttachmentFetcher.fetch")
 async def test_handle_email__mailgun_error(
-    mock_read_attachment_from_s3: MagicMock,
+    mock_fetch_attachment: AsyncMock,
     mock_fetch_model_field: AsyncMock,
     mock_send_email: AsyncMock,
     token: AuthToken,
@@ -409,6 +421,7 @@ async def test_handle_email__mailgun_error(
     controller.lock_by_id.return_value = scheduled_email
     controller.fail_by_id.return_value = failed_email
     mock_fetch_model_field.return_value = "person@example.org"
+    mock_fetch_attachment.return_value = AttachmentWithContent(filename="certificate.pdf", content=b"Test")
     mock_send_email.return_value.raise_for_status = MagicMock(
         side_effect=HTTPStatusError("test", request=MagicMock(), response=MagicMock())
     )
@@ -427,6 +440,7 @@ async def test_handle_email__mailgun_error(
     assert result == {
         "email": failed_email.model_dump(mode="json"),
         "status": failed_email.state.value,
+        "error": (f"Failed to send email {scheduled_email.pk}. Error: test"),
     }
     controller.lock_by_id.assert_awaited_once_with(scheduled_email.pk)
     controller.fail_by_id.assert_awaited_once_with(
@@ -437,9 +451,9 @@ async def test_handle_email__mailgun_error(
 
 @pytest.mark.asyncio
 @patch("src.handler.fetch_model_field")
-@patch("src.handler.read_attachment_from_s3")
+@patch("src.attachments.AttachmentFetcher.fetch")
 async def test_handle_email__s3_error(
-    mock_read_attachment_from_s3: MagicMock,
+    mock_fetch_attachment: AsyncMock,
     mock_fetch_model_field: AsyncMock,
     token: AuthToken,
     scheduled_email: ScheduledEmail,
@@ -454,7 +468,7 @@ async def test_handle_email__s3_error(
     controller.lock_by_id.return_value = scheduled_email
     controller.fail_by_id.return_value = failed_email
     mock_fetch_model_field.return_value = "person@example.org"
-    mock_read_attachment_from_s3.side_effect = Exception("???")  # TODO: use real exception
+    mock_fetch_attachment.side_effect = Exception("???")  # TODO: use real exception
 
     # Act
     result = await handle_email(
@@ -470,9 +484,274 @@ async def test_handle_email__s3_error(
     assert result == {
         "email": failed_email.model_dump(mode="json"),
         "status": failed_email.state.value,
+        "error": (f"Failed to download attachments for email {scheduled_email.pk}. Error: ???"),
     }
     controller.lock_by_id.assert_awaited_once_with(scheduled_email.pk)
     controller.fail_by_id.assert_awaited_once_with(
         scheduled_email.pk,
         details=(f"Failed to download attachments for email {scheduled_email.pk}. Error: ???"),
     )
+
+
+@pytest.mark.asyncio
+@patch("src.delivery.send_email")
+@patch("src.handler.fetch_model_field")
+@patch("src.attachments.AttachmentFetcher.fetch")
+async def test_handle_email__render_planner_reuses_render(
+    mock_fetch_attachment: AsyncMock,
+    mock_fetch_model_field: AsyncMock,
+    mock_send_email: AsyncMock,
+    token: AuthToken,
+    scheduled_email: ScheduledEmail,
+    mailgun_credentials: MailgunCredentials,
+    overwrite_outgoing_emails: str,
+) -> None:
+    # Arrange
+    other_email = scheduled_email.model_copy(update={"pk": uuid4()})
+    client = AsyncMock()
+    token_cache = TokenCache(client, token=token)
+    controller = AsyncMock()
+    controller.lock_by_id.side_effect = [scheduled_email, other_email]
+    controller.succeed_by_id.side_effect = [scheduled_email, other_email]
+    mock_fetch_model_field.side_effect = ["person1@example.org", "person2@example.org"]
+    mock_send_email.return_value.raise_for_status = MagicMock()
+    mock_fetch_attachment.return_value = AttachmentWithContent(filename="certificate.pdf", content=b"Test")
+    render_planner = RenderPlanner()
+
+    # Act
+    for email in [scheduled_email, other_email]:
+        await handle_email(
+            email,
+            mailgun_credentials,
+            overwrite_outgoing_emails,
+            controller,
+            client,
+            token_cache,
+            render_planner=render_planner,
+        )
+
+    # Assert
+    assert render_planner.renders == 1
+    assert render_planner.renders_saved == 1
+    sent_emails = [call.args[1] for call in mock_send_email.await_args_list]
+    assert [email.pk for email in sent_emails] == [scheduled_email.pk, other_email.pk]
+    assert [email.to_header_rendered for email in sent_emails] == [["person1@example.org"], ["person2@example.org"]]
+    assert {email.body_rendered for email in sent_emails} == {"<p>Welcome, John Doe!</p>\n<p>New paragraph.</p>"}
+
+
+@pytest.mark.asyncio
+@patch("src.delivery.send_email")
+@patch("src.handler.fetch_model_field")
+@patch("src.attachments.AttachmentFetcher.fetch")
+async def test_handle_email__unused_context_keys_skipped(
+    mock_fetch_attachment: AsyncMock,
+    mock_fetch_model_field: AsyncMock,
+    mock_send_email: AsyncMock,
+    token: AuthToken,
+    scheduled_email: ScheduledEmail,
+    mailgun_credentials: MailgunCredentials,
+    overwrite_outgoing_emails: str,
+) -> None:
+    # Arrange
+    scheduled_email.context_json = {
+        "name": "value:str#John Doe",
+        "legacy_event": "api:event#1",
+        "legacy_persons": ["api:person#1", "api:person#2"],
+    }
+    client = AsyncMock()
+    token_cache = TokenCache(client, token=token)
+    controller = AsyncMock()
+    controller.lock_by_id.return_value = scheduled_email
+    controller.succeed_by_id.return_value = scheduled_email
+    mock_fetch_model_field.return_value = "person@example.org"
+    mock_send_email.return_value.raise_for_status = MagicMock()
+    mock_fetch_attachment.return_value = AttachmentWithContent(filename="certificate.pdf", content=b"Test")
+
+    # Act
+    result = await handle_email(
+        scheduled_email,
+        mailgun_credentials,
+        overwrite_outgoing_emails,
+        controller,
+        client,
+        token_cache,
+    )
+
+    # Assert
+    assert result == {
+        "email": scheduled_email.model_dump(mode="json"),
+        "status": scheduled_email.state.value,
+        "skipped_context_keys": ["legacy_event", "legacy_persons"],
+    }
+    client.get.assert_not_awaited()
+    mock_send_email.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@patch("src.delivery.send_email")
+@patch("src.handler.fetch_model_field")
+@patch("src.attachments.AttachmentFetcher.select_linked")
+@patch("src.attachments.AttachmentFetcher.fetch")
+async def test_handle_email__large_attachments_linked(
+    mock_fetch_attachment: AsyncMock,
+    mock_select_linked: AsyncMock,
+    mock_fetch_model_field: AsyncMock,
+    mock_send_email: AsyncMock,
+    token: AuthToken,
+    scheduled_email: ScheduledEmail,
+    mailgun_credentials: MailgunCredentials,
+    overwrite_outgoing_emails: str,
+) -> None:
+    # Arrange
+    linked_attachment = scheduled_email.attachments[0]
+    linked_attachment.presigned_url = "https://s3.example.org/certificate.pdf"
+    client = AsyncMock()
+    token_cache = TokenCache(client, token=token)
+    controller = AsyncMock()
+    controller.lock_by_id.return_value = scheduled_email
+    controller.succeed_by_id.return_value = scheduled_email
+    mock_fetch_model_field.return_value = "person@example.org"
+    mock_send_email.return_value.raise_for_status = MagicMock()
+    mock_select_linked.return_value = [(linked_attachment, 5_000_000)]
+
+    # Act
+    with patch("src.handler.SETTINGS", replace(SETTINGS, ATTACHMENT_LINK_THRESHOLD_BYTES=1_000_000)):
+        result = await handle_email(
+            scheduled_email,
+            mailgun_credentials,
+            overwrite_outgoing_emails,
+            controller,
+            client,
+            token_cache,
+        )
+
+    # Assert
+    assert result == {
+        "email": scheduled_email.model_dump(mode="json"),
+        "status": scheduled_email.state.value,
+        "attachments_linked": ["certificate.pdf"],
+        "attachment_bytes_saved": 5_000_000,
+    }
+    mock_fetch_attachment.assert_not_awaited()
+    sent_email = mock_send_email.call_args.args[1]
+    assert sent_email.attachments_with_content == []
+    assert '<a href="https://s3.example.org/certificate.pdf">certificate.pdf</a>' in sent_email.body_rendered
+
+
+@pytest.mark.asyncio
+@patch("src.delivery.send_email")
+@patch("src.handler.fetch_model_field")
+@patch("src.attachments.AttachmentFetcher.fetch")
+async def test_handle_email__sent_by_batcher(
+    mock_fetch_attachment: AsyncMock,
+    mock_fetch_model_field: AsyncMock,
+    mock_send_email: AsyncMock,
+    token: AuthToken,
+    scheduled_email: ScheduledEmail,
+    mailgun_credentials: MailgunCredentials,
+    overwrite_outgoing_emails: str,
+) -> None:
+    # Arrange
+    client = AsyncMock()
+    token_cache = TokenCache(client, token=token)
+    controller = AsyncMock()
+    controller.lock_by_id.return_value = scheduled_email
+    controller.succeed_by_id.return_value = scheduled_email
+    mock_fetch_model_field.return_value = "person@example.org"
+    mock_fetch_attachment.return_value = AttachmentWithContent(filename="certificate.pdf", content=b"Test")
+    batcher = AsyncMock()
+    batcher.send.return_value.raise_for_status = MagicMock()
+
+    # Act
+    result = await handle_email(
+        scheduled_email,
+        mailgun_credentials,
+        overwrite_outgoing_emails,
+        controller,
+        client,
+        token_cache,
+        batcher=batcher,
+    )
+
+    # Assert
+    assert result["status"] == scheduled_email.state.value
+    batcher.send.assert_awaited_once()
+    mock_send_email.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "update,details",
+    [
+        ({"context_json": "{"}, "Failed to read email context {pk}."),
+        ({"to_header_context_json": "{"}, "Failed to read email recipients {pk}."),
+        ({"body": "{{ invalid_syntax }"}, "Failed to render email {pk}. Error: unexpected '}}'"),
+    ],
+)
+async def test_handle_email__invalid_email_failed_without_lock(
+    update: dict[str, Any],
+    details: str,
+    token: AuthToken,
+    scheduled_email: ScheduledEmail,
+    mailgun_credentials: MailgunCredentials,
+    overwrite_outgoing_emails: str,
+) -> None:
+    # Arrange
+    invalid_email = scheduled_email.model_copy(update=update)
+    failed_email = invalid_email.model_copy(update={"state": ScheduledEmailStatus.FAILED})
+    client = AsyncMock()
+    token_cache = TokenCache(client, token=token)
+    controller = AsyncMock()
+    controller.fail_by_id.return_value = failed_email
+
+    # Act
+    result = await handle_email(
+        invalid_email,
+        mailgun_credentials,
+        overwrite_outgoing_emails,
+        controller,
+        client,
+        token_cache,
+    )
+
+    # Assert
+    assert result == {
+        "email": failed_email.model_dump(mode="json"),
+        "status": failed_email.state.value,
+        "error": details.format(pk=scheduled_email.pk),
+        "lock_skipped": True,
+    }
+    controller.lock_by_id.assert_not_awaited()
+    controller.fail_by_id.assert_awaited_once_with(scheduled_email.pk, details=details.format(pk=scheduled_email.pk))
+
+
+@pytest.mark.asyncio
+async def test_handle_email__invalid_email_locked_when_api_rejects_failing_it(
+    token: AuthToken,
+    scheduled_email: ScheduledEmail,
+    mailgun_credentials: MailgunCredentials,
+    overwrite_outgoing_emails: str,
+) -> None:
+    # Arrange
+    invalid_email = scheduled_email.model_copy(update={"context_json": "{"})
+    failed_email = invalid_email.model_copy(update={"state": ScheduledEmailStatus.FAILED})
+    client = AsyncMock()
+    token_cache = TokenCache(client, token=token)
+    controller = AsyncMock()
+    rejected = HTTPStatusError("Bad Request", request=MagicMock(), response=MagicMock(status_code=400))
+    controller.fail_by_id.side_effect = [rejected, failed_email]
+
+    # Act
+    result = await handle_email(
+        invalid_email,
+        mailgun_credentials,
+        overwrite_outgoing_emails,
+        controller,
+        client,
+        token_cache,
+    )
+
+    # Assert
+    assert "lock_skipped" not in result
+    controller.lock_by_id.assert_awaited_once_with(scheduled_email.pk)
+    assert controller.fail_by_id.await_count == 2
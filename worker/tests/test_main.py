@@ -0,0 +1,20 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from main import main
+
+
+@pytest.mark.asyncio
+@patch("src.sending.send_emails")
+@patch("main.ScheduledEmailController")
+async def test_main__no_emails(mock_controller_class: MagicMock, mock_send_emails: AsyncMock) -> None:
+    # Arrange
+    mock_controller_class.return_value.get_scheduled_to_run = AsyncMock(return_value=[])
+
+    # Act
+    result = await main({}, MagicMock())
+
+    # Assert
+    assert result == {"emails": []}
+    mock_send_emails.assert_not_awaited()
@@ -0,0 +1,67 @@
+from dataclasses import replace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+
+from src.prewarm import prewarm, warm_up
+from src.settings import MAILGUN_API_URL, SETTINGS
+from src.token import TokenCache
+from src.types import AuthToken
+
+
+@pytest.mark.asyncio
+@patch("src.prewarm.get_parameter_loader")
+async def test_warm_up(mock_get_parameter_loader: MagicMock, token: AuthToken) -> None:
+    # Arrange
+    mock_get_parameter_loader.return_value.get = AsyncMock()
+    client = AsyncMock()
+    token_cache = TokenCache(client)
+    settings = replace(SETTINGS, DELIVERY_BACKEND="mailgun")
+
+    # Act
+    with patch.object(token_cache, "fetch_token", return_value=token) as mock_fetch_token:
+        await warm_up(client, token_cache, settings)
+
+    # Assert
+    mock_get_parameter_loader.return_value.get.assert_awaited_once_with()
+    mock_fetch_token.assert_awaited_once_with()
+    assert token_cache._token == token
+    client.head.assert_awaited_once_with(MAILGUN_API_URL)
+
+
+@pytest.mark.asyncio
+@patch("src.prewarm.get_parameter_loader")
+async def test_warm_up__no_mailgun(mock_get_parameter_loader: MagicMock, token: AuthToken) -> None:
+    # Arrange
+    mock_get_parameter_loader.return_value.get = AsyncMock()
+    client = AsyncMock()
+    token_cache = TokenCache(client)
+    settings = replace(SETTINGS, DELIVERY_BACKEND="smtp", DELIVERY_FAILOVER_BACKEND=None)
+
+    # Act
+    with patch.object(token_cache, "fetch_token", return_value=token):
+        await warm_up(client, token_cache, settings)
+
+    # Assert
+    client.head.assert_not_awaited()
+
+
+@patch("src.prewarm.get_parameter_loader")
+def test_prewarm__failures_left_for_lazy_initialization(mock_get_parameter_loader: MagicMock) -> None:
+    # Arrange
+    mock_get_parameter_loader.return_value.get = AsyncMock(side_effect=RuntimeError("SSM unavailable"))
+    settings = replace(SETTINGS, DELIVERY_BACKEND="mailgun")
+
+    # Act
+    with (
+        patch("src.token.read_token_credentials_from_ssm", side_effect=RuntimeError("SSM unavailable")),
+        patch("httpx.AsyncClient.head", side_effect=httpx.ConnectError("unreachable")),
+    ):
+        prewarmed = prewarm(settings)
+
+    # Assert
+    assert prewarmed.token_cache._token is None
+    assert not prewarmed.loop.is_closed()
+    prewarmed.loop.run_until_complete(prewarmed.client.aclose())
+    prewarmed.loop.close()
@@ -0,0 +1,54 @@
+import multiprocessing
+import os
+from typing import Iterator
+from unittest.mock import patch
+
+import pytest
+
+from src.processpool import PipeProcessPool, WorkerProcessDied
+
+
+@pytest.fixture
+def pool() -> Iterator[PipeProcessPool]:
+    pool = PipeProcessPool(2, mp_context=multiprocessing.get_context("forkserver"))
+    yield pool
+    pool.shutdown()
+
+
+def test_pipe_process_pool__runs_jobs_in_processes(pool: PipeProcessPool) -> None:
+    # Act
+    results = list(pool.map(pow, [2, 3, 4], [10, 2, 2]))
+    pids = {pool.submit(os.getpid).result() for _ in range(10)}
+
+    # Assert
+    assert results == [1024, 9, 16]
+    assert os.getpid() not in pids
+
+
+def test_pipe_process_pool__exception_raised(pool: PipeProcessPool) -> None:
+    # Act & Assert
+    with pytest.raises(ValueError, match="invalid literal"):
+        pool.submit(int, "not a number").result()
+    assert pool.submit(int, "42").result() == 42
+
+
+def test_pipe_process_pool__dead_worker_replaced(pool: PipeProcessPool) -> None:
+    # Act & Assert
+    with pytest.raises(WorkerProcessDied):
+        pool.submit(os._exit, 1).result()
+    assert [pool.submit(pow, 2, 3).result() for _ in range(4)] == [8, 8, 8, 8]
+
+
+def test_pipe_process_pool__works_without_semaphores() -> None:
+    # Arrange
+    # AWS Lambda has no /dev/shm, so creating POSIX semaphores fails there.
+    with patch("_multiprocessing.SemLock", side_effect=OSError(38, "Function not implemented")):
+        # Act
+        pool = PipeProcessPool(1, mp_context=multiprocessing.get_context("forkserver"))
+        try:
+            result = pool.submit(pow, 2, 10).result()
+        finally:
+            pool.shutdown()
+
+    # Assert
+    assert result == 1024
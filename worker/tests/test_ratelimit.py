@@ -0,0 +1,221 @@
+import asyncio
+from dataclasses import replace
+from datetime import UTC, datetime
+import time
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+
+from src.ratelimit import (
+    AdaptiveRateLimiter,
+    get_mailgun_rate_limiter,
+    parse_retry_after,
+    send_rate_limited,
+)
+from src.settings import SETTINGS
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (None, None),
+        ("", None),
+        ("5", 5.0),
+        ("-1", 0.0),
+        ("Wed, 01 May 2024 12:00:30 GMT", 30.0),
+        ("soon", None),
+    ],
+)
+def test_parse_retry_after(value: str | None, expected: float | None) -> None:
+    # Arrange
+    current_time = datetime(2024, 5, 1, 12, 0, 0, tzinfo=UTC)
+
+    # Act
+    result = parse_retry_after(value, current_time)
+
+    # Assert
+    assert result == expected
+
+
+def test_adaptive_rate_limiter__paces_requests() -> None:
+    # Arrange
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(rate=10, min_rate=1, max_rate=100, clock=clock)
+
+    # Act
+    first = limiter.try_acquire()
+    delays = [limiter.try_acquire() for _ in range(2)]
+    clock.now += 0.1
+    later = limiter.try_acquire()
+
+    # Assert
+    assert first == 0.0
+    assert delays == pytest.approx([0.1, 0.1])
+    assert later == 0.0
+
+
+@pytest.mark.parametrize("rate,min_rate,max_rate", [(0, 0, 100), (10, 0, 100), (10, 20, 100), (10, 1, 5)])
+def test_adaptive_rate_limiter__invalid_rates(rate: float, min_rate: float, max_rate: float) -> None:
+    # Act & Assert
+    with pytest.raises(ValueError):
+        AdaptiveRateLimiter(rate=rate, min_rate=min_rate, max_rate=max_rate)
+
+
+def test_adaptive_rate_limiter__additive_increase() -> None:
+    # Arrange
+    limiter = AdaptiveRateLimiter(rate=10, min_rate=1, max_rate=10.5, clock=FakeClock())
+
+    # Act
+    limiter.on_success()
+    after_one = limiter.rate
+    for _ in range(100):
+        limiter.on_success()
+
+    # Assert
+    assert after_one == pytest.approx(10.1)
+    assert limiter.rate == 10.5
+
+
+def test_adaptive_rate_limiter__multiplicative_decrease_once_per_second() -> None:
+    # Arrange
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(rate=16, min_rate=3, max_rate=100, clock=clock)
+
+    # Act
+    limiter.on_throttled()
+    limiter.on_throttled()
+    after_burst = limiter.rate
+    clock.now += 1
+    limiter.on_throttled()
+    clock.now += 1
+    limiter.on_throttled()
+
+    # Assert
+    assert after_burst == 8
+    assert limiter.rate == 3
+    assert limiter.throttled == 4
+
+
+def test_adaptive_rate_limiter__retry_after_pauses_requests() -> None:
+    # Arrange
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(rate=10, min_rate=1, max_rate=100, clock=clock)
+
+    # Act
+    limiter.on_throttled(retry_after=5)
+    delay = limiter.try_acquire()
+
+    # Assert
+    assert delay == 5
+
+
+@pytest.mark.asyncio
+async def test_adaptive_rate_limiter__throttling_slows_waiting_requests() -> None:
+    # Arrange
+    limiter = AdaptiveRateLimiter(rate=50, min_rate=1, max_rate=50)
+    acquired: list[float] = []
+
+    async def acquire() -> None:
+        await limiter.acquire()
+        acquired.append(time.monotonic())
+
+    # Act
+    start = time.monotonic()
+    tasks = [asyncio.create_task(acquire()) for _ in range(6)]
+    await asyncio.sleep(0)
+    # first request was sent right away, and throttled
+    limiter.on_throttled(retry_after=0.3)
+    await asyncio.gather(*tasks)
+
+    # Assert
+    assert acquired[0] - start < 0.1
+    assert acquired[1] - start >= 0.29
+    # halved rate applies to requests which were already waiting
+    gaps = [later - earlier for earlier, later in zip(acquired[1:], acquired[2:])]
+    assert min(gaps) >= 1 / 25 - 0.005
+
+
+@pytest.mark.asyncio
+async def test_adaptive_rate_limiter__increase_shortens_waits() -> None:
+    # Arrange
+    limiter = AdaptiveRateLimiter(rate=1, min_rate=1, max_rate=100)
+    await limiter.acquire()
+
+    # Act
+    start = time.monotonic()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    limiter.rate = 100
+    await asyncio.sleep(0.25)
+
+    # Assert
+    assert waiting.done()
+    assert time.monotonic() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_send_rate_limited__without_limiter() -> None:
+    # Arrange
+    send = AsyncMock(return_value=httpx.Response(429))
+
+    # Act
+    response = await send_rate_limited(None, send)
+
+    # Assert
+    assert response.status_code == 429
+    send.assert_awaited_once()
+
+
+def test_get_mailgun_rate_limiter__disabled() -> None:
+    # Act
+    with patch("src.ratelimit.SETTINGS", replace(SETTINGS, MAILGUN_RATE_LIMIT=0)):
+        limiter = get_mailgun_rate_limiter.__wrapped__()
+
+    # Assert
+    assert limiter is None
+
+
+@pytest.mark.asyncio
+async def test_send_rate_limited__retries_throttled_request() -> None:
+    # Arrange
+    limiter = AdaptiveRateLimiter(rate=1000, min_rate=1, max_rate=1000)
+    send = AsyncMock(
+        side_effect=[
+            httpx.Response(429, headers={"Retry-After": "0"}),
+            httpx.Response(200, json={"message": "Queued. Thank you."}),
+        ]
+    )
+
+    # Act
+    response = await send_rate_limited(limiter, send)
+
+    # Assert
+    assert response.status_code == 200
+    assert send.await_count == 2
+    assert limiter.throttled == 1
+    assert limiter.rate == pytest.approx(500 + 1 / 500)
+
+
+@pytest.mark.asyncio
+async def test_send_rate_limited__gives_up_after_retries() -> None:
+    # Arrange
+    limiter = AdaptiveRateLimiter(rate=1000, min_rate=1, max_rate=1000)
+    send = AsyncMock(return_value=httpx.Response(429))
+
+    # Act
+    with patch("src.ratelimit.asyncio.sleep") as mock_sleep:
+        response = await send_rate_limited(limiter, send, retries=2)
+
+    # Assert
+    assert response.status_code == 429
+    assert send.await_count == 3
+    assert mock_sleep.await_count >= 1
@@ -0,0 +1,261 @@
+import os
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+from jinja2.exceptions import TemplateSyntaxError
+import markdown
+import pytest
+
+from src.rendering import (
+    BoundedFileSystemBytecodeCache,
+    MarkdownConverter,
+    RenderExecutor,
+    RenderPlanner,
+    StringLoader,
+    analyze_templates,
+    create_bytecode_cache,
+    create_engine,
+    get_engine,
+    render_fingerprint,
+    template_variables,
+)
+from src.types import RenderExecutorKind
+
+
+def test_string_loader__template_cached_in_engine() -> None:
+    # Arrange
+    engine = create_engine()
+    template = "Hello {{ name }}!"
+
+    # Act
+    first = engine.get_template(template)
+    second = engine.get_template(template)
+
+    # Assert
+    assert isinstance(engine.loader, StringLoader)
+    assert first is second
+    assert first.render(name="John Doe") == "Hello John Doe!"
+
+
+def test_create_bytecode_cache__disabled() -> None:
+    # Act
+    result = create_bytecode_cache("", max_bytes=1024)
+
+    # Assert
+    assert result is None
+
+
+def test_bytecode_cache__reused_by_new_engine(tmp_path: Path) -> None:
+    # Arrange
+    template = "Hello {{ name }}!"
+    create_engine(BoundedFileSystemBytecodeCache(str(tmp_path), max_bytes=1024 * 1024)).get_template(template)
+    engine = create_engine(BoundedFileSystemBytecodeCache(str(tmp_path), max_bytes=1024 * 1024))
+
+    # Act
+    with patch.object(engine, "compile", side_effect=AssertionError("template compiled")) as mock_compile:
+        result = engine.get_template(template).render(name="John Doe")
+
+    # Assert
+    assert result == "Hello John Doe!"
+    mock_compile.assert_not_called()
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_bytecode_cache__evicts_least_recently_used(tmp_path: Path) -> None:
+    # Arrange
+    cache = BoundedFileSystemBytecodeCache(str(tmp_path), max_bytes=1024 * 1024)
+    engine = create_engine(cache)
+    engine.get_template("First {{ name }}")
+    engine.get_template("Second {{ name }}")
+    first, second = sorted(tmp_path.iterdir(), key=lambda path: path.stat().st_mtime)
+    os.utime(first, (0, 0))
+    cache.max_bytes = second.stat().st_size
+
+    # Act
+    cache.evict()
+
+    # Assert
+    assert list(tmp_path.iterdir()) == [second]
+
+
+def test_markdown_converter__same_output_as_markdown() -> None:
+    # Arrange
+    converter = MarkdownConverter(cache_size=0)
+    text = "# Welcome\n\nHello *John Doe*!\n\n* first\n* second"
+
+    # Act
+    result = converter.convert(text)
+
+    # Assert
+    assert result == markdown.markdown(text)
+
+
+def test_markdown_converter__instance_reused_and_reset() -> None:
+    # Arrange
+    converter = MarkdownConverter(cache_size=0)
+
+    # Act
+    converter.convert("[1]: https://example.org")
+    result = converter.convert("[link][1]")
+
+    # Assert
+    assert converter._pool.qsize() == 1
+    assert result == "<p>[link][1]</p>"  # reference from previous text is not remembered
+
+
+def test_markdown_converter__output_memoized() -> None:
+    # Arrange
+    converter = MarkdownConverter(cache_size=10)
+    text = "Hello *John Doe*!"
+
+    # Act
+    with patch.object(markdown.Markdown, "convert", autospec=True, return_value="<p>cached</p>") as mock_convert:
+        first = converter.convert(text)
+        second = converter.convert(text)
+
+    # Assert
+    assert first == second == "<p>cached</p>"
+    mock_convert.assert_called_once()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["inline", "thread", "process"])
+async def test_render_executor__run(kind: RenderExecutorKind) -> None:
+    # Arrange
+    executor = RenderExecutor(kind, max_workers=2)
+
+    # Act
+    result = await executor.run(pow, 2, 10)
+
+    # Assert
+    assert executor.kind == kind
+    assert result == 1024
+
+
+@pytest.mark.asyncio
+async def test_render_executor__process_pool_unavailable() -> None:
+    # Arrange
+    with patch("src.rendering.PipeProcessPool", side_effect=OSError("Function not implemented")):
+        # Act
+        executor = RenderExecutor("process", max_workers=2)
+
+    # Assert
+    assert executor.kind == "thread"
+    assert await executor.run(pow, 2, 10) == 1024
+
+
+@pytest.mark.asyncio
+async def test_render_executor__preload() -> None:
+    # Arrange
+    executor = RenderExecutor("thread", max_workers=2)
+    template = "Preloaded {{ name }}"
+
+    # Act
+    await executor.preload([template, template, "Invalid {{ name }"])
+
+    # Assert
+    with patch.object(get_engine(), "compile", side_effect=AssertionError("template compiled")):
+        assert get_engine().get_template(template).render(name="template") == "Preloaded template"
+
+
+def test_render_fingerprint() -> None:
+    # Act
+    first = render_fingerprint("Subject", "Body {{ name }}", {"name": "John", "age": 30})
+    same = render_fingerprint("Subject", "Body {{ name }}", {"age": 30, "name": "John"})
+    different = render_fingerprint("Subject", "Body {{ name }}", {"name": "Jane", "age": 30})
+
+    # Assert
+    assert first == same
+    assert first != different
+
+
+@pytest.mark.asyncio
+async def test_render_planner__renders_each_fingerprint_once() -> None:
+    # Arrange
+    planner = RenderPlanner()
+    render = AsyncMock(return_value=("Subject", "<p>Body</p>"))
+
+    # Act
+    results = [
+        await planner.render("fingerprint-1", render),
+        await planner.render("fingerprint-1", render),
+        await planner.render("fingerprint-2", render),
+    ]
+
+    # Assert
+    assert results == [("Subject", "<p>Body</p>")] * 3
+    assert render.await_count == 2
+    assert planner.renders == 2
+    assert planner.renders_saved == 1
+
+
+@pytest.mark.asyncio
+async def test_render_planner__finished_renders_bounded() -> None:
+    # Arrange
+    planner = RenderPlanner(max_results=2)
+    render = AsyncMock(return_value=("Subject", "<p>Body</p>"))
+
+    # Act
+    for fingerprint in ["fingerprint-1", "fingerprint-2", "fingerprint-1", "fingerprint-3", "fingerprint-2"]:
+        await planner.render(fingerprint, render)
+
+    # Assert
+    # fingerprint-2 was least recently used when fingerprint-3 was rendered
+    assert list(planner._results) == ["fingerprint-3", "fingerprint-2"]
+    assert render.await_count == 4
+    assert planner.renders_saved == 1
+
+
+@pytest.mark.asyncio
+async def test_render_planner__error_shared_by_group() -> None:
+    # Arrange
+    planner = RenderPlanner()
+    render = AsyncMock(side_effect=ValueError("Invalid template"))
+
+    # Act & Assert
+    for _ in range(2):
+        with pytest.raises(ValueError, match="Invalid template"):
+            await planner.render("fingerprint", render)
+    render.assert_awaited_once()
+
+
+def test_template_variables() -> None:
+    # Act
+    result = template_variables(
+        "Hello {{ person.personal }}!",
+        "{% for task in tasks %}{{ task.role }} at {{ event.slug }}{% endfor %}{% set local = 1 %}{{ local }}",
+    )
+
+    # Assert
+    assert result == frozenset({"person", "tasks", "event"})
+
+
+def test_template_variables__syntax_error() -> None:
+    # Act
+    result = template_variables("Hello {{ name }!")
+
+    # Assert
+    assert result is None
+
+
+def test_analyze_templates__syntax_error() -> None:
+    # Act
+    result = analyze_templates("Hello {{ name }}!", "Hello {{ name }!")
+
+    # Assert
+    assert isinstance(result, TemplateSyntaxError)
+    assert str(result) == "unexpected '}'"
+    assert result.__traceback__ is None
+
+
+def test_template_variables__templates_parsed_once() -> None:
+    # Arrange
+    templates = ("Subject for {{ event.slug }}", "Body for {{ person.personal }}")
+    analyze_templates(*templates)
+
+    # Act
+    with patch.object(get_engine(), "parse", side_effect=AssertionError("template parsed again")):
+        result = template_variables(*templates)
+
+    # Assert
+    assert result == frozenset({"event", "person"})
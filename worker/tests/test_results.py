@@ -0,0 +1,97 @@
+from dataclasses import replace
+from datetime import UTC, datetime
+import json
+from pathlib import Path
+from typing import IO
+from unittest.mock import MagicMock, patch
+
+from src.results import (
+    FileResultSink,
+    S3ResultSink,
+    compact_output,
+    create_result_sink,
+)
+from src.settings import SETTINGS
+from src.types import WorkerOutputEmail
+
+SUCCEEDED: WorkerOutputEmail = {
+    "email": {"pk": "9116a1af-f361-4633-8990-5e16e43683e3", "body": "Hello", "context_json": {}},
+    "status": "succeeded",
+    "duration_seconds": 0.25,
+}
+FAILED: WorkerOutputEmail = {
+    "email": {"pk": "bffca722-d774-4b78-84d4-56863c5e923d", "body": "Hello", "context_json": {}},
+    "status": "failed",
+    "error": "Failed to send email.",
+}
+
+
+def test_compact_output() -> None:
+    # Act
+    succeeded = compact_output(SUCCEEDED)
+    failed = compact_output(FAILED)
+
+    # Assert
+    assert succeeded == {"pk": "9116a1af-f361-4633-8990-5e16e43683e3", "status": "succeeded", "duration_seconds": 0.25}
+    assert failed == {
+        "pk": "bffca722-d774-4b78-84d4-56863c5e923d",
+        "status": "failed",
+        "error": "Failed to send email.",
+    }
+
+
+def test_file_result_sink(tmp_path: Path) -> None:
+    # Arrange
+    sink = FileResultSink(str(tmp_path / "results"), "invocation.ndjson")
+
+    # Act
+    sink.write(SUCCEEDED)
+    written_before_close = (tmp_path / "results" / "invocation.ndjson").read_text()
+    sink.write(FAILED)
+    location = sink.close()
+
+    # Assert
+    assert location == str(tmp_path / "results" / "invocation.ndjson")
+    assert [json.loads(line) for line in written_before_close.splitlines()] == [SUCCEEDED]
+    assert [json.loads(line) for line in Path(location).read_text().splitlines()] == [SUCCEEDED, FAILED]
+
+
+@patch("src.results.upload_s3_fileobj")
+def test_s3_result_sink(mock_upload_s3_fileobj: MagicMock) -> None:
+    # Arrange
+    uploaded: list[bytes] = []
+
+    def upload(bucket: str, path: str, fileobj: IO[bytes]) -> None:
+        fileobj.seek(0)
+        uploaded.append(fileobj.read())
+
+    mock_upload_s3_fileobj.side_effect = upload
+    sink = S3ResultSink("bucket", "results/invocation.ndjson")
+
+    # Act
+    sink.write(SUCCEEDED)
+    sink.write(FAILED)
+    location = sink.close()
+
+    # Assert
+    assert location == "s3://bucket/results/invocation.ndjson"
+    assert mock_upload_s3_fileobj.call_args.args[:2] == ("bucket", "results/invocation.ndjson")
+    assert [json.loads(line) for line in uploaded[0].splitlines()] == [SUCCEEDED, FAILED]
+
+
+def test_create_result_sink(tmp_path: Path) -> None:
+    # Arrange
+    current_time = datetime(2024, 5, 1, 12, 30, tzinfo=UTC)
+
+    # Act
+    none = create_result_sink(replace(SETTINGS, RESULT_SINK="none"), current_time)
+    s3_without_bucket = create_result_sink(replace(SETTINGS, RESULT_SINK="s3", RESULT_SINK_S3_BUCKET=""), current_time)
+    s3 = create_result_sink(replace(SETTINGS, RESULT_SINK="s3", RESULT_SINK_S3_BUCKET="bucket"), current_time)
+    file = create_result_sink(replace(SETTINGS, RESULT_SINK="file", RESULT_SINK_DIR=str(tmp_path)), current_time)
+
+    # Assert
+    assert none is None
+    assert s3_without_bucket is None
+    assert isinstance(s3, S3ResultSink) and s3.path.startswith("results/2024-05-01T123000-")
+    assert isinstance(file, FileResultSink) and file.path.name.startswith("2024-05-01T123000-")
+    file.close()
@@ -0,0 +1,215 @@
+import asyncio
+from dataclasses import replace
+from datetime import datetime, timezone
+import json
+import logging
+from pathlib import Path
+from typing import Any, Iterator
+from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
+
+import pytest
+
+from src.sending import send_emails
+from src.settings import SETTINGS
+from src.types import (
+    ScheduledEmail,
+    ScheduledEmailStatus,
+    WorkerOutputEmail,
+)
+
+
+def make_email() -> ScheduledEmail:
+    now_ = datetime.now(timezone.utc)
+    return ScheduledEmail(
+        pk=uuid4(),
+        created_at=now_,
+        last_updated_at=now_,
+        state=ScheduledEmailStatus.SCHEDULED,
+        scheduled_at=now_,
+        to_header=[],
+        to_header_context_json=[{"api_uri": "api:person#1", "property": "email"}],
+        from_header="",
+        reply_to_header="",
+        cc_header=[],
+        bcc_header=[],
+        subject="Hello",
+        body="Welcome!",
+        context_json={},
+        template="Welcome email",
+        attachments=[],
+    )
+
+
+def handled(email: ScheduledEmail, status: str = "succeeded", **fields: Any) -> WorkerOutputEmail:
+    output: WorkerOutputEmail = {"email": email.model_dump(mode="json"), "status": status}
+    output.update(fields)  # type: ignore[typeddict-item]
+    return output
+
+
+@pytest.fixture
+def backend() -> MagicMock:
+    backend = MagicMock()
+    backend.name = "mock"
+    return backend
+
+
+@pytest.fixture
+def mock_sending(backend: MagicMock) -> Iterator[None]:
+    """Patch parameters, delivery backend and template preloading used by `send_emails`."""
+    with (
+        patch("src.sending.get_parameter_loader") as mock_loader,
+        patch("src.sending.create_delivery_backend", return_value=backend),
+        patch("src.sending.get_render_executor") as mock_executor,
+    ):
+        mock_loader.return_value.get = AsyncMock()
+        mock_executor.return_value.preload = AsyncMock()
+        yield
+
+
+async def call_send_emails(emails: list[ScheduledEmail], controller: MagicMock, **settings: Any) -> Any:
+    with patch("src.sending.SETTINGS", replace(SETTINGS, MAILGUN_BATCH_WINDOW_MS=0, **settings)):
+        return await send_emails(emails, AsyncMock(), controller, MagicMock(), "")
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_sending")
+async def test_send_emails__full_output(backend: MagicMock) -> None:
+    # Arrange
+    controller = MagicMock()
+    emails = [make_email(), make_email()]
+
+    # Act
+    with patch("src.sending.handle_email", side_effect=lambda email, *_, **__: handled(email)) as mock_handle:
+        result = await call_send_emails(emails, controller, OUTPUT_MODE="full", RESULT_SINK="none")
+
+    # Assert
+    assert [output["email"]["pk"] for output in result["emails"]] == [str(email.pk) for email in emails]
+    assert all(output["email"]["body"] == "Welcome!" for output in result["emails"])
+    assert "results_location" not in result
+    for call in mock_handle.call_args_list:
+        assert call.args[3] is controller
+        assert call.kwargs["backend"] is backend
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_sending")
+async def test_send_emails__compact_output() -> None:
+    # Arrange
+    email = make_email()
+
+    # Act
+    with patch("src.sending.handle_email", return_value=handled(email, "failed", error="No recipients")):
+        result = await call_send_emails([email], MagicMock(), OUTPUT_MODE="compact", RESULT_SINK="none")
+
+    # Assert
+    assert result["emails"] == [
+        {
+            "pk": str(email.pk),
+            "status": "failed",
+            "duration_seconds": result["emails"][0]["duration_seconds"],
+            "error": "No recipients",
+        }
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_sending")
+async def test_send_emails__duration_seconds() -> None:
+    # Arrange
+    email = make_email()
+
+    async def handle_email(email: ScheduledEmail, *args: Any, **kwargs: Any) -> WorkerOutputEmail:
+        await asyncio.sleep(0.05)
+        return handled(email)
+
+    # Act
+    with patch("src.sending.handle_email", side_effect=handle_email):
+        result = await call_send_emails([email], MagicMock(), RESULT_SINK="none")
+
+    # Assert
+    assert 0.05 <= result["emails"][0]["duration_seconds"] < 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_sending")
+async def test_send_emails__records_written_as_emails_finish(tmp_path: Path) -> None:
+    # Arrange
+    fast, slow = make_email(), make_email()
+    release_slow = asyncio.Event()
+    written_before_slow: list[str] = []
+
+    async def handle_email(email: ScheduledEmail, *args: Any, **kwargs: Any) -> WorkerOutputEmail:
+        if email is slow:
+            await release_slow.wait()
+        return handled(email)
+
+    async def release_after_fast() -> None:
+        while not list(tmp_path.glob("*.ndjson")) or not next(tmp_path.glob("*.ndjson")).read_text():
+            await asyncio.sleep(0.01)
+        written_before_slow.extend(next(tmp_path.glob("*.ndjson")).read_text().splitlines())
+        release_slow.set()
+
+    # Act
+    with patch("src.sending.handle_email", side_effect=handle_email):
+        result, _ = await asyncio.gather(
+            call_send_emails(
+                [slow, fast], MagicMock(), OUTPUT_MODE="compact", RESULT_SINK="file", RESULT_SINK_DIR=str(tmp_path)
+            ),
+            release_after_fast(),
+        )
+
+    # Assert
+    records = [json.loads(line) for line in Path(result["results_location"]).read_text().splitlines()]
+    assert [json.loads(line)["email"]["pk"] for line in written_before_slow] == [str(fast.pk)]
+    assert [record["email"]["pk"] for record in records] == [str(fast.pk), str(slow.pk)]
+    assert all(record["email"]["body"] == "Welcome!" and "duration_seconds" in record for record in records)
+    assert Path(result["results_location"]).parent == tmp_path
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_sending")
+async def test_send_emails__results_location_when_handling_raises(
+    tmp_path: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    # Arrange
+    succeeded, broken = make_email(), make_email()
+
+    async def handle_email(email: ScheduledEmail, *args: Any, **kwargs: Any) -> WorkerOutputEmail:
+        if email is broken:
+            await asyncio.sleep(0.01)
+            raise RuntimeError("API unavailable")
+        return handled(email)
+
+    # Act
+    with (
+        patch("src.sending.handle_email", side_effect=handle_email),
+        caplog.at_level(logging.INFO, logger="amy-email-worker"),
+        pytest.raises(RuntimeError),
+    ):
+        await call_send_emails([succeeded, broken], MagicMock(), RESULT_SINK="file", RESULT_SINK_DIR=str(tmp_path))
+
+    # Assert
+    (path,) = tmp_path.glob("*.ndjson")
+    assert f"Email records written to {path}." in caplog.messages
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["email"]["pk"] for record in records] == [str(succeeded.pk)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_sending")
+async def test_send_emails__lock_requests_saved() -> None:
+    # Arrange
+    emails = [make_email(), make_email(), make_email()]
+    outputs = {
+        emails[0].pk: handled(emails[0], "failed", error="No recipients", lock_skipped=True),
+        emails[1].pk: handled(emails[1], "failed", error="Invalid template", lock_skipped=True),
+        emails[2].pk: handled(emails[2]),
+    }
+
+    # Act
+    with patch("src.sending.handle_email", side_effect=lambda email, *_, **__: outputs[email.pk]):
+        result = await call_send_emails(emails, MagicMock(), RESULT_SINK="none")
+
+    # Assert
+    assert result["lock_requests_saved"] == 2
@@ -0,0 +1,180 @@
+import asyncio
+from dataclasses import replace
+from unittest.mock import patch
+
+import pytest
+
+from src.settings import (
+    MAILGUN_KEY_PARAMETER,
+    PARAMETER_PATHS,
+    S3_BUCKET_PARAMETER,
+    SETTINGS,
+    SMTP_PARAMETER_PATHS,
+    TOKEN_PASSWORD_PARAMETER,
+    TOKEN_USERNAME_PARAMETER,
+    LocalParameterStore,
+    ParameterLoader,
+    parameter_paths,
+    read_s3_bucket_from_ssm,
+    read_settings_from_env,
+    worker_parameters,
+)
+from src.types import Credentials, DeliveryBackendKind
+
+
+@patch.dict("os.environ", {"MAILGUN_RATE_LIMIT": "-5", "MAILGUN_MAX_RATE_LIMIT": "-5"})
+def test_read_settings_from_env__negative_mailgun_rate_limit_disables_limiter() -> None:
+    # Act
+    settings = read_settings_from_env()
+
+    # Assert
+    assert settings.MAILGUN_RATE_LIMIT == 0
+    assert settings.MAILGUN_MAX_RATE_LIMIT == 0
+
+
+def test_worker_parameters() -> None:
+    # Arrange
+    values = {
+        TOKEN_USERNAME_PARAMETER: "worker",
+        TOKEN_PASSWORD_PARAMETER: "secret",
+        S3_BUCKET_PARAMETER: "attachments",
+    }
+
+    # Act
+    parameters = worker_parameters(values)
+
+    # Assert
+    assert parameters.TOKEN_CREDENTIALS == Credentials(USER="worker", PASSWORD="secret")
+    assert parameters.S3_BUCKET == "attachments"
+    # defaults for missing parameters
+    assert parameters.MAILGUN_CREDENTIALS.MAILGUN_API_KEY == "fakeKey"
+    assert parameters.SMTP_CREDENTIALS == Credentials(USER="", PASSWORD="")
+
+
+@pytest.mark.parametrize(
+    "backend,failover_backend,expected",
+    [
+        ("mailgun", None, PARAMETER_PATHS),
+        ("mailgun", "null", PARAMETER_PATHS),
+        ("smtp", None, PARAMETER_PATHS + SMTP_PARAMETER_PATHS),
+        ("mailgun", "smtp", PARAMETER_PATHS + SMTP_PARAMETER_PATHS),
+    ],
+)
+def test_parameter_paths(
+    backend: DeliveryBackendKind, failover_backend: DeliveryBackendKind | None, expected: list[str]
+) -> None:
+    # Arrange
+    settings = replace(SETTINGS, DELIVERY_BACKEND=backend, DELIVERY_FAILOVER_BACKEND=failover_backend)
+
+    # Act
+    paths = parameter_paths(settings)
+
+    # Assert
+    assert paths == expected
+
+
+@pytest.mark.asyncio
+async def test_parameter_loader__single_request() -> None:
+    # Arrange
+    store = LocalParameterStore({MAILGUN_KEY_PARAMETER: "key", S3_BUCKET_PARAMETER: "attachments"})
+    loader = ParameterLoader(store)
+
+    # Act
+    results = await asyncio.gather(loader.load(), loader.get(), loader.get())
+    later = await loader.get()
+
+    # Assert
+    assert store.requests == 1
+    assert len({id(result) for result in [*results, later]}) == 1
+    assert later.MAILGUN_CREDENTIALS.MAILGUN_API_KEY == "key"
+
+
+@pytest.mark.asyncio
+async def test_parameter_loader__load_refreshes_parameters() -> None:
+    # Arrange
+    store = LocalParameterStore({S3_BUCKET_PARAMETER: "attachments"})
+    loader = ParameterLoader(store)
+    await loader.load()
+    store.values[S3_BUCKET_PARAMETER] = "new-attachments"
+
+    # Act
+    parameters = await loader.load()
+
+    # Assert
+    assert store.requests == 2
+    assert parameters.S3_BUCKET == "new-attachments"
+
+
+@pytest.mark.asyncio
+async def test_parameter_loader__reads_all_parameters_off_event_loop() -> None:
+    # Arrange
+    requests: list[tuple[list[str], bool]] = []
+
+    class RecordingStore(LocalParameterStore):
+        def get_parameters(self, paths: list[str]) -> dict[str, str]:
+            try:
+                asyncio.get_running_loop()
+                on_event_loop = True
+            except RuntimeError:
+                on_event_loop = False
+            requests.append((paths, on_event_loop))
+            return super().get_parameters(paths)
+
+    loader = ParameterLoader(RecordingStore())
+
+    # Act
+    await loader.get()
+
+    # Assert
+    assert requests == [(PARAMETER_PATHS, False)]
+
+
+@pytest.mark.asyncio
+async def test_parameter_loader__cached_until_ttl_expires() -> None:
+    # Arrange
+    now = 1000.0
+    store = LocalParameterStore({S3_BUCKET_PARAMETER: "attachments"})
+    loader = ParameterLoader(store, ttl=300, clock=lambda: now)
+    await loader.get()
+    store.values[S3_BUCKET_PARAMETER] = "rotated-attachments"
+
+    # Act
+    now += 299
+    cached = await loader.get()
+    now += 1
+    expired = await loader.get()
+
+    # Assert
+    assert cached.S3_BUCKET == "attachments"
+    assert expired.S3_BUCKET == "rotated-attachments"
+    assert store.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_parameter_loader__invalidate() -> None:
+    # Arrange
+    store = LocalParameterStore({MAILGUN_KEY_PARAMETER: "key"})
+    loader = ParameterLoader(store, ttl=300)
+    await loader.get()
+    store.values[MAILGUN_KEY_PARAMETER] = "rotated-key"
+
+    # Act
+    loader.invalidate()
+    parameters = await loader.get()
+
+    # Assert
+    assert parameters.MAILGUN_CREDENTIALS.MAILGUN_API_KEY == "rotated-key"
+    assert store.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_read_s3_bucket_from_ssm() -> None:
+    # Arrange
+    loader = ParameterLoader(LocalParameterStore({S3_BUCKET_PARAMETER: "attachments"}))
+
+    # Act
+    with patch("src.settings.get_parameter_loader", return_value=loader):
+        bucket = await read_s3_bucket_from_ssm()
+
+    # Assert
+    assert bucket == "attachments"
@@ -1,9 +1,13 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import stat
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import httpx
 import pytest
 
-from src.token import TokenCache
+from src.token import FileTokenStore, MemoryTokenStore, TokenCache
 from src.types import AuthToken, Credentials
 
 
@@ -44,6 +48,34 @@ async def test_cached_token__fetch_token(
     }
 
 
+@pytest.mark.asyncio
+@patch("src.token.get_parameter_loader")
+@patch("src.token.read_token_credentials_from_ssm")
+async def test_cached_token__fetch_token__rotated_credentials_reloaded(
+    mock_read_token_credentials: AsyncMock,
+    mock_get_parameter_loader: MagicMock,
+) -> None:
+    # Arrange
+    client = AsyncMock()
+    cached_token = TokenCache(client)
+    mock_read_token_credentials.side_effect = [
+        Credentials(USER="test", PASSWORD="old"),
+        Credentials(USER="test", PASSWORD="new"),
+    ]
+    rejected = MagicMock(status_code=401)
+    accepted = MagicMock(status_code=200)
+    accepted.json.return_value = {"expiry": "2022-01-01T00:00:00Z", "token": "testToken"}
+    client.post.side_effect = [rejected, accepted]
+
+    # Act
+    token = await cached_token.fetch_token()
+
+    # Assert
+    assert token.token == "testToken"
+    mock_get_parameter_loader.return_value.invalidate.assert_called_once()
+    assert [call.kwargs["auth"] for call in client.post.await_args_list] == [("test", "old"), ("test", "new")]
+
+
 @pytest.mark.asyncio
 async def test_cached_token__get_token__initial_fetch_token() -> None:
     # Arrange
@@ -102,3 +134,146 @@ async def test_cached_token__get_token__cached() -> None:
     # Assert
     assert not token.has_expired(datetime.now(tz=timezone.utc), delta=timedelta(0))
     cached_token.fetch_token.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_cached_token__get_token__concurrent_callers_share_fetch() -> None:
+    # Arrange
+    client = AsyncMock()
+    cached_token = TokenCache(client)
+    new_token = AuthToken(expiry=datetime.now(tz=timezone.utc) + timedelta(hours=10), token="new")
+
+    async def fetch_token() -> AuthToken:
+        await asyncio.sleep(0.01)
+        return new_token
+
+    cached_token.fetch_token = AsyncMock(side_effect=fetch_token)  # type: ignore[method-assign]
+
+    # Act
+    tokens = await asyncio.gather(*[cached_token.get_token() for _ in range(10)])
+
+    # Assert
+    assert tokens == [new_token] * 10
+    cached_token.fetch_token.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_cached_token__get_token__refreshed_in_background_before_expiry() -> None:
+    # Arrange
+    client = AsyncMock()
+    token = AuthToken(expiry=datetime.now(tz=timezone.utc) + timedelta(seconds=30), token="old")
+    new_token = AuthToken(expiry=datetime.now(tz=timezone.utc) + timedelta(hours=10), token="new")
+    cached_token = TokenCache(client, delta=timedelta(seconds=60), token=token)
+    cached_token.fetch_token = AsyncMock(return_value=new_token)  # type: ignore[method-assign]
+
+    # Act
+    first = await cached_token.get_token()
+    second = await cached_token.get_token()
+    await asyncio.sleep(0)
+    third = await cached_token.get_token()
+
+    # Assert
+    assert first == token
+    assert second == token
+    assert third == new_token
+    cached_token.fetch_token.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_cached_token__get_token__background_refresh_failure() -> None:
+    # Arrange
+    client = AsyncMock()
+    token = AuthToken(expiry=datetime.now(tz=timezone.utc) + timedelta(seconds=30), token="old")
+    cached_token = TokenCache(client, delta=timedelta(seconds=60), token=token)
+    cached_token.fetch_token = AsyncMock(side_effect=httpx.ConnectError("unreachable"))  # type: ignore[method-assign]
+
+    # Act
+    first = await cached_token.get_token()
+    await asyncio.sleep(0)
+    second = await cached_token.get_token()
+    await asyncio.sleep(0)
+
+    # Assert
+    assert first == second == token
+    assert cached_token.fetch_token.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_token__stored_token_reused(token: AuthToken) -> None:
+    # Arrange
+    store = MemoryTokenStore()
+    store.save(token)
+    cached_token = TokenCache(AsyncMock(), store=store)
+    cached_token.fetch_token = AsyncMock()  # type: ignore[method-assign]
+
+    # Act
+    result = await cached_token.get_token()
+
+    # Assert
+    assert result == token
+    cached_token.fetch_token.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_cached_token__fetched_token_stored(token: AuthToken) -> None:
+    # Arrange
+    store = MemoryTokenStore()
+    cached_token = TokenCache(AsyncMock(), store=store)
+    cached_token.fetch_token = AsyncMock(return_value=token)  # type: ignore[method-assign]
+
+    # Act
+    await cached_token.get_token()
+    stored = store.load()
+    cached_token.invalidate()
+
+    # Assert
+    assert stored == token
+    assert store.load() is None
+
+
+@pytest.mark.asyncio
+async def test_cached_token__store_failure_doesnt_fail_fetch(token: AuthToken) -> None:
+    # Arrange
+    store = MagicMock(spec=MemoryTokenStore)
+    store.load.return_value = None
+    store.save.side_effect = OSError("No space left on device")
+    cached_token = TokenCache(AsyncMock(), store=store)
+    cached_token.fetch_token = AsyncMock(return_value=token)  # type: ignore[method-assign]
+
+    # Act
+    result = await cached_token.get_token()
+
+    # Assert
+    assert result == token
+    store.save.assert_called_once_with(token)
+
+
+def test_file_token_store__token_survives_new_store(tmp_path: Path, token: AuthToken) -> None:
+    # Arrange
+    path = tmp_path / "store" / "token"
+    FileTokenStore(str(path)).save(token)
+
+    # Act
+    result = FileTokenStore(str(path)).load()
+
+    # Assert
+    assert result == token
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_file_token_store__missing_or_unreadable_file_ignored(tmp_path: Path, token: AuthToken) -> None:
+    # Arrange
+    store = FileTokenStore(str(tmp_path / "token"))
+    missing = store.load()
+    store.path.write_text("{not json")
+
+    # Act
+    unreadable = store.load()
+    store.save(token)
+    store.clear()
+
+    # Assert
+    assert missing is None
+    assert unreadable is None
+    assert store.load() is None
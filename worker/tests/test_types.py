@@ -3,10 +3,17 @@ Most of the types defined in this project don't contain any logic.
 """
 
 from datetime import datetime, timedelta, timezone
+from uuid import uuid4
 
 import pytest
 
-from src.types import AuthToken
+from src.types import (
+    Attachment,
+    AuthToken,
+    RenderedScheduledEmail,
+    ScheduledEmail,
+    ScheduledEmailStatus,
+)
 
 
 # Arrange
@@ -44,3 +51,54 @@ def test_auth_token__has_expired(token: AuthToken, current_time: datetime, delta
     result = token.has_expired(current_time, delta)
     # Assert
     assert result == expected
+
+
+def test_rendered_scheduled_email__from_email() -> None:
+    # Arrange
+    now_ = datetime.now(tz=timezone.utc)
+    email = ScheduledEmail(
+        pk=uuid4(),
+        created_at=now_,
+        last_updated_at=now_,
+        state=ScheduledEmailStatus.LOCKED,
+        scheduled_at=now_,
+        to_header=[],
+        to_header_context_json=[],
+        from_header="team@example.org",
+        reply_to_header="",
+        cc_header=[],
+        bcc_header=[],
+        subject="Hello",
+        body="Welcome, {{ name }}!",
+        context_json={"name": "value:str#John"},
+        template="Welcome email",
+        attachments=[
+            Attachment(
+                filename="certificate.pdf",
+                s3_path="certificate.pdf",
+                s3_bucket="bucket",
+                presigned_url="",
+                presigned_url_expiration=None,
+            )
+        ],
+    )
+
+    # Act
+    result = RenderedScheduledEmail.from_email(
+        email,
+        to_header_rendered=["jdoe@example.com"],
+        subject_rendered="Hello",
+        body_rendered="Welcome, John!",
+        attachments_with_content=[],
+    )
+
+    # Assert
+    assert result == RenderedScheduledEmail(
+        **email.model_dump(),
+        to_header_rendered=["jdoe@example.com"],
+        subject_rendered="Hello",
+        body_rendered="Welcome, John!",
+        attachments_with_content=[],
+    )
+    assert result.attachments is email.attachments
+    assert result.context_json is email.context_json